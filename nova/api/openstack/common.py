@@ -26,9 +26,9 @@ from xml.dom import minidom
 from nova.api.openstack import wsgi
 from nova.api.openstack import xmlutil
 from nova.compute import task_states
-from nova.compute import utils as compute_utils
 from nova.compute import vm_states
 from nova import exception
+from nova.network import model as network_model
 from nova.openstack.common import cfg
 from nova.openstack.common import log as logging
 from nova import quota
@@ -312,15 +312,13 @@ def dict_to_query_str(params):
 
 def get_networks_for_instance_from_nw_info(nw_info):
     networks = {}
-    for vif in nw_info:
-        ips = vif.fixed_ips()
-        floaters = vif.floating_ips()
-        label = vif['network']['label']
+    for vif in network_model.vif_addresses(nw_info):
+        label = vif['network_label']
         if label not in networks:
             networks[label] = {'ips': [], 'floating_ips': []}
 
-        networks[label]['ips'].extend(ips)
-        networks[label]['floating_ips'].extend(floaters)
+        networks[label]['ips'].extend(vif['fixed_ips'])
+        networks[label]['floating_ips'].extend(vif['floating_ips'])
     return networks
 
 
@@ -334,9 +332,13 @@ def get_networks_for_instance(context, instance):
                     'floating_ips': [{'addr': '172.16.0.1', 'version': 4},
                                      {'addr': '172.16.2.1', 'version': 4}]},
          ...}
+
+    The addresses are read from the cached network info, without building
+    its model.
     """
-    nw_info = compute_utils.get_nw_info_for_instance(instance)
-    return get_networks_for_instance_from_nw_info(nw_info)
+    info_cache = instance['info_cache'] or {}
+    return get_networks_for_instance_from_nw_info(
+            info_cache.get('network_info'))
 
 
 def raise_http_conflict_for_instance_invalid_state(exc, action):
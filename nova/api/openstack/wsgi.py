@@ -27,6 +27,7 @@ import webob
 from nova import exception
 from nova.openstack.common import jsonutils
 from nova.openstack.common import log as logging
+from nova import tracing
 from nova import wsgi
 
 
@@ -890,9 +891,13 @@ class Resource(wsgi.Application):
         #            function.  If we try to audit __call__(), we can
         #            run into troubles due to the @webob.dec.wsgify()
         #            decorator.
+        context = request.environ.get('nova.context')
         try:
-            return self._process_stack(request, action, action_args,
-                                   content_type, body, accept)
+            with tracing.start_trace('api.%s' % action, context,
+                                     method=request.method,
+                                     path=request.path):
+                return self._process_stack(request, action, action_args,
+                                           content_type, body, accept)
         except expat.ExpatError:
             msg = _("Invalid XML in request body")
             return Fault(webob.exc.HTTPBadRequest(explanation=msg))
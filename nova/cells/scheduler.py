@@ -55,15 +55,15 @@ class CellsScheduler(base.Base):
 
     def _create_instances_here(self, ctxt, request_spec):
         instance_values = request_spec['instance_properties']
-        for instance_uuid in request_spec['instance_uuids']:
-            instance_values['uuid'] = instance_uuid
-            instance = self.compute_api.create_db_entry_for_new_instance(
-                    ctxt,
-                    request_spec['instance_type'],
-                    request_spec['image'],
-                    instance_values,
-                    request_spec['security_group'],
-                    request_spec['block_device_mapping'])
+        instances = self.compute_api.create_db_entries_for_new_instances(
+                ctxt,
+                request_spec['instance_type'],
+                request_spec['image'],
+                [dict(instance_values, uuid=instance_uuid)
+                 for instance_uuid in request_spec['instance_uuids']],
+                request_spec['security_group'],
+                request_spec['block_device_mapping'])
+        for instance in instances:
             self.msg_runner.instance_update_at_top(ctxt, instance)
 
     def _get_possible_cells(self):
@@ -549,13 +549,11 @@ class API(base.Base):
                 check_policy(context, 'create:forced_host', {})
                 filter_properties['force_hosts'] = [forced_host]
 
-            for i in xrange(num_instances):
-                options = base_options.copy()
-                instance = self.create_db_entry_for_new_instance(
-                        context, instance_type, image, options,
-                        security_group, block_device_mapping)
-                instances.append(instance)
-                instance_uuids.append(instance['uuid'])
+            instances = self.create_db_entries_for_new_instances(
+                    context, instance_type, image,
+                    [base_options.copy() for i in xrange(num_instances)],
+                    security_group, block_device_mapping)
+            instance_uuids = [instance['uuid'] for instance in instances]
 
         # In the case of any exceptions, attempt DB cleanup and rollback the
         # quota reservations.
@@ -607,14 +605,13 @@ class API(base.Base):
 
         return size
 
-    def _update_image_block_device_mapping(self, elevated_context,
-                                           instance_type, instance_uuid,
-                                           mappings):
-        """tell vm driver to create ephemeral/swap device at boot time by
-        updating BlockDeviceMapping
+    def _image_block_device_mapping(self, instance_type, mappings):
+        """Return the BlockDeviceMapping values making the vm driver create
+        the ephemeral/swap devices of an image's mappings at boot time
         """
+        values_list = []
         for bdm in block_device.mappings_prepend_dev(mappings):
-            LOG.debug(_("bdm %s"), bdm, instance_uuid=instance_uuid)
+            LOG.debug(_("bdm %s"), bdm)
 
             virtual_name = bdm['virtual']
             if virtual_name == 'ami' or virtual_name == 'root':
@@ -627,26 +624,23 @@ class API(base.Base):
             if size == 0:
                 continue
 
-            values = {
-                'instance_uuid': instance_uuid,
+            values_list.append({
                 'device_name': bdm['device'],
                 'virtual_name': virtual_name,
-                'volume_size': size}
-            self.db.block_device_mapping_update_or_create(elevated_context,
-                                                          values)
+                'volume_size': size})
+        return values_list
 
-    def _update_block_device_mapping(self, elevated_context,
-                                     instance_type, instance_uuid,
+    def _block_device_mapping_values(self, instance_type,
                                      block_device_mapping):
-        """tell vm driver to attach volume at boot time by updating
-        BlockDeviceMapping
+        """Return the BlockDeviceMapping values making the vm driver attach
+        volumes at boot time
         """
-        LOG.debug(_("block_device_mapping %s"), block_device_mapping,
-                  instance_uuid=instance_uuid)
+        LOG.debug(_("block_device_mapping %s"), block_device_mapping)
+        values_list = []
         for bdm in block_device_mapping:
             assert 'device_name' in bdm
 
-            values = {'instance_uuid': instance_uuid}
+            values = {}
             for key in ('device_name', 'delete_on_termination', 'virtual_name',
                         'snapshot_id', 'volume_id', 'volume_size',
                         'no_device'):
@@ -669,28 +663,51 @@ class API(base.Base):
                           'snapshot_id', 'volume_id', 'volume_size'):
                     values[k] = None
 
-            self.db.block_device_mapping_update_or_create(elevated_context,
-                                                          values)
+            values_list.append(values)
+        return values_list
 
-    def _populate_instance_for_bdm(self, context, instance, instance_type,
-            image, block_device_mapping):
-        """Populate instance block device mapping information."""
-        # FIXME(comstud): Why do the block_device_mapping DB calls
-        # require elevated context?
-        elevated = context.elevated()
-        instance_uuid = instance['uuid']
+    @staticmethod
+    def _merge_block_device_mapping(templates, values_list):
+        """Apply BlockDeviceMapping values to templates the way
+        block_device_mapping_update_or_create applies them to rows.
+        """
+        for values in values_list:
+            for template in templates:
+                if template['device_name'] == values['device_name']:
+                    template.update(values)
+                    break
+            else:
+                templates.append(dict(values))
+
+            # The same virtual device name can be specified multiple times,
+            # the last one wins.
+            virtual_name = values['virtual_name']
+            if (virtual_name is not None and
+                block_device.is_swap_or_ephemeral(virtual_name)):
+                templates[:] = [t for t in templates
+                                if t['virtual_name'] != virtual_name or
+                                t['device_name'] == values['device_name']]
+        return templates
+
+    def _block_device_mapping_templates(self, instance_type, image,
+                                        block_device_mapping):
+        """Return the BlockDeviceMapping values of new instances, without
+        their instance_uuid.
+        """
         image_properties = image.get('properties', {})
+        templates = []
         mappings = image_properties.get('mappings', [])
         if mappings:
-            self._update_image_block_device_mapping(elevated,
-                    instance_type, instance_uuid, mappings)
+            self._merge_block_device_mapping(templates,
+                    self._image_block_device_mapping(instance_type, mappings))
 
         image_bdm = image_properties.get('block_device_mapping', [])
         for mapping in (image_bdm, block_device_mapping):
             if not mapping:
                 continue
-            self._update_block_device_mapping(elevated,
-                    instance_type, instance_uuid, mapping)
+            self._merge_block_device_mapping(templates,
+                    self._block_device_mapping_values(instance_type, mapping))
+        return templates
 
     def _populate_instance_shutdown_terminate(self, instance, image,
                                               block_device_mapping):
@@ -769,29 +786,56 @@ class API(base.Base):
         This is called by the scheduler after a location for the
         instance has been determined.
         """
-        instance = self._populate_instance_for_create(base_options,
-                image, security_group)
+        return self.create_db_entries_for_new_instances(context,
+                instance_type, image, [base_options], security_group,
+                block_device_mapping)[0]
 
-        self._populate_instance_names(instance)
+    def create_db_entries_for_new_instances(self, context, instance_type,
+            image, instances_options, security_group, block_device_mapping):
+        """Create the DB entries of new instances, one for each dict of
+        base options in instances_options.
 
-        self._populate_instance_shutdown_terminate(instance, image,
-                                                   block_device_mapping)
+        The security groups and block device mappings are worked out once
+        for all of them, and their rows are inserted together.
+        """
+        instances = []
+        for base_options in instances_options:
+            instance = self._populate_instance_for_create(base_options,
+                    image, security_group)
+
+            self._populate_instance_names(instance)
+
+            self._populate_instance_shutdown_terminate(instance, image,
+                                                       block_device_mapping)
+            instances.append(instance)
 
-        # ensure_default security group is called before the instance
-        # is created so the creation of the default security group is
+        # ensure_default security group is called before the instances
+        # are created so the creation of the default security group is
         # proxied to the sgh.
         self.security_group_api.ensure_default(context)
-        instance = self.db.instance_create(context, instance)
+        instances = self.db.instance_create_multi(context, instances)
 
-        self._populate_instance_for_bdm(context, instance,
-                instance_type, image, block_device_mapping)
+        try:
+            templates = self._block_device_mapping_templates(instance_type,
+                    image, block_device_mapping)
+            if templates:
+                # FIXME(comstud): Why do the block_device_mapping DB calls
+                # require elevated context?
+                self.db.block_device_mapping_create_multi(context.elevated(),
+                        [dict(template, instance_uuid=inst['uuid'])
+                         for inst in instances
+                         for template in templates])
+        except Exception:
+            with excutils.save_and_reraise_exception():
+                for instance in instances:
+                    self.db.instance_destroy(context, instance['uuid'])
 
         # send a state update notification for the initial create to
         # show it going from non-existent to BUILDING
-        notifications.send_update_with_states(context, instance, None,
+        notifications.send_updates_with_states(context, instances, None,
                 vm_states.BUILDING, None, None, service="api")
 
-        return instance
+        return instances
 
     def _check_create_policies(self, context, availability_zone,
             requested_networks, block_device_mapping):
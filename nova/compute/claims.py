@@ -18,8 +18,8 @@ Claim objects for use with resource tracking.
 """
 
 from nova.openstack.common import jsonutils
-from nova.openstack.common import lockutils
 from nova.openstack.common import log as logging
+from nova import utils
 
 LOG = logging.getLogger(__name__)
 COMPUTE_RESOURCE_SEMAPHORE = "compute_resources"
@@ -86,7 +86,7 @@ class Claim(NopClaim):
     def vcpus(self):
         return self.instance['vcpus']
 
-    @lockutils.synchronized(COMPUTE_RESOURCE_SEMAPHORE, 'nova-')
+    @utils.synchronized(COMPUTE_RESOURCE_SEMAPHORE)
     def abort(self):
         """Compute operation requiring claimed resources has failed or
         been aborted.
@@ -210,7 +210,7 @@ class ResizeClaim(Claim):
     def vcpus(self):
         return self.instance_type['vcpus']
 
-    @lockutils.synchronized(COMPUTE_RESOURCE_SEMAPHORE, 'nova-')
+    @utils.synchronized(COMPUTE_RESOURCE_SEMAPHORE)
     def abort(self):
         """Compute operation requiring claimed resources has failed or
         been aborted.
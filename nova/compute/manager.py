@@ -63,7 +63,6 @@ from nova.openstack.common import cfg
 from nova.openstack.common import excutils
 from nova.openstack.common import importutils
 from nova.openstack.common import jsonutils
-from nova.openstack.common import lockutils
 from nova.openstack.common import log as logging
 from nova.openstack.common.notifier import api as notifier
 from nova.openstack.common import rpc
@@ -72,6 +71,7 @@ from nova.openstack.common import timeutils
 from nova import paths
 from nova import quota
 from nova.scheduler import rpcapi as scheduler_rpcapi
+from nova import tracing
 from nova import utils
 from nova.virt import driver
 from nova.virt import storage_users
@@ -115,6 +115,10 @@ interval_opts = [
                default=60,
                help="Number of seconds between instance info_cache self "
                         "healing updates"),
+    cfg.IntOpt("heal_instance_info_cache_batch_size",
+               default=50,
+               help="Number of instances whose info_cache is healed on "
+                    "each update"),
     cfg.IntOpt('host_state_interval',
                default=120,
                help='Interval in seconds for querying the host status'),
@@ -937,6 +941,7 @@ class ComputeManager(manager.SchedulerDependentManager):
                               expected_task_state=(task_states.SCHEDULING,
                                                    None))
 
+    @tracing.traced('compute.allocate_network')
     def _allocate_network(self, context, instance, requested_networks):
         """Allocate networks for an instance and return the network info."""
         self._instance_update(context, instance['uuid'],
@@ -959,6 +964,7 @@ class ComputeManager(manager.SchedulerDependentManager):
 
         return network_info
 
+    @tracing.traced('compute.prep_block_device')
     def _prep_block_device(self, context, instance, bdms):
         """Set up the block device for an instance with error logging."""
         self._instance_update(context, instance['uuid'],
@@ -971,6 +977,7 @@ class ComputeManager(manager.SchedulerDependentManager):
                           instance=instance)
             raise
 
+    @tracing.traced('compute.spawn')
     def _spawn(self, context, instance, image_meta, network_info,
                block_device_info, injected_files, admin_password):
         """Spawn an instance with error logging and update its power state."""
@@ -1071,7 +1078,7 @@ class ComputeManager(manager.SchedulerDependentManager):
         if injected_files is None:
             injected_files = []
 
-        @lockutils.synchronized(instance['uuid'], 'nova-')
+        @utils.synchronized(instance['uuid'])
         def do_run_instance():
             self._run_instance(context, request_spec,
                     filter_properties, requested_networks, injected_files,
@@ -1181,7 +1188,7 @@ class ComputeManager(manager.SchedulerDependentManager):
         if not bdms:
             bdms = self._get_instance_volume_bdms(context, instance)
 
-        @lockutils.synchronized(instance['uuid'], 'nova-')
+        @utils.synchronized(instance['uuid'])
         def do_terminate_instance(instance, bdms):
             try:
                 self._delete_instance(context, instance, bdms)
@@ -2472,7 +2479,7 @@ class ComputeManager(manager.SchedulerDependentManager):
     def reserve_block_device_name(self, context, instance, device,
                                   volume_id=None):
 
-        @lockutils.synchronized(instance['uuid'], 'nova-')
+        @utils.synchronized(instance['uuid'])
         def do_reserve():
             result = compute_utils.get_device_name_for_instance(context,
                                                                 instance,
@@ -2963,15 +2970,19 @@ class ComputeManager(manager.SchedulerDependentManager):
 
     @manager.periodic_task
     def _heal_instance_info_cache(self, context):
-        """Called periodically.  On every call, try to update the
-        info_cache's network information for another instance by
-        calling to the network manager.
-
-        This is implemented by keeping a cache of uuids of instances
-        that live on this host.  On each call, we pop one off of a
-        list, pull the DB record, and try the call to the network API.
-        If anything errors, we don't care.  It's possible the instance
-        has been deleted, etc.
+        """Called periodically.  On every call, update the info_cache's
+        network information for the next heal_instance_info_cache_batch_size
+        instances by calling to the network manager.
+
+        This is implemented by keeping a list of uuids of instances that
+        live on this host.  On each call, we take a batch off of it, pull
+        their DB records together, and get their network info in one call
+        to the network API.  If anything errors, we don't care.  It's
+        possible an instance has been deleted, etc.
+
+        Changes the network API makes itself, like associating floating
+        IPs, update the caches as they happen.  This catches what they
+        miss.
         """
         heal_interval = CONF.heal_instance_info_cache_interval
         if not heal_interval:
@@ -2981,38 +2992,48 @@ class ComputeManager(manager.SchedulerDependentManager):
             return
         self._last_info_cache_heal = curr_time
 
+        batch_size = max(1, CONF.heal_instance_info_cache_batch_size)
         instance_uuids = getattr(self, '_instance_uuids_to_heal', None)
-        instance = None
-
-        while not instance or instance['host'] != self.host:
-            if instance_uuids:
-                try:
-                    instance = self.conductor_api.instance_get_by_uuid(context,
-                        instance_uuids.pop(0))
-                except exception.InstanceNotFound:
-                    # Instance is gone.  Try to grab another.
-                    continue
-            else:
-                # No more in our copy of uuids.  Pull from the DB.
-                db_instances = self.conductor_api.instance_get_all_by_host(
-                        context, self.host)
-                if not db_instances:
-                    # None.. just return.
-                    return
-                instance = db_instances.pop(0)
-                instance_uuids = [inst['uuid'] for inst in db_instances]
-                self._instance_uuids_to_heal = instance_uuids
+        if instance_uuids:
+            batch_uuids = instance_uuids[:batch_size]
+            del instance_uuids[:batch_size]
+            # Instances that are gone or have moved are left out
+            instances = self.conductor_api.instance_get_all_by_filters(
+                    context, {'uuid': batch_uuids})
+            instances = [instance for instance in instances
+                         if instance['host'] == self.host]
+        else:
+            # No more in our copy of uuids.  Pull from the DB.
+            instances = self.conductor_api.instance_get_all_by_host(
+                    context, self.host)
+            self._instance_uuids_to_heal = [instance['uuid'] for instance in
+                                            instances[batch_size:]]
+            instances = instances[:batch_size]
+        if not instances:
+            return
 
-        # We have an instance now and it's ours
         try:
-            # Call to network API to get instance info.. this will
-            # force an update to the instance's info_cache
-            self._get_instance_nw_info(context, instance)
-            LOG.debug(_('Updated the info_cache for instance'),
-                      instance=instance)
+            # Get the network info from network API, but don't let it
+            # update the cache, as that will hit the DB.  We'll update
+            # the cache ourselves via the conductor.
+            nw_infos = self.network_api.get_instances_nw_info(context,
+                    instances, update_cache=False)
         except Exception:
             # We don't care about any failures
-            pass
+            return
+        for instance in instances:
+            network_info = nw_infos.get(instance['uuid'])
+            if network_info is None:
+                continue
+            try:
+                cache = {'network_info': network_info.json()}
+                self.conductor_api.instance_info_cache_update(context,
+                                                              instance,
+                                                              cache)
+                LOG.debug(_('Updated the info_cache for instance'),
+                          instance=instance)
+            except Exception:
+                pass
 
     @manager.periodic_task
     def _poll_rebooting_instances(self, context):
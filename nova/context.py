@@ -26,6 +26,7 @@ from nova.openstack.common import local
 from nova.openstack.common import log as logging
 from nova.openstack.common import timeutils
 from nova import policy
+from nova import tracing
 
 
 LOG = logging.getLogger(__name__)
@@ -46,7 +47,8 @@ class RequestContext(object):
                  roles=None, remote_address=None, timestamp=None,
                  request_id=None, auth_token=None, overwrite=True,
                  quota_class=None, user_name=None, project_name=None,
-                 service_catalog=None, instance_lock_checked=False, **kwargs):
+                 service_catalog=None, instance_lock_checked=False,
+                 trace=None, **kwargs):
         """
         :param read_deleted: 'no' indicates deleted records are hidden, 'yes'
             indicates deleted records are visible, 'only' indicates that
@@ -55,6 +57,9 @@ class RequestContext(object):
         :param overwrite: Set to False to ensure that the greenthread local
             copy of the index is not overwritten.
 
+        :param trace: The sampled trace the request is part of, if any.
+            See nova.tracing.
+
         :param kwargs: Extra arguments that might be present, but we ignore
             because they possibly came in from older rpc messages.
         """
@@ -88,6 +93,7 @@ class RequestContext(object):
         self.quota_class = quota_class
         self.user_name = user_name
         self.project_name = project_name
+        self.trace = trace
 
         if overwrite or not hasattr(local.store, 'context'):
             self.update_store()
@@ -111,22 +117,29 @@ class RequestContext(object):
         local.store.context = self
 
     def to_dict(self):
-        return {'user_id': self.user_id,
-                'project_id': self.project_id,
-                'is_admin': self.is_admin,
-                'read_deleted': self.read_deleted,
-                'roles': self.roles,
-                'remote_address': self.remote_address,
-                'timestamp': timeutils.strtime(self.timestamp),
-                'request_id': self.request_id,
-                'auth_token': self.auth_token,
-                'quota_class': self.quota_class,
-                'user_name': self.user_name,
-                'service_catalog': self.service_catalog,
-                'project_name': self.project_name,
-                'instance_lock_checked': self.instance_lock_checked,
-                'tenant': self.tenant,
-                'user': self.user}
+        values = {'user_id': self.user_id,
+                  'project_id': self.project_id,
+                  'is_admin': self.is_admin,
+                  'read_deleted': self.read_deleted,
+                  'roles': self.roles,
+                  'remote_address': self.remote_address,
+                  'timestamp': timeutils.strtime(self.timestamp),
+                  'request_id': self.request_id,
+                  'auth_token': self.auth_token,
+                  'quota_class': self.quota_class,
+                  'user_name': self.user_name,
+                  'service_catalog': self.service_catalog,
+                  'project_name': self.project_name,
+                  'instance_lock_checked': self.instance_lock_checked,
+                  'tenant': self.tenant,
+                  'user': self.user}
+        # The current span, if any, becomes the parent of the spans of the
+        # receiver. Left out unless set, so nodes that don't know about
+        # traces don't warn about dropping it
+        trace = tracing.get_trace(self)
+        if trace:
+            values['trace'] = trace
+        return values
 
     @classmethod
     def from_dict(cls, values):
@@ -47,6 +47,7 @@ from nova.cells import rpcapi as cells_rpcapi
 from nova import exception
 from nova.openstack.common import cfg
 from nova.openstack.common import log as logging
+from nova import tracing
 from nova import utils
 
 
@@ -68,8 +69,9 @@ db_opts = [
 CONF = cfg.CONF
 CONF.register_opts(db_opts)
 
-IMPL = utils.LazyPluggable('db_backend',
-                           sqlalchemy='nova.db.sqlalchemy.api')
+# Calls made in a sampled trace are timed
+IMPL = tracing.TracedProxy(utils.LazyPluggable('db_backend',
+                               sqlalchemy='nova.db.sqlalchemy.api'), 'db.')
 LOG = logging.getLogger(__name__)
 
 
@@ -509,6 +511,11 @@ def fixed_ips_by_virtual_interface(context, vif_id):
     return IMPL.fixed_ips_by_virtual_interface(context, vif_id)
 
 
+def fixed_ips_by_address_filter(context, address=None, address_like=None):
+    """Get fixed ips of instances by exact address or LIKE pattern."""
+    return IMPL.fixed_ips_by_address_filter(context, address, address_like)
+
+
 def fixed_ip_update(context, address, values):
     """Create a fixed ip from the values dictionary."""
     return IMPL.fixed_ip_update(context, address, values)
@@ -541,6 +548,11 @@ def virtual_interface_get_by_instance(context, instance_id):
     return IMPL.virtual_interface_get_by_instance(context, instance_id)
 
 
+def virtual_interface_get_by_instances(context, instance_uuids):
+    """Gets all virtual_interfaces for instances."""
+    return IMPL.virtual_interface_get_by_instances(context, instance_uuids)
+
+
 def virtual_interface_get_by_instance_and_network(context, instance_id,
                                                            network_id):
     """Gets all virtual interfaces for instance."""
@@ -564,6 +576,11 @@ def virtual_interface_get_all(context):
     return IMPL.virtual_interface_get_all(context)
 
 
+def virtual_interface_get_all_with_ipv6(context):
+    """Gets all instance vifs on networks with an ipv6 cidr."""
+    return IMPL.virtual_interface_get_all_with_ipv6(context)
+
+
 ####################
 
 
@@ -572,6 +589,11 @@ def instance_create(context, values):
     return IMPL.instance_create(context, values)
 
 
+def instance_create_multi(context, values_list):
+    """Create instances from a list of values dictionaries."""
+    return IMPL.instance_create_multi(context, values_list)
+
+
 def instance_data_get_for_project(context, project_id, session=None):
     """Get (instance_count, total_cores, total_ram) for project."""
     return IMPL.instance_data_get_for_project(context, project_id,
@@ -1082,6 +1104,11 @@ def block_device_mapping_create(context, values):
     return IMPL.block_device_mapping_create(context, values)
 
 
+def block_device_mapping_create_multi(context, values_list):
+    """Create entries of block device mapping from a list of values."""
+    return IMPL.block_device_mapping_create_multi(context, values_list)
+
+
 def block_device_mapping_update(context, bdm_id, values):
     """Update an entry of block device mapping."""
     return IMPL.block_device_mapping_update(context, bdm_id, values)
@@ -1733,3 +1760,25 @@ def task_log_get(context, task_name, period_beginning,
                  period_ending, host, state=None, session=None):
     return IMPL.task_log_get(context, task_name, period_beginning,
                  period_ending, host, state, session)
+
+
+####################
+
+
+def archive_deleted_rows(context, max_rows=None):
+    """Move up to max_rows deleted rows from production tables to the
+    corresponding shadow tables.
+
+    :returns: number of rows archived.
+    """
+    return IMPL.archive_deleted_rows(context, max_rows=max_rows)
+
+
+def archive_deleted_rows_for_table(context, tablename, max_rows=None):
+    """Move up to max_rows deleted rows from tablename to the corresponding
+    shadow table.
+
+    :returns: number of rows archived.
+    """
+    return IMPL.archive_deleted_rows_for_table(context, tablename,
+                                               max_rows=max_rows)
@@ -23,16 +23,22 @@ import collections
 import copy
 import datetime
 import functools
+import itertools
+import random
 import uuid
 
 from sqlalchemy import and_
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.exc import NoSuchTableError
+from sqlalchemy import MetaData
 from sqlalchemy import or_
 from sqlalchemy.orm import joinedload
 from sqlalchemy.orm import joinedload_all
 from sqlalchemy.sql.expression import asc
 from sqlalchemy.sql.expression import desc
+from sqlalchemy.sql.expression import select
 from sqlalchemy.sql import func
+from sqlalchemy import Table
 
 from nova import block_device
 from nova.common.sqlalchemyutils import paginate_query
@@ -40,6 +46,7 @@ from nova.compute import task_states
 from nova.compute import vm_states
 from nova import db
 from nova.db.sqlalchemy import models
+from nova.db.sqlalchemy.session import get_engine
 from nova.db.sqlalchemy.session import get_session
 from nova import exception
 from nova.openstack.common import cfg
@@ -253,6 +260,76 @@ def exact_filter(query, model, filters, legal_keys):
     return query
 
 
+def _claim_row(context, model, free_filters, row_id, values, session):
+    """Apply values to row_id if it still matches free_filters.
+
+    Returns the number of rows updated, 0 if the row was taken meanwhile.
+    """
+    with session.begin():
+        query = model_query(context, model, session=session,
+                            read_deleted="no").\
+                filter_by(id=row_id)
+        for criterion in free_filters:
+            query = query.filter(criterion)
+        return query.update(values, synchronize_session=False)
+
+
+def _claim_free_row(context, model, free_filters, values, session=None,
+                    num_candidates=10):
+    """Atomically claim one row matching free_filters by applying values.
+
+    The lowest free row is tried first, which is what an uncontended caller
+    gets. Rather than locking it, which every concurrent caller would queue
+    on, rows are claimed with an UPDATE that only matches while the row is
+    still free. After losing a race, candidates are read from a random
+    starting id so concurrent callers spread over the free rows.
+
+    Returns the claimed row's (id, address), or None if no row is free.
+    """
+    session = session or get_session()
+
+    def free_query():
+        query = model_query(context, model, session=session,
+                            read_deleted="no").\
+                with_entities(model.id, model.address)
+        for criterion in free_filters:
+            query = query.filter(criterion)
+        return query
+
+    candidate = free_query().order_by(asc(model.id)).first()
+    if not candidate:
+        return None
+    if _claim_row(context, model, free_filters, candidate[0], values,
+                  session):
+        return candidate
+
+    while True:
+        min_id, max_id = free_query().\
+                with_entities(func.min(model.id), func.max(model.id)).\
+                first()
+        if min_id is None:
+            return None
+
+        pivot = random.randint(min_id, max_id)
+        candidates = free_query().\
+                filter(model.id >= pivot).\
+                order_by(asc(model.id)).\
+                limit(num_candidates).\
+                all()
+        if len(candidates) < num_candidates:
+            candidates += free_query().\
+                    filter(model.id < pivot).\
+                    order_by(asc(model.id)).\
+                    limit(num_candidates - len(candidates)).\
+                    all()
+        random.shuffle(candidates)
+
+        for candidate in candidates:
+            if _claim_row(context, model, free_filters, candidate[0], values,
+                          session):
+                return candidate
+
+
 ###################
 
 
@@ -668,41 +745,57 @@ def floating_ip_get_pools(context):
 @require_context
 def floating_ip_allocate_address(context, project_id, pool):
     authorize_project_context(context, project_id)
-    session = get_session()
-    with session.begin():
-        floating_ip_ref = model_query(context, models.FloatingIp,
-                                      session=session, read_deleted="no").\
-                                  filter_by(fixed_ip_id=None).\
-                                  filter_by(project_id=None).\
-                                  filter_by(pool=pool).\
-                                  with_lockmode('update').\
-                                  first()
-        # NOTE(vish): if with_lockmode isn't supported, as in sqlite,
-        #             then this has concurrency issues
-        if not floating_ip_ref:
-            raise exception.NoMoreFloatingIps()
-        floating_ip_ref['project_id'] = project_id
-        session.add(floating_ip_ref)
-    return floating_ip_ref['address']
+    free_filters = [models.FloatingIp.fixed_ip_id == None,
+                    models.FloatingIp.project_id == None,
+                    models.FloatingIp.pool == pool]
+    claimed = _claim_free_row(context, models.FloatingIp, free_filters,
+                              {'project_id': project_id})
+    if not claimed:
+        raise exception.NoMoreFloatingIps()
+    return claimed[1]
 
 
 @require_context
 def floating_ip_bulk_create(context, ips):
-    existing_ips = {}
-    for floating in _floating_ip_get_all(context).all():
-        existing_ips[floating['address']] = floating
-
     session = get_session()
     with session.begin():
-        for ip in ips:
-            addr = ip['address']
-            if (addr in existing_ips and
-                ip.get('id') != existing_ips[addr]['id']):
-                raise exception.FloatingIpExists(**dict(existing_ips[addr]))
-
-            model = models.FloatingIp()
-            model.update(ip)
-            session.add(model)
+        for chunk in _chunks(ips):
+            addresses = [ip['address'] for ip in chunk]
+            existing_ips = {}
+            for floating in _floating_ip_get_all(context, session=session).\
+                    filter(models.FloatingIp.address.in_(addresses)):
+                existing_ips[floating['address']] = floating
+
+            for ip in chunk:
+                floating = existing_ips.get(ip['address'])
+                if floating and ip.get('id') != floating['id']:
+                    raise exception.FloatingIpExists(**dict(floating))
+            _bulk_insert(session, models.FloatingIp, chunk)
+
+
+def _chunks(iterable, chunk_size=1000):
+    """Yields lists of at most chunk_size items from iterable."""
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+
+    if chunk:
+        yield chunk
+
+
+def _bulk_insert(session, model, rows):
+    """Insert a list of column dicts with executemany statements.
+
+    This skips building an ORM object per row, which dominates the cost of
+    creating large networks and floating ip ranges. Column defaults such as
+    created_at and deleted are still applied. Consecutive rows setting the
+    same columns share a statement, so rows keep their order.
+    """
+    for columns, column_rows in itertools.groupby(rows, key=frozenset):
+        session.execute(model.__table__.insert(), list(column_rows))
 
 
 def _ip_range_splitter(ips, block_size=256):
@@ -1032,33 +1125,22 @@ def fixed_ip_associate_pool(context, network_id, instance_uuid=None,
     if instance_uuid and not uuidutils.is_uuid_like(instance_uuid):
         raise exception.InvalidUUID(uuid=instance_uuid)
 
-    session = get_session()
-    with session.begin():
-        network_or_none = or_(models.FixedIp.network_id == network_id,
-                              models.FixedIp.network_id == None)
-        fixed_ip_ref = model_query(context, models.FixedIp, session=session,
-                                   read_deleted="no").\
-                               filter(network_or_none).\
-                               filter_by(reserved=False).\
-                               filter_by(instance_uuid=None).\
-                               filter_by(host=None).\
-                               with_lockmode('update').\
-                               first()
-        # NOTE(vish): if with_lockmode isn't supported, as in sqlite,
-        #             then this has concurrency issues
-        if not fixed_ip_ref:
-            raise exception.NoMoreFixedIps()
-
-        if fixed_ip_ref['network_id'] is None:
-            fixed_ip_ref['network'] = network_id
-
-        if instance_uuid:
-            fixed_ip_ref['instance_uuid'] = instance_uuid
+    network_or_none = or_(models.FixedIp.network_id == network_id,
+                          models.FixedIp.network_id == None)
+    free_filters = [network_or_none,
+                    models.FixedIp.reserved == False,
+                    models.FixedIp.instance_uuid == None,
+                    models.FixedIp.host == None]
+    values = {'network_id': network_id}
+    if instance_uuid:
+        values['instance_uuid'] = instance_uuid
+    if host:
+        values['host'] = host
 
-        if host:
-            fixed_ip_ref['host'] = host
-        session.add(fixed_ip_ref)
-    return fixed_ip_ref['address']
+    claimed = _claim_free_row(context, models.FixedIp, free_filters, values)
+    if not claimed:
+        raise exception.NoMoreFixedIps()
+    return claimed[1]
 
 
 @require_context
@@ -1073,10 +1155,8 @@ def fixed_ip_create(context, values):
 def fixed_ip_bulk_create(context, ips):
     session = get_session()
     with session.begin():
-        for ip in ips:
-            model = models.FixedIp()
-            model.update(ip)
-            session.add(model)
+        for chunk in _chunks(ips):
+            _bulk_insert(session, models.FixedIp, chunk)
 
 
 @require_context
@@ -1232,6 +1312,52 @@ def fixed_ips_by_virtual_interface(context, vif_id):
     return result
 
 
+@require_context
+def fixed_ips_by_address_filter(context, address=None, address_like=None):
+    """Get the fixed ips of instances matching an address filter.
+
+    A fixed ip matches if its address equals `address`, or if either it or
+    one of its floating ips is LIKE `address_like`.
+
+    :returns: a list of dicts with instance_uuid, address and
+              floating_address keys, ordered by vif, fixed ip and floating
+              ip id. floating_address is None for fixed ips without one.
+    """
+    criteria = []
+    if address is not None:
+        criteria.append(models.FixedIp.address == address)
+    if address_like is not None:
+        criteria.append(models.FixedIp.address.like(address_like,
+                                                     escape='\\'))
+        criteria.append(models.FloatingIp.address.like(address_like,
+                                                       escape='\\'))
+    if not criteria:
+        return []
+
+    session = get_session()
+    rows = session.query(models.VirtualInterface.instance_uuid,
+                         models.FixedIp.address,
+                         models.FloatingIp.address).\
+        join((models.FixedIp,
+              models.FixedIp.virtual_interface_id ==
+              models.VirtualInterface.id)).\
+        outerjoin((models.FloatingIp,
+                   and_(models.FloatingIp.fixed_ip_id == models.FixedIp.id,
+                        models.FloatingIp.deleted == False))).\
+        filter(models.FixedIp.deleted == False).\
+        filter(models.VirtualInterface.instance_uuid != None).\
+        filter(or_(*criteria)).\
+        order_by(models.VirtualInterface.id,
+                 models.FixedIp.id,
+                 models.FloatingIp.id).\
+        all()
+
+    return [{'instance_uuid': instance_uuid,
+             'address': fixed_address,
+             'floating_address': floating_address}
+            for instance_uuid, fixed_address, floating_address in rows]
+
+
 @require_context
 def fixed_ip_update(context, address, values):
     session = get_session()
@@ -1317,6 +1443,20 @@ def virtual_interface_get_by_instance(context, instance_uuid):
     return vif_refs
 
 
+@require_context
+def virtual_interface_get_by_instances(context, instance_uuids):
+    """Gets all virtual interfaces for instances.
+
+    :param instance_uuids: = uuids of the instances to retrieve vifs for
+    """
+    if not instance_uuids:
+        return []
+    return _virtual_interface_query(context).\
+                    filter(models.VirtualInterface.instance_uuid.in_(
+                            instance_uuids)).\
+                    all()
+
+
 @require_context
 def virtual_interface_get_by_instance_and_network(context, instance_uuid,
                                                   network_id):
@@ -1358,6 +1498,31 @@ def virtual_interface_get_all(context):
     return vif_refs
 
 
+@require_context
+def virtual_interface_get_all_with_ipv6(context):
+    """Get the vifs of instances on networks that have an ipv6 cidr.
+
+    :returns: a list of dicts with instance_uuid, address (the vif mac) and
+              cidr_v6 keys, ordered by vif id.
+    """
+    session = get_session()
+    rows = session.query(models.VirtualInterface.instance_uuid,
+                         models.VirtualInterface.address,
+                         models.Network.cidr_v6).\
+        join((models.Network,
+              models.Network.id == models.VirtualInterface.network_id)).\
+        filter(models.Network.deleted == False).\
+        filter(models.Network.cidr_v6 != None).\
+        filter(models.VirtualInterface.instance_uuid != None).\
+        order_by(models.VirtualInterface.id).\
+        all()
+
+    return [{'instance_uuid': instance_uuid,
+             'address': address,
+             'cidr_v6': cidr_v6}
+            for instance_uuid, address, cidr_v6 in rows]
+
+
 ###################
 
 
@@ -1373,6 +1538,10 @@ def _metadata_refs(metadata_dict, meta_class):
 
 
 def _validate_unique_server_name(context, session, name):
+    _validate_unique_server_names(context, session, [name])
+
+
+def _validate_unique_server_names(context, session, names):
     if not CONF.osapi_compute_unique_server_name_scope:
         return
 
@@ -1394,10 +1563,41 @@ def _validate_unique_server_name(context, session, name):
         LOG.warn(msg)
         return
 
-    lowername = name.lower()
-    for instance in instance_list:
-        if instance['hostname'].lower() == lowername:
-            raise exception.InstanceExists(name=instance['hostname'])
+    taken = set(instance['hostname'].lower() for instance in instance_list)
+    for name in names:
+        lowername = name.lower()
+        if lowername in taken:
+            raise exception.InstanceExists(name=name)
+        taken.add(lowername)
+
+
+def _security_group_get_models(context, session, security_groups):
+    models = []
+    _existed, default_group = security_group_ensure_default(context,
+        session=session)
+    if 'default' in security_groups:
+        models.append(default_group)
+        # Generate a new list, so we don't modify the original
+        security_groups = [x for x in security_groups if x != 'default']
+    if security_groups:
+        models.extend(_security_group_get_by_names(context,
+                session, context.project_id, security_groups))
+    return models
+
+
+def _insert_rows(session, model, rows):
+    """Insert rows of model with one multi-row statement per set of columns.
+
+    Keys of the rows that aren't columns are left out.
+    """
+    columns = set(column.name for column in model.__table__.columns)
+    rows_by_columns = {}
+    for row in rows:
+        row = dict((key, value) for key, value in row.iteritems()
+                   if key in columns)
+        rows_by_columns.setdefault(tuple(sorted(row)), []).append(row)
+    for column_rows in rows_by_columns.itervalues():
+        session.execute(model.__table__.insert(), column_rows)
 
 
 @require_context
@@ -1424,25 +1624,12 @@ def instance_create(context, values):
     security_groups = values.pop('security_groups', [])
     instance_ref.update(values)
 
-    def _get_sec_group_models(session, security_groups):
-        models = []
-        _existed, default_group = security_group_ensure_default(context,
-            session=session)
-        if 'default' in security_groups:
-            models.append(default_group)
-            # Generate a new list, so we don't modify the original
-            security_groups = [x for x in security_groups if x != 'default']
-        if security_groups:
-            models.extend(_security_group_get_by_names(context,
-                    session, context.project_id, security_groups))
-        return models
-
     session = get_session()
     with session.begin():
         if 'hostname' in values:
             _validate_unique_server_name(context, session, values['hostname'])
-        instance_ref.security_groups = _get_sec_group_models(session,
-                security_groups)
+        instance_ref.security_groups = _security_group_get_models(context,
+                session, security_groups)
         instance_ref.save(session=session)
         # NOTE(comstud): This forces instance_type to be loaded so it
         # exists in the ref when we return.  Fixes lazy loading issues.
@@ -1454,6 +1641,81 @@ def instance_create(context, values):
     return instance_ref
 
 
+@require_context
+def instance_create_multi(context, values_list):
+    """Create several Instance records in the database at once.
+
+    The instances and their metadata, system metadata, info caches,
+    security group associations and ec2 id mappings are inserted in one
+    transaction, with one multi-row statement per table.
+
+    context - request context object
+    values_list - list of dicts containing column values.
+    """
+    instance_rows = []
+    metadata_rows = []
+    system_metadata_rows = []
+    info_cache_rows = []
+    security_groups = []
+    for values in values_list:
+        values = values.copy()
+        if not values.get('uuid'):
+            values['uuid'] = str(uuid.uuid4())
+        instance_uuid = values['uuid']
+        for rows, key in ((metadata_rows, 'metadata'),
+                          (system_metadata_rows, 'system_metadata')):
+            for k, v in (values.pop(key, None) or {}).iteritems():
+                rows.append({'instance_uuid': instance_uuid,
+                             'key': k, 'value': v})
+        info_cache = dict(values.pop('info_cache', None) or {})
+        info_cache['instance_uuid'] = instance_uuid
+        info_cache_rows.append(info_cache)
+        security_groups.append((instance_uuid,
+                                values.pop('security_groups', [])))
+        instance_rows.append(values)
+
+    uuids = [row['uuid'] for row in instance_rows]
+    session = get_session()
+    with session.begin():
+        _validate_unique_server_names(context, session,
+                [row['hostname'] for row in instance_rows
+                 if 'hostname' in row])
+
+        # Instances booted together ask for the same groups
+        group_ids = {}
+        association_rows = []
+        for instance_uuid, names in security_groups:
+            key = tuple(sorted(set(names)))
+            if key not in group_ids:
+                group_ids[key] = [group.id for group in
+                        _security_group_get_models(context, session,
+                                                   list(key))]
+            association_rows.extend({'security_group_id': group_id,
+                                     'instance_uuid': instance_uuid}
+                                    for group_id in group_ids[key])
+
+        _insert_rows(session, models.Instance, instance_rows)
+        _insert_rows(session, models.InstanceMetadata, metadata_rows)
+        _insert_rows(session, models.InstanceSystemMetadata,
+                     system_metadata_rows)
+        _insert_rows(session, models.InstanceInfoCache, info_cache_rows)
+        _insert_rows(session, models.SecurityGroupInstanceAssociation,
+                     association_rows)
+        # create the instance uuid to ec2_id mapping entries
+        _insert_rows(session, models.InstanceIdMapping,
+                     [{'uuid': instance_uuid} for instance_uuid in uuids])
+
+        instances = {}
+        # Stay below the number of parameters a statement can have
+        for i in xrange(0, len(uuids), 500):
+            query = _build_instance_get(context, session=session).\
+                        filter(models.Instance.uuid.in_(uuids[i:i + 500]))
+            for instance_ref in query.all():
+                instances[instance_ref['uuid']] = instance_ref
+
+    return [instances[instance_uuid] for instance_uuid in uuids]
+
+
 @require_admin_context
 def instance_data_get_for_project(context, project_id, session=None):
     result = model_query(context,
@@ -2980,6 +3242,13 @@ def block_device_mapping_create(context, values):
         bdm_ref.save(session=session)
 
 
+@require_context
+def block_device_mapping_create_multi(context, values_list):
+    session = get_session()
+    with session.begin():
+        _insert_rows(session, models.BlockDeviceMapping, values_list)
+
+
 @require_context
 def block_device_mapping_update(context, bdm_id, values):
     session = get_session()
@@ -4819,3 +5088,116 @@ def task_log_end_task(context, task_name,
         task.errors = errors
         task.save(session=session)
     return task
+
+
+####################
+
+
+def _archive_rows_one_by_one(conn, table, shadow_table, column, rows):
+    """Archive rows one at a time, skipping those that can't be.
+
+    :returns: number of rows archived
+    """
+    archived = 0
+    for row in rows:
+        key = row[column.name]
+        values = {'tablename': table.name, 'key': key}
+        trans = conn.begin()
+        try:
+            conn.execute(shadow_table.insert(), [row])
+        except IntegrityError:
+            trans.rollback()
+            LOG.warn(_("Not archiving deleted row %(key)s from "
+                       "%(tablename)s, its shadow table already has a row "
+                       "with that key") % values)
+            continue
+        try:
+            conn.execute(table.delete().where(column == key))
+        except IntegrityError:
+            trans.rollback()
+            LOG.warn(_("Not archiving deleted row %(key)s from "
+                       "%(tablename)s, it is still referenced by other "
+                       "rows") % values)
+            continue
+        trans.commit()
+        archived += 1
+    return archived
+
+
+@require_admin_context
+def archive_deleted_rows_for_table(context, tablename, max_rows=None):
+    """Move up to max_rows deleted rows from a table to its shadow table.
+
+    Rows are copied and deleted a batch at a time, each batch in a single
+    transaction. If a batch can't be archived, because a row is still
+    referenced by a foreign key or its key is already in the shadow table,
+    its rows are archived one at a time and the ones that fail are
+    skipped.
+
+    :returns: number of rows archived
+    """
+    # The context argument is only used for the decorator.
+    if max_rows is None:
+        max_rows = 5000
+    engine = get_engine()
+    metadata = MetaData()
+    metadata.bind = engine
+    try:
+        table = Table(tablename, metadata, autoload=True)
+        shadow_table = Table('shadow_' + tablename, metadata, autoload=True)
+    except NoSuchTableError:
+        # No corresponding shadow table; skip it.
+        return 0
+    primary_key = list(table.primary_key.columns)
+    if len(primary_key) != 1 or 'deleted' not in table.c:
+        return 0
+    column = primary_key[0]
+
+    archived = 0
+    last_key = None
+    conn = engine.connect()
+    try:
+        while archived < max_rows:
+            query = select([table]).where(table.c.deleted != False)
+            if last_key is not None:
+                # Past the rows which were skipped
+                query = query.where(column > last_key)
+            query = query.order_by(column).limit(max_rows - archived)
+            rows = [dict(row) for row in conn.execute(query)]
+            if not rows:
+                break
+            last_key = rows[-1][column.name]
+
+            try:
+                with conn.begin():
+                    conn.execute(shadow_table.insert(), rows)
+                    keys = [row[column.name] for row in rows]
+                    conn.execute(table.delete().where(column.in_(keys)))
+                archived += len(rows)
+            except IntegrityError:
+                archived += _archive_rows_one_by_one(conn, table,
+                                                     shadow_table, column,
+                                                     rows)
+    finally:
+        conn.close()
+    return archived
+
+
+@require_admin_context
+def archive_deleted_rows(context, max_rows=None):
+    """Move up to max_rows deleted rows from live tables to shadow tables.
+
+    Tables are visited with the ones holding foreign keys first, so rows
+    are archived before the rows they reference.
+
+    :returns: number of rows archived
+    """
+    if max_rows is None:
+        max_rows = 5000
+    rows_archived = 0
+    for table in reversed(models.BASE.metadata.sorted_tables):
+        if rows_archived >= max_rows:
+            break
+        rows_archived += archive_deleted_rows_for_table(
+                context, table.name, max_rows=max_rows - rows_archived)
+    return rows_archived
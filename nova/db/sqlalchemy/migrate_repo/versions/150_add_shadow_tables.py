@@ -0,0 +1,73 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from sqlalchemy import BigInteger, Column, MetaData, Table
+from sqlalchemy.types import NullType
+
+from nova.openstack.common import log as logging
+
+LOG = logging.getLogger(__name__)
+
+
+def _shadow_table_names(meta):
+    # Only tables that are soft deleted get a shadow table to archive into.
+    return ['shadow_' + name for name, table in meta.tables.items()
+            if not name.startswith('shadow_') and 'deleted' in table.c]
+
+
+def upgrade(migrate_engine):
+    meta = MetaData()
+    meta.bind = migrate_engine
+    meta.reflect(migrate_engine)
+
+    shadow_tables = []
+    for shadow_table_name in _shadow_table_names(meta):
+        table = meta.tables[shadow_table_name[len('shadow_'):]]
+        columns = []
+        for column in table.columns:
+            # sqlite reflects BigInteger as NullType, every other type
+            # nova uses round trips.
+            column_type = column.type
+            if isinstance(column_type, NullType):
+                column_type = BigInteger()
+            # Shadow tables keep the primary key but none of the foreign
+            # keys, unique constraints or indexes of the live table.
+            columns.append(Column(column.name, column_type,
+                                  primary_key=column.primary_key,
+                                  autoincrement=False,
+                                  nullable=column.nullable))
+        shadow_table = Table(shadow_table_name, meta, *columns,
+                             mysql_engine='InnoDB',
+                             mysql_charset='utf8')
+        try:
+            shadow_table.create()
+        except Exception:
+            LOG.exception("Exception while creating table '%s'" %
+                          shadow_table_name)
+            meta.drop_all(tables=shadow_tables)
+            raise
+        shadow_tables.append(shadow_table)
+
+
+def downgrade(migrate_engine):
+    meta = MetaData()
+    meta.bind = migrate_engine
+    meta.reflect(migrate_engine)
+
+    for name in meta.tables.keys():
+        if name.startswith('shadow_'):
+            meta.tables[name].drop()
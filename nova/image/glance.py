@@ -20,12 +20,20 @@
 from __future__ import absolute_import
 
 import copy
+import hashlib
+import httplib
 import itertools
+import os
+import posixpath
 import random
+import socket
+import stat
 import sys
 import time
+import urllib
 import urlparse
 
+from eventlet import greenpool
 import glanceclient
 import glanceclient.exc
 
@@ -58,6 +66,16 @@ glance_opts = [
     cfg.IntOpt('glance_num_retries',
                default=0,
                help='Number retries when downloading an image from glance'),
+    cfg.IntOpt('glance_server_retry_interval',
+               default=60,
+               help='Number of seconds after a glance api server fails '
+                    'during which the other servers are tried first'),
+    cfg.IntOpt('glance_download_connections',
+               default=1,
+               help='Number of connections to download an image to a file '
+                    'over in parallel, each fetching a range of at least '
+                    '64 MB. Needs glance servers that honour range '
+                    'requests'),
 ]
 
 LOG = logging.getLogger(__name__)
@@ -66,6 +84,18 @@ CONF.register_opts(glance_opts)
 CONF.import_opt('auth_strategy', 'nova.api.auth')
 CONF.import_opt('my_ip', 'nova.netconf')
 
+CHUNK_SIZE = 64 * 1024
+
+# Parallel downloads split images in ranges of at least this size
+MIN_RANGE_SIZE = 64 * 1024 * 1024
+
+# Kept alive connections image data is fetched over, keyed by server
+MAX_IDLE_CONNECTIONS = 4
+_idle_connections = {}
+
+# Time of the last failure of each api server
+_server_failures = {}
+
 
 def generate_glance_url():
     """Generate the URL to glance."""
@@ -112,7 +142,8 @@ def get_api_servers():
     """
     Shuffle a list of CONF.glance_api_servers and return an iterator
     that will cycle through the list, looping around to the beginning
-    if necessary.
+    if necessary. Servers that failed in the last
+    CONF.glance_server_retry_interval seconds come last.
     """
     api_servers = []
     for api_server in CONF.glance_api_servers:
@@ -124,6 +155,10 @@ def get_api_servers():
         use_ssl = (o.scheme == 'https')
         api_servers.append((host, port, use_ssl))
     random.shuffle(api_servers)
+    # Servers that failed recently are tried after the others
+    failed_since = time.time() - CONF.glance_server_retry_interval
+    api_servers.sort(key=lambda server:
+                     _server_failures.get(server, 0) > failed_since)
     return itertools.cycle(api_servers)
 
 
@@ -164,17 +199,39 @@ class GlanceClientWrapper(object):
         Call a glance client method.  If we get a connection error,
         retry the request according to CONF.glance_num_retries.
         """
+        return self._call(context, version, method,
+                lambda client: getattr(client.images, method)(*args,
+                                                              **kwargs))
+
+    def open_data(self, context, image_id, start=0, end=None):
+        """Request the bytes of an image from start up to end.
+
+        Returns an _ImageData to read them from. Failures to connect are
+        retried like those of other calls.
+        """
+        return self._call(context, 1, 'data',
+                lambda client: _open_image_data(client, self.host, self.port,
+                                                image_id, start, end))
+
+    def _call(self, context, version, method, func):
         retry_excs = (glanceclient.exc.ServiceUnavailable,
                 glanceclient.exc.InvalidEndpoint,
                 glanceclient.exc.CommunicationError)
         num_attempts = 1 + CONF.glance_num_retries
 
         for attempt in xrange(1, num_attempts + 1):
-            client = self.client or self._create_onetime_client(context,
-                                                                version)
+            if self.client:
+                client = self.client
+                server = None
+            else:
+                client = self._create_onetime_client(context, version)
+                server = (self.host, self.port, self.use_ssl)
             try:
-                return getattr(client.images, method)(*args, **kwargs)
+                result = func(client)
             except retry_excs as e:
+                if server:
+                    # Other calls try the other servers first for a while
+                    _server_failures[server] = time.time()
                 host = self.host
                 port = self.port
                 extra = "retrying"
@@ -187,6 +244,156 @@ class GlanceClientWrapper(object):
                             host=host, port=port, reason=str(e))
                 LOG.exception(error_msg, locals())
                 time.sleep(1)
+            else:
+                if server:
+                    _server_failures.pop(server, None)
+                return result
+
+
+def _http_client(client):
+    """Return the HTTPClient of a glanceclient Client, or None.
+
+    glanceclient 0.9.0 clients are their own HTTPClient, later ones have it
+    as http_client. None is returned for those whose HTTPClient can't hand
+    out connections.
+    """
+    http = getattr(client, 'http_client', client)
+    if not callable(getattr(http, 'get_connection', None)):
+        return None
+    for attr in ('auth_token', 'endpoint_scheme', 'endpoint_hostname',
+                 'endpoint_port', 'endpoint_path'):
+        if not hasattr(http, attr):
+            return None
+    return http
+
+
+def _get_connection(http):
+    """Return an idle kept alive connection to the server of a client."""
+    key = (http.endpoint_scheme, http.endpoint_hostname, http.endpoint_port)
+    idle = _idle_connections.get(key)
+    if idle:
+        return idle.pop(), True
+    return http.get_connection(), False
+
+
+def _release_connection(http, conn, resp):
+    """Keep a connection for reuse if the whole response was read."""
+    key = (http.endpoint_scheme, http.endpoint_hostname, http.endpoint_port)
+    idle = _idle_connections.setdefault(key, [])
+    if (resp.isclosed() and not resp.length and not resp.will_close and
+            len(idle) < MAX_IDLE_CONNECTIONS):
+        idle.append(conn)
+    else:
+        conn.close()
+
+
+def _open_image_data(client, host, port, image_id, start=0, end=None):
+    """Send a range request for the bytes of an image from start to end.
+
+    glanceclient opens a new connection for each request, so this makes
+    the request itself, over a connection kept alive from an earlier one
+    where there is one. With glanceclient releases that don't let it, the
+    whole image is requested through glanceclient instead.
+    """
+    http = _http_client(client)
+    if http is None:
+        body = client.images.data(image_id)
+        return _ImageData(host, port, None, None, 0, None, None, body=body)
+
+    headers = {'User-Agent': 'nova',
+               'Range': 'bytes=%d-%s' % (start,
+                                         '' if end is None else end - 1)}
+    if http.auth_token:
+        headers['X-Auth-Token'] = http.auth_token
+    url = posixpath.normpath('%s/v1/images/%s' % (
+            http.endpoint_path, urllib.quote(str(image_id))))
+
+    while True:
+        conn, reused = _get_connection(http)
+        try:
+            conn.request('GET', url, headers=headers)
+            resp = conn.getresponse()
+            break
+        except (socket.error, httplib.HTTPException) as e:
+            conn.close()
+            # The server may have closed a connection that was idle
+            if not reused:
+                raise glanceclient.exc.CommunicationError(message=str(e))
+
+    if resp.status == httplib.REQUESTED_RANGE_NOT_SATISFIABLE:
+        # Nothing is left of the image after start
+        resp.read()
+        _release_connection(http, conn, resp)
+        content_range = resp.getheader('content-range', '')
+        size = int(content_range.rpartition('/')[2] or start)
+        return _ImageData(host, port, None, None, size, size, None)
+    if resp.status >= 400:
+        body = resp.read()
+        _release_connection(http, conn, resp)
+        raise glanceclient.exc.from_response(resp, body)
+
+    checksum = resp.getheader('x-image-meta-checksum')
+    length = resp.getheader('content-length')
+    if resp.status == httplib.PARTIAL_CONTENT:
+        content_range = resp.getheader('content-range', '')
+        first = int(content_range.split()[-1].split('-')[0])
+        size = content_range.rpartition('/')[2]
+        size = int(size) if size not in ('', '*') else None
+    else:
+        # The range was ignored, so this is the whole image
+        first = 0
+        size = int(length) if length is not None else None
+    return _ImageData(host, port, http, conn, first, size, checksum,
+                      resp=resp)
+
+
+class _ImageData(object):
+    """The body of a response to a request for image data.
+
+    It is read from resp, the response on conn, or else from body, an
+    iterator over chunks of it.
+    """
+
+    def __init__(self, host, port, http, conn, first, size, checksum,
+                 resp=None, body=None):
+        self.host = host
+        self.port = port
+        self._http = http
+        self._conn = conn
+        self._resp = resp
+        self._body = body
+        # Offset in the image of the first byte of the body
+        self.first = first
+        self.size = size
+        self.checksum = checksum
+
+    def iter_range(self, start, end=None):
+        """Yield the bytes of the image from start up to end in chunks.
+
+        They stop short if the connection is closed early.
+        """
+        if self._resp is not None:
+            chunks = iter(lambda: self._resp.read(CHUNK_SIZE), '')
+        else:
+            chunks = iter(self._body or ())
+        offset = self.first
+        try:
+            for chunk in chunks:
+                chunk_end = offset + len(chunk)
+                if chunk_end > start:
+                    yield chunk[max(start - offset, 0):
+                                len(chunk) if end is None else end - offset]
+                offset = chunk_end
+                if end is not None and offset >= end:
+                    break
+        finally:
+            self.close()
+
+    def close(self):
+        if self._conn is not None:
+            _release_connection(self._http, self._conn, self._resp)
+            self._conn = self._resp = None
+        self._body = None
 
 
 class GlanceImageService(object):
@@ -253,15 +460,134 @@ class GlanceImageService(object):
         return getattr(image_meta, 'direct_url', None)
 
     def download(self, context, image_id, data):
-        """Calls out to Glance for metadata and data and writes data."""
+        """Calls out to Glance for metadata and data and writes data.
+
+        A download cut short is resumed where it stopped with a range
+        request, up to CONF.glance_num_retries times. When data is a
+        regular file, what it holds up to its current position is taken
+        as the start of the image, and the rest may be fetched over
+        several connections at once.
+        """
         try:
-            image_chunks = self._client.call(context, 1, 'data', image_id)
+            if _is_regular_file(data) and (data.tell() or
+                    CONF.glance_download_connections > 1):
+                self._download_to_file(context, image_id, data)
+            else:
+                self._download_stream(context, image_id, data)
         except Exception:
             _reraise_translated_image_exception(image_id)
 
-        for chunk in image_chunks:
+    def _download_stream(self, context, image_id, data):
+        md5 = hashlib.md5()
+
+        def write(chunk):
+            md5.update(chunk)
             data.write(chunk)
 
+        image_data = self._fetch_range(context, image_id, write, 0)
+        _check_checksum(image_id, md5, image_data.checksum)
+
+    def _download_to_file(self, context, image_id, data):
+        start = data.tell()
+        num_ranges = 1
+        image = None
+        if CONF.glance_download_connections > 1:
+            image = self._client.call(context, 1, 'get', image_id)
+            size = getattr(image, 'size', None) or 0
+            checksum = getattr(image, 'checksum', None)
+            num_ranges = max(1, min(CONF.glance_download_connections,
+                                    (size - start) // MIN_RANGE_SIZE))
+
+        if num_ranges == 1:
+            if not start:
+                self._download_stream(context, image_id, data)
+                return
+            image_data = self._fetch_range(context, image_id, data.write,
+                                           start)
+            checksum = image_data.checksum
+            size = image_data.size
+            if not checksum:
+                # Responses with nothing left to send carry no checksum
+                if image is None:
+                    image = self._client.call(context, 1, 'get', image_id)
+                checksum = getattr(image, 'checksum', None)
+                size = size or getattr(image, 'size', None)
+            if size is not None and start > size:
+                LOG.warn(_("%(start)d bytes of image %(image_id)s were "
+                           "already downloaded, but it only has %(size)d, "
+                           "downloading it again"), locals())
+                data.seek(0)
+                data.truncate()
+                self._download_stream(context, image_id, data)
+                return
+        else:
+            range_size = (size - start) // num_ranges
+            bounds = [start + i * range_size for i in xrange(num_ranges)]
+            bounds.append(size)
+
+            def fetch(range_start, range_end):
+                with open(data.name, 'r+b') as range_file:
+                    range_file.seek(range_start)
+                    self._fetch_range(context, image_id, range_file.write,
+                                      range_start, range_end)
+
+            LOG.debug(_("Downloading image %(image_id)s in %(num_ranges)d "
+                        "ranges"), locals())
+            data.flush()
+            pool = greenpool.GreenPool(num_ranges)
+            threads = [pool.spawn(fetch, bounds[i], bounds[i + 1])
+                       for i in xrange(num_ranges)]
+            try:
+                for thread in threads:
+                    thread.wait()
+            finally:
+                for thread in threads:
+                    thread.kill()
+            data.seek(size)
+        data.flush()
+
+        if checksum:
+            # What was downloaded before start has to be read back in
+            md5 = hashlib.md5()
+            with open(data.name, 'rb') as image_file:
+                for chunk in iter(lambda: image_file.read(CHUNK_SIZE), ''):
+                    md5.update(chunk)
+            _check_checksum(image_id, md5, checksum)
+
+    def _fetch_range(self, context, image_id, write, start, end=None):
+        """Write the bytes of an image from start up to end.
+
+        Returns the _ImageData of the first request.
+        """
+        offset = start
+        first_data = None
+        failures = 0
+        while True:
+            image_data = self._client.open_data(context, image_id, offset,
+                                                end)
+            if first_data is None:
+                first_data = image_data
+            if end is None:
+                end = image_data.size
+            try:
+                for chunk in image_data.iter_range(offset, end):
+                    write(chunk)
+                    offset += len(chunk)
+            except (socket.error, httplib.HTTPException) as e:
+                reason = str(e)
+            else:
+                if end is None or offset >= end:
+                    return first_data
+                reason = _('connection closed')
+
+            failures += 1
+            if failures > CONF.glance_num_retries:
+                raise exception.GlanceConnectionFailed(host=image_data.host,
+                        port=image_data.port, reason=reason)
+            LOG.warn(_("Download of image %(image_id)s stopped at byte "
+                       "%(offset)d of %(end)d, resuming: %(reason)s"),
+                     locals())
+
     def create(self, context, image_meta, data=None):
         """Store the image data and return the new image object."""
         sent_service_image_meta = self._translate_to_glance(image_meta)
@@ -352,6 +678,20 @@ class GlanceImageService(object):
         return str(user_id) == str(context.user_id)
 
 
+def _is_regular_file(data):
+    try:
+        return stat.S_ISREG(os.fstat(data.fileno()).st_mode)
+    except (AttributeError, IOError, OSError, ValueError):
+        return False
+
+
+def _check_checksum(image_id, md5, checksum):
+    if checksum and md5.hexdigest() != checksum:
+        reason = (_("checksum %(actual)s does not match %(checksum)s") %
+                  {'actual': md5.hexdigest(), 'checksum': checksum})
+        raise exception.ImageUnacceptable(image_id=image_id, reason=reason)
+
+
 def _convert_timestamps_to_datetimes(image_meta):
     """Returns image with timestamp fields converted to datetime objects."""
     for attr in ['created_at', 'updated_at', 'deleted_at']:
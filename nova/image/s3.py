@@ -20,12 +20,15 @@
 
 import base64
 import binascii
+import collections
+import contextlib
 import os
 import shutil
 import tarfile
 import tempfile
 
 import boto.s3.connection
+from Crypto.Cipher import AES
 import eventlet
 from lxml import etree
 
@@ -35,7 +38,6 @@ from nova import exception
 from nova.image import glance
 from nova.openstack.common import cfg
 from nova.openstack.common import log as logging
-from nova import utils
 
 
 LOG = logging.getLogger(__name__)
@@ -64,12 +66,74 @@ s3_opts = [
                default=False,
                help='whether to affix the tenant id to the access key '
                     'when downloading from s3'),
+    cfg.IntOpt('s3_image_download_concurrency',
+               default=4,
+               help='number of parts of an image bundle downloaded at once '
+                    'when registering it'),
     ]
 
 CONF = cfg.CONF
 CONF.register_opts(s3_opts)
 CONF.import_opt('my_ip', 'nova.netconf')
 
+CHUNK_SIZE = 64 * 1024
+
+
+class _ImageStageFailed(Exception):
+    """A stage of registering an image failed, and it has been logged."""
+
+    def __init__(self, image_state):
+        super(_ImageStageFailed, self).__init__(image_state)
+        self.image_state = image_state
+
+
+@contextlib.contextmanager
+def _image_stage(image_state, message):
+    """Log failures of the enclosed block and raise them as image_state."""
+    try:
+        yield
+    except _ImageStageFailed:
+        raise
+    except Exception:
+        LOG.exception(message)
+        raise _ImageStageFailed(image_state)
+
+
+def _staged(chunks, image_state, message):
+    """Pass on chunks, raising the failures of their stage as image_state.
+
+    The stages of registering an image are generators reading from each
+    other, so failures of earlier stages come through later ones. Those
+    have been logged already and keep their image_state.
+    """
+    with _image_stage(image_state, message):
+        for chunk in chunks:
+            yield chunk
+
+
+def _read_chunks(fileobj):
+    return iter(lambda: fileobj.read(CHUNK_SIZE), '')
+
+
+class _ChunkReader(object):
+    """File-like object reading from an iterator of strings."""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = ''
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            try:
+                self._buffer += self._chunks.next()
+            except StopIteration:
+                break
+        if size < 0:
+            size = len(self._buffer)
+        data = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return data
+
 
 class S3ImageService(object):
     """Wraps an existing image service to support s3 based register."""
@@ -178,6 +242,40 @@ class S3ImageService(object):
         key.get_contents_to_filename(local_filename)
         return local_filename
 
+    def _download_parts(self, bucket, filenames, local_dir):
+        """Yield the contents of the parts of a bundle in order, in chunks.
+
+        Up to s3_image_download_concurrency parts are downloaded to
+        local_dir ahead of the one being read, and each is removed once it
+        has been read, so a bundle of any size needs only a few parts of
+        scratch space.
+        """
+        pool = eventlet.GreenPool(CONF.s3_image_download_concurrency)
+        filenames = iter(filenames)
+        downloads = collections.deque()
+
+        def download_next():
+            for filename in filenames:
+                downloads.append(pool.spawn(self._download_file, bucket,
+                                            filename, local_dir))
+                return
+
+        for i in xrange(max(1, CONF.s3_image_download_concurrency)):
+            download_next()
+        try:
+            while downloads:
+                part = downloads.popleft().wait()
+                download_next()
+                try:
+                    with open(part) as part_file:
+                        for chunk in _read_chunks(part_file):
+                            yield chunk
+                finally:
+                    os.unlink(part)
+        finally:
+            for download in downloads:
+                download.kill()
+
     def _s3_parse_manifest(self, context, metadata, manifest):
         manifest = etree.fromstring(manifest)
         image_format = 'ami'
@@ -281,95 +379,85 @@ class S3ImageService(object):
                                                               manifest)
 
         def delayed_create():
-            """This handles the fetching and decrypting of the part files."""
+            """This handles the fetching and decrypting of the part files.
+
+            The parts are downloaded, decrypted, unpacked and uploaded as a
+            stream, so the image is never written out in between. The
+            stages overlap, image_state names each once it has begun.
+            """
             context.update_store()
             log_vars = {'image_location': image_location,
                         'image_path': image_path}
+            messages = {
+                'failed_download': _("Failed to download %(image_location)s "
+                                     "to %(image_path)s") % log_vars,
+                'failed_decrypt': _("Failed to decrypt %(image_location)s "
+                                    "to %(image_path)s") % log_vars,
+                'failed_untar': _("Failed to untar %(image_location)s "
+                                  "to %(image_path)s") % log_vars,
+                'failed_upload': _("Failed to upload %(image_location)s "
+                                   "to %(image_path)s") % log_vars,
+            }
 
             def _update_image_state(context, image_uuid, image_state):
                 metadata = {'properties': {'image_state': image_state}}
                 self.service.update(context, image_uuid, metadata,
                                     purge_props=False)
 
-            def _update_image_data(context, image_uuid, image_data):
-                metadata = {}
-                self.service.update(context, image_uuid, metadata, image_data,
-                                    purge_props=False)
-
-            _update_image_state(context, image_uuid, 'downloading')
-
-            try:
-                parts = []
-                elements = manifest.find('image').getiterator('filename')
-                for fn_element in elements:
-                    part = self._download_file(bucket,
-                                               fn_element.text,
-                                               image_path)
-                    parts.append(part)
-
-                # NOTE(vish): this may be suboptimal, should we use cat?
-                enc_filename = os.path.join(image_path, 'image.encrypted')
-                with open(enc_filename, 'w') as combined:
-                    for filename in parts:
-                        with open(filename) as part:
-                            shutil.copyfileobj(part, combined)
-
-            except Exception:
-                LOG.exception(_("Failed to download %(image_location)s "
-                                "to %(image_path)s"), log_vars)
-                _update_image_state(context, image_uuid, 'failed_download')
-                return
-
-            _update_image_state(context, image_uuid, 'decrypting')
-
-            try:
-                hex_key = manifest.find('image/ec2_encrypted_key').text
-                encrypted_key = binascii.a2b_hex(hex_key)
-                hex_iv = manifest.find('image/ec2_encrypted_iv').text
-                encrypted_iv = binascii.a2b_hex(hex_iv)
-
-                dec_filename = os.path.join(image_path, 'image.tar.gz')
-                self._decrypt_image(context, enc_filename, encrypted_key,
-                                    encrypted_iv, dec_filename)
-            except Exception:
-                LOG.exception(_("Failed to decrypt %(image_location)s "
-                                "to %(image_path)s"), log_vars)
-                _update_image_state(context, image_uuid, 'failed_decrypt')
-                return
+            def _stage(image_state):
+                return _image_stage(image_state, messages[image_state])
 
-            _update_image_state(context, image_uuid, 'untarring')
+            def _staged_chunks(chunks, image_state):
+                return _staged(chunks, image_state, messages[image_state])
 
-            try:
-                unz_filename = self._untarzip_image(image_path, dec_filename)
-            except Exception:
-                LOG.exception(_("Failed to untar %(image_location)s "
-                                "to %(image_path)s"), log_vars)
-                _update_image_state(context, image_uuid, 'failed_untar')
-                return
+            _update_image_state(context, image_uuid, 'downloading')
 
-            _update_image_state(context, image_uuid, 'uploading')
+            filenames = [fn_element.text for fn_element in
+                         manifest.find('image').getiterator('filename')]
+            parts = self._download_parts(bucket, filenames, image_path)
             try:
-                with open(unz_filename) as image_file:
-                    _update_image_data(context, image_uuid, image_file)
-            except Exception:
-                LOG.exception(_("Failed to upload %(image_location)s "
-                                "to %(image_path)s"), log_vars)
-                _update_image_state(context, image_uuid, 'failed_upload')
+                _update_image_state(context, image_uuid, 'decrypting')
+                with _stage('failed_decrypt'):
+                    hex_key = manifest.find('image/ec2_encrypted_key').text
+                    encrypted_key = binascii.a2b_hex(hex_key)
+                    hex_iv = manifest.find('image/ec2_encrypted_iv').text
+                    encrypted_iv = binascii.a2b_hex(hex_iv)
+                    key, iv = self._decrypt_key(context, encrypted_key,
+                                                encrypted_iv)
+                chunks = _staged_chunks(self._decrypt_chunks(
+                        _staged_chunks(parts, 'failed_download'), key, iv),
+                        'failed_decrypt')
+
+                # Reading the headers of the tarball starts the download
+                _update_image_state(context, image_uuid, 'untarring')
+                with _stage('failed_untar'):
+                    image_file, size = self._open_tarball_image(
+                            _ChunkReader(chunks))
+                image_data = _ChunkReader(_staged_chunks(
+                        _read_chunks(image_file), 'failed_untar'))
+
+                _update_image_state(context, image_uuid, 'uploading')
+                with _stage('failed_upload'):
+                    self.service.update(context, image_uuid, {'size': size},
+                                        image_data, purge_props=False)
+            except _ImageStageFailed, exc:
+                _update_image_state(context, image_uuid, exc.image_state)
                 return
+            finally:
+                parts.close()
+                shutil.rmtree(image_path, ignore_errors=True)
 
             metadata = {'status': 'active',
                         'properties': {'image_state': 'available'}}
             self.service.update(context, image_uuid, metadata,
                     purge_props=False)
 
-            shutil.rmtree(image_path)
-
         eventlet.spawn_n(delayed_create)
 
         return image
 
-    def _decrypt_image(self, context, encrypted_filename, encrypted_key,
-                       encrypted_iv, decrypted_filename):
+    def _decrypt_key(self, context, encrypted_key, encrypted_iv):
+        """Return the hex key and iv of an image, decrypted by nova-cert."""
         elevated = context.elevated()
         try:
             key = self.cert_rpcapi.decrypt_text(elevated,
@@ -385,35 +473,50 @@ class S3ImageService(object):
         except Exception, exc:
             raise exception.NovaException(_('Failed to decrypt initialization '
                                     'vector: %s') % exc)
+        return key, iv
 
-        try:
-            utils.execute('openssl', 'enc',
-                          '-d', '-aes-128-cbc',
-                          '-in', '%s' % (encrypted_filename,),
-                          '-K', '%s' % (key,),
-                          '-iv', '%s' % (iv,),
-                          '-out', '%s' % (decrypted_filename,))
-        except exception.ProcessExecutionError, exc:
-            raise exception.NovaException(_('Failed to decrypt image file '
-                                    '%(image_file)s: %(err)s') %
-                                    {'image_file': encrypted_filename,
-                                     'err': exc.stdout})
+    @staticmethod
+    def _decrypt_chunks(chunks, key, iv):
+        """Decrypt AES-128-CBC chunks like openssl enc -d -aes-128-cbc."""
+        cipher = AES.new(binascii.a2b_hex(key), AES.MODE_CBC,
+                         binascii.a2b_hex(iv))
+        data = ''
+        for chunk in chunks:
+            data += chunk
+            # The last block is held back, it has the padding
+            length = (len(data) - 1) // AES.block_size * AES.block_size
+            if length > 0:
+                yield cipher.decrypt(data[:length])
+                data = data[length:]
+        if len(data) != AES.block_size:
+            raise exception.NovaException(_('Encrypted image is not a whole '
+                                            'number of blocks'))
+        data = cipher.decrypt(data)
+        padding = ord(data[-1])
+        if (not 1 <= padding <= AES.block_size or
+                data[-padding:] != data[-1] * padding):
+            raise exception.NovaException(_('Bad padding in decrypted image, '
+                                            'the key may be wrong'))
+        yield data[:-padding]
 
     @staticmethod
-    def _test_for_malicious_tarball(path, filename):
-        """Raises exception if extracting tarball would escape extract path."""
-        tar_file = tarfile.open(filename, 'r|gz')
-        for n in tar_file.getnames():
-            if not os.path.abspath(os.path.join(path, n)).startswith(path):
-                tar_file.close()
-                raise exception.NovaException(_('Unsafe filenames in image'))
-        tar_file.close()
+    def _test_for_malicious_member(member):
+        """Raises exception if extracting member would escape extract path."""
+        name = os.path.normpath(member.name)
+        if os.path.isabs(name) or name.split(os.sep)[0] == os.pardir:
+            raise exception.NovaException(_('Unsafe filenames in image'))
 
     @staticmethod
-    def _untarzip_image(path, filename):
-        S3ImageService._test_for_malicious_tarball(path, filename)
-        tar_file = tarfile.open(filename, 'r|gz')
-        tar_file.extractall(path)
-        image_file = tar_file.getnames()[0]
-        tar_file.close()
-        return os.path.join(path, image_file)
+    def _open_tarball_image(fileobj):
+        """Find the image in a gzipped tarball read as a stream.
+
+        The image is the first file in the tarball. Returns a file object
+        reading it from the stream, and its size.
+        """
+        tar_file = tarfile.open(fileobj=fileobj, mode='r|gz',
+                                bufsize=CHUNK_SIZE)
+        for member in tar_file:
+            S3ImageService._test_for_malicious_member(member)
+            if member.isfile():
+                return tar_file.extractfile(member), member.size
+        raise exception.NovaException(_('No image file in the bundle'))
@@ -61,8 +61,8 @@ from nova import exception
 from nova.openstack.common import cfg
 from nova.openstack.common import log as logging
 from nova.openstack.common.plugin import pluginmanager
-from nova.openstack.common.rpc import dispatcher as rpc_dispatcher
 from nova.scheduler import rpcapi as scheduler_rpcapi
+from nova import tracing
 from nova import version
 
 
@@ -203,7 +203,7 @@ class Manager(base.Base):
         If a manager would like to set an rpc API version, or support more than
         one class as the target of rpc messages, override this method.
         '''
-        return rpc_dispatcher.RpcDispatcher([self])
+        return tracing.TracedRpcDispatcher([self])
 
     def periodic_tasks(self, context, raise_on_error=False):
         """Tasks to be run at a periodic interval."""
@@ -226,7 +226,9 @@ class Manager(base.Base):
             self._periodic_last_run[task_name] = time.time()
 
             try:
-                task(self, context)
+                with tracing.start_trace('periodic.%s' % full_task_name,
+                                         context):
+                    task(self, context)
             except Exception as e:
                 if raise_on_error:
                     raise
@@ -246,17 +246,40 @@ class API(base.Base):
                                                 result)
         return result
 
-    def _get_instance_nw_info(self, context, instance):
-        """Returns all network info related to an instance."""
-        args = {'instance_id': instance['id'],
+    @staticmethod
+    def _nw_info_args(instance):
+        return {'instance_id': instance['id'],
                 'instance_uuid': instance['uuid'],
                 'rxtx_factor': instance['instance_type']['rxtx_factor'],
                 'host': instance['host'],
                 'project_id': instance['project_id']}
+
+    def _get_instance_nw_info(self, context, instance):
+        """Returns all network info related to an instance."""
+        args = self._nw_info_args(instance)
         nw_info = self.network_rpcapi.get_instance_nw_info(context, **args)
 
         return network_model.NetworkInfo.hydrate(nw_info)
 
+    def get_instances_nw_info(self, context, instances, update_cache=True):
+        """Return the network info of instances, keyed by their uuids.
+
+        The network manager builds them all in one call.
+        """
+        if not instances:
+            return {}
+        nw_infos = self.network_rpcapi.get_instances_nw_info(context,
+                [self._nw_info_args(instance) for instance in instances])
+        result = {}
+        for instance in instances:
+            nw_info = network_model.NetworkInfo.hydrate(
+                    nw_infos[instance['uuid']])
+            if update_cache:
+                update_instance_cache_with_nw_info(self, context, instance,
+                                                   nw_info)
+            result[instance['uuid']] = nw_info
+        return result
+
     def validate_networks(self, context, requested_networks):
         """validate the networks passed at the time of creating
         the server
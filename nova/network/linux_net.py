@@ -23,13 +23,13 @@ import calendar
 import inspect
 import netaddr
 import os
+import tempfile
 
 from nova import db
 from nova import exception
 from nova.openstack.common import cfg
 from nova.openstack.common import fileutils
 from nova.openstack.common import importutils
-from nova.openstack.common import lockutils
 from nova.openstack.common import log as logging
 from nova import paths
 from nova import utils
@@ -357,7 +357,7 @@ class IptablesManager(object):
 
         self._apply()
 
-    @lockutils.synchronized('iptables', 'nova-', external=True)
+    @utils.synchronized('iptables', external=True)
     def _apply(self):
         """Apply the current in-memory set of iptables rules.
 
@@ -516,6 +516,19 @@ def write_to_file(file, data, mode='w'):
         f.write(data)
 
 
+def write_to_file_atomic(file, data):
+    """Replace file with data without readers ever seeing a partial file."""
+    fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(file),
+                                    prefix='.%s.' % os.path.basename(file))
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(data)
+        os.rename(tmp_file, file)
+    except Exception:
+        os.unlink(tmp_file)
+        raise
+
+
 def metadata_forward():
     """Create forwarding rule for metadata."""
     if CONF.metadata_host != '127.0.0.1':
@@ -733,6 +746,27 @@ def get_dhcp_hosts(context, network_ref):
     return '\n'.join(hosts)
 
 
+def get_dhcp_host_entries(context, network_ref):
+    """Get network's hosts config in dhcp-host format keyed by address."""
+    host = None
+    if network_ref['multi_host']:
+        host = CONF.host
+    entries = {}
+    for data in db.network_get_associated_fixed_ips(context,
+                                                    network_ref['id'],
+                                                    host=host):
+        entries[data['address']] = _host_dhcp(data)
+    return entries
+
+
+def get_dhcp_host_entry(address, vif, instance):
+    """Get a single fixed ip's hosts config in dhcp-host format."""
+    return _host_dhcp({'address': address,
+                       'vif_id': vif['id'],
+                       'vif_address': vif['address'],
+                       'instance_hostname': instance['hostname']})
+
+
 def get_dns_hosts(context, network_ref):
     """Get network's DNS hosts in hosts format."""
     hosts = []
@@ -823,6 +857,15 @@ def update_dhcp(context, dev, network_ref):
     restart_dhcp(context, dev, network_ref)
 
 
+def update_dhcp_hosts(context, dev, network_ref, entries):
+    """Write precomputed dhcp-host entries and reload dnsmasq."""
+    conffile = _dhcp_file(dev, 'conf')
+    addresses = sorted(entries, key=netaddr.IPAddress)
+    write_to_file_atomic(conffile,
+                         '\n'.join(entries[address] for address in addresses))
+    restart_dhcp(context, dev, network_ref)
+
+
 def update_dns(context, dev, network_ref):
     hostsfile = _dhcp_file(dev, 'hosts')
     write_to_file(hostsfile, get_dns_hosts(context, network_ref))
@@ -852,7 +895,7 @@ def kill_dhcp(dev):
 # NOTE(ja): Sending a HUP only reloads the hostfile, so any
 #           configuration options (like dchp-range, vlan, ...)
 #           aren't reloaded.
-@lockutils.synchronized('dnsmasq_start', 'nova-')
+@utils.synchronized('dnsmasq_start')
 def restart_dhcp(context, dev, network_ref):
     """(Re)starts a dnsmasq server for a given network.
 
@@ -925,7 +968,7 @@ def restart_dhcp(context, dev, network_ref):
     _add_dnsmasq_accept_rules(dev)
 
 
-@lockutils.synchronized('radvd_start', 'nova-')
+@utils.synchronized('radvd_start')
 def update_ra(context, dev, network_ref):
     conffile = _ra_file(dev, 'conf')
     conf_str = """
@@ -1215,7 +1258,7 @@ class LinuxBridgeInterfaceDriver(LinuxNetInterfaceDriver):
         LinuxBridgeInterfaceDriver.remove_vlan(vlan_num)
 
     @classmethod
-    @lockutils.synchronized('lock_vlan', 'nova-', external=True)
+    @utils.synchronized('lock_vlan', external=True)
     def ensure_vlan(_self, vlan_num, bridge_interface, mac_address=None):
         """Create a vlan unless it already exists."""
         interface = 'vlan%s' % vlan_num
@@ -1240,7 +1283,7 @@ class LinuxBridgeInterfaceDriver(LinuxNetInterfaceDriver):
         return interface
 
     @classmethod
-    @lockutils.synchronized('lock_vlan', 'nova-', external=True)
+    @utils.synchronized('lock_vlan', external=True)
     def remove_vlan(cls, vlan_num):
         """Delete a vlan."""
         vlan_interface = 'vlan%s' % vlan_num
@@ -1257,7 +1300,7 @@ class LinuxBridgeInterfaceDriver(LinuxNetInterfaceDriver):
             LOG.debug(_("Unplugged VLAN interface '%s'"), vlan_interface)
 
     @classmethod
-    @lockutils.synchronized('lock_bridge', 'nova-', external=True)
+    @utils.synchronized('lock_bridge', external=True)
     def ensure_bridge(_self, bridge, interface, net_attrs=None, gateway=True,
                       filtering=True):
         """Create a bridge unless it already exists.
@@ -1339,7 +1382,7 @@ class LinuxBridgeInterfaceDriver(LinuxNetInterfaceDriver):
                                      '--out-interface %s -j DROP' % bridge)
 
     @classmethod
-    @lockutils.synchronized('lock_bridge', 'nova-', external=True)
+    @utils.synchronized('lock_bridge', external=True)
     def remove_bridge(cls, bridge, gateway=True, filtering=True):
         """Delete a bridge."""
         if not device_exists(bridge):
@@ -1367,7 +1410,7 @@ class LinuxBridgeInterfaceDriver(LinuxNetInterfaceDriver):
         LOG.debug(_("Unplugged bridge interface '%s'"), bridge)
 
 
-@lockutils.synchronized('ebtables', 'nova-', external=True)
+@utils.synchronized('ebtables', external=True)
 def ensure_ebtables_rules(rules):
     for rule in rules:
         cmd = ['ebtables', '-D'] + rule.split()
@@ -1376,7 +1419,7 @@ def ensure_ebtables_rules(rules):
         _execute(*cmd, run_as_root=True)
 
 
-@lockutils.synchronized('ebtables', 'nova-', external=True)
+@utils.synchronized('ebtables', external=True)
 def remove_ebtables_rules(rules):
     for rule in rules:
         cmd = ['ebtables', '-D'] + rule.split()
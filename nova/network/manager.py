@@ -52,6 +52,7 @@ import socket
 import uuid
 
 from eventlet import greenpool
+from eventlet import greenthread
 import netaddr
 
 from nova.compute import api as compute_api
@@ -67,7 +68,6 @@ from nova.openstack.common import cfg
 from nova.openstack.common import excutils
 from nova.openstack.common import importutils
 from nova.openstack.common import jsonutils
-from nova.openstack.common import lockutils
 from nova.openstack.common import log as logging
 from nova.openstack.common.notifier import api as notifier
 from nova.openstack.common.rpc import common as rpc_common
@@ -180,6 +180,11 @@ network_opts = [
     cfg.StrOpt('dhcp_domain',
                default='novalocal',
                help='domain to use for building the hostnames'),
+    cfg.FloatOpt('dhcp_hosts_update_delay',
+                 default=0.2,
+                 help='Number of seconds to collect dhcp host changes before '
+                      'rewriting the hostsfile and reloading dnsmasq. '
+                      'Set to 0 to reload on every change.'),
     cfg.StrOpt('l3_lib',
                default='nova.network.l3.LinuxNetL3',
                help="Indicates underlying L3 management library"),
@@ -301,6 +306,53 @@ def check_policy(context, action):
     nova.policy.enforce(context, _action, target)
 
 
+def _ip_filter_to_like(pattern):
+    """Translate the literal prefix of an ip filter regex to a LIKE pattern.
+
+    The filters are applied with re.match, so only the start of the address
+    is anchored. '.' becomes '_', escaped characters are taken literally and
+    translation stops at the first construct LIKE can't express, leaving a
+    trailing '%'. The result matches a superset of the regex, so callers
+    still have to check the rows it returns against the regex.
+    """
+    if '|' in pattern:
+        return '%'
+    if pattern.startswith('^'):
+        pattern = pattern[1:]
+
+    like = []
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if char == '\\' and i + 1 < len(pattern) and \
+                not pattern[i + 1].isalnum():
+            token = pattern[i + 1]
+            i += 2
+        elif char == '.':
+            token = None
+            i += 1
+        elif char == '$' and i + 1 == len(pattern):
+            return ''.join(like)
+        elif char in '\\[]()*+?{}^$':
+            break
+        else:
+            token = char
+            i += 1
+
+        if i < len(pattern) and pattern[i] in '*?{':
+            # The token may not appear at all.
+            break
+        if token is None:
+            like.append('_')
+        elif token in '%_\\':
+            like.append('\\' + token)
+        else:
+            like.append(token)
+        if i < len(pattern) and pattern[i] == '+':
+            break
+    return ''.join(like) + '%'
+
+
 class FloatingIP(object):
     """Mixin class for adding floating IP functionality to a manager."""
 
@@ -586,7 +638,7 @@ class FloatingIP(object):
                                interface, instance_uuid):
         """Performs db and driver calls to associate floating ip & fixed ip."""
 
-        @lockutils.synchronized(unicode(floating_address), 'nova-')
+        @utils.synchronized(unicode(floating_address))
         def do_associate():
             # associate floating ip
             res = self.db.floating_ip_fixed_ip_associate(context,
@@ -674,7 +726,7 @@ class FloatingIP(object):
         """Performs db and driver calls to disassociate floating ip."""
         # disassociate floating ip
 
-        @lockutils.synchronized(unicode(address), 'nova-')
+        @utils.synchronized(unicode(address))
         def do_disassociate():
             # NOTE(vish): Note that we are disassociating in the db before we
             #             actually remove the ip address on the host. We are
@@ -924,7 +976,7 @@ class NetworkManager(manager.SchedulerDependentManager):
         The one at a time part is to flatten the layout to help scale
     """
 
-    RPC_API_VERSION = '1.6'
+    RPC_API_VERSION = '1.7'
 
     # If True, this manager requires VIF to create a bridge.
     SHOULD_CREATE_BRIDGE = False
@@ -953,6 +1005,11 @@ class NetworkManager(manager.SchedulerDependentManager):
                                    security_group_api=self.security_group_api)
         self.servicegroup_api = servicegroup.API()
 
+        # dhcp-host entries per network id, keyed by address, so leases can
+        # be added and removed without regenerating the hostsfile from the db
+        self._dhcp_hosts = {}
+        self._dhcp_updates = {}
+
         # NOTE(tr3buchet: unless manager subclassing NetworkManager has
         #                 already imported ipam, import nova ipam here
         if not hasattr(self, 'ipam'):
@@ -966,7 +1023,7 @@ class NetworkManager(manager.SchedulerDependentManager):
     def _import_ipam_lib(self, ipam_lib):
         self.ipam = importutils.import_module(ipam_lib).get_ipam_lib(self)
 
-    @lockutils.synchronized('get_dhcp', 'nova-')
+    @utils.synchronized('get_dhcp')
     def _get_dhcp_ip(self, context, network_ref, host=None):
         """Get the proper dhcp address to listen on."""
         # NOTE(vish): this is for compatibility
@@ -991,6 +1048,57 @@ class NetworkManager(manager.SchedulerDependentManager):
         """Broker the request to the driver to fetch the dhcp leases."""
         return self.driver.get_dhcp_leases(ctxt, network_ref)
 
+    def _add_dhcp_host(self, network, address, instance, vif):
+        """Add a fixed ip to the network's cached dhcp-host entries."""
+        entries = self._dhcp_hosts.get(network['id'])
+        if entries is not None:
+            entries[address] = self.driver.get_dhcp_host_entry(address, vif,
+                                                               instance)
+
+    def _remove_dhcp_host(self, network_id, address):
+        """Remove a fixed ip from the network's cached dhcp-host entries."""
+        entries = self._dhcp_hosts.get(network_id)
+        if entries is not None:
+            entries.pop(address, None)
+
+    def _invalidate_dhcp_hosts(self, network_id):
+        """Reload the network's dhcp-host entries from the db next time."""
+        self._dhcp_hosts.pop(network_id, None)
+
+    def _cancel_dhcp_update(self, network_id):
+        update = self._dhcp_updates.pop(network_id, None)
+        if update:
+            update.cancel()
+
+    def _update_dhcp(self, context, dev, network):
+        """Write the network's hostsfile and reload dnsmasq.
+
+        Updates requested within dhcp_hosts_update_delay of each other are
+        written out together with a single reload.
+        """
+        if CONF.dhcp_hosts_update_delay <= 0:
+            self._flush_dhcp_hosts(context, dev, network)
+        elif network['id'] not in self._dhcp_updates:
+            self._dhcp_updates[network['id']] = greenthread.spawn_after(
+                    CONF.dhcp_hosts_update_delay,
+                    self._delayed_flush_dhcp_hosts, context, dev, network)
+
+    def _delayed_flush_dhcp_hosts(self, context, dev, network):
+        try:
+            self._flush_dhcp_hosts(context, dev, network)
+        except Exception:
+            LOG.exception(_('Failed to update dhcp hosts for network %s'),
+                          network['id'], context=context)
+
+    def _flush_dhcp_hosts(self, context, dev, network):
+        network_id = network['id']
+        self._dhcp_updates.pop(network_id, None)
+        entries = self._dhcp_hosts.get(network_id)
+        if entries is None:
+            entries = self.driver.get_dhcp_host_entries(context, network)
+            self._dhcp_hosts[network_id] = entries
+        self.driver.update_dhcp_hosts(context, dev, network, entries)
+
     def init_host(self):
         """Do any initialization that needs to be run if this is a
         standalone service.
@@ -1064,52 +1172,50 @@ class NetworkManager(manager.SchedulerDependentManager):
     @wrap_check_policy
     def get_instance_uuids_by_ip_filter(self, context, filters):
         fixed_ip_filter = filters.get('fixed_ip')
-        ip_filter = re.compile(str(filters.get('ip')))
-        ipv6_filter = re.compile(str(filters.get('ip6')))
-
-        # NOTE(jkoelker) Should probably figure out a better way to do
-        #                this. But for now it "works", this could suck on
-        #                large installs.
-
-        vifs = self.db.virtual_interface_get_all(context)
+        ip_filter = None
+        if filters.get('ip') is not None:
+            ip_filter = re.compile(str(filters['ip']))
         results = []
 
-        for vif in vifs:
-            if vif['instance_uuid'] is None:
-                continue
-
-            network = self._get_network_by_id(context, vif['network_id'])
-            fixed_ipv6 = None
-            if network['cidr_v6'] is not None:
-                fixed_ipv6 = ipv6.to_global(network['cidr_v6'],
-                                            vif['address'],
-                                            context.project_id)
-
-            if fixed_ipv6 and ipv6_filter.match(fixed_ipv6):
-                results.append({'instance_uuid': vif['instance_uuid'],
-                                'ip': fixed_ipv6})
-
-            vif_id = vif['id']
-            fixed_ips = self.db.fixed_ips_by_virtual_interface(context,
-                                                               vif_id)
+        if fixed_ip_filter is not None or ip_filter is not None:
+            address_like = None
+            if ip_filter is not None:
+                address_like = _ip_filter_to_like(ip_filter.pattern)
+            fixed_ips = self.db.fixed_ips_by_address_filter(
+                    context, address=fixed_ip_filter,
+                    address_like=address_like)
+            matched = set()
             for fixed_ip in fixed_ips:
-                if not fixed_ip or not fixed_ip['address']:
+                fixed_address = fixed_ip['address']
+                if (fixed_address == fixed_ip_filter or
+                        ip_filter and ip_filter.match(fixed_address)):
+                    # The fixed ip has a row for each of its floating ips
+                    key = (fixed_ip['instance_uuid'], fixed_address)
+                    if key not in matched:
+                        matched.add(key)
+                        results.append({
+                            'instance_uuid': fixed_ip['instance_uuid'],
+                            'ip': fixed_address})
                     continue
-                if fixed_ip['address'] == fixed_ip_filter:
-                    results.append({'instance_uuid': vif['instance_uuid'],
-                                    'ip': fixed_ip['address']})
-                    continue
-                if ip_filter.match(fixed_ip['address']):
+                floating_address = fixed_ip['floating_address']
+                if (floating_address and ip_filter and
+                        ip_filter.match(floating_address)):
+                    results.append({
+                        'instance_uuid': fixed_ip['instance_uuid'],
+                        'ip': floating_address})
+
+        # ipv6 addresses are derived from the vif mac so they can't be
+        # filtered in the database.
+        if filters.get('ip6') is not None:
+            ipv6_filter = re.compile(str(filters['ip6']))
+            vifs = self.db.virtual_interface_get_all_with_ipv6(context)
+            for vif in vifs:
+                fixed_ipv6 = ipv6.to_global(vif['cidr_v6'],
+                                            vif['address'],
+                                            context.project_id)
+                if ipv6_filter.match(fixed_ipv6):
                     results.append({'instance_uuid': vif['instance_uuid'],
-                                    'ip': fixed_ip['address']})
-                    continue
-                for floating_ip in fixed_ip.get('floating_ips', []):
-                    if not floating_ip or not floating_ip['address']:
-                        continue
-                    if ip_filter.match(floating_ip['address']):
-                        results.append({'instance_uuid': vif['instance_uuid'],
-                                        'ip': floating_ip['address']})
-                        continue
+                                    'ip': fixed_ipv6})
 
         return results
 
@@ -1224,6 +1330,38 @@ class NetworkManager(manager.SchedulerDependentManager):
                                                          rxtx_factor, host)
         return nw_info
 
+    @wrap_check_policy
+    def get_instances_nw_info(self, context, instances):
+        """Creates the network info of instances, keyed by their uuids.
+
+        instances are dicts of the arguments of get_instance_nw_info. The
+        vifs of all of them are looked up together, and each network once.
+        """
+        instance_uuids = [instance['instance_uuid'] for instance in instances]
+        vifs_by_instance = dict((uuid, []) for uuid in instance_uuids)
+        for vif in self.db.virtual_interface_get_by_instances(context,
+                                                              instance_uuids):
+            vifs_by_instance[vif['instance_uuid']].append(vif)
+
+        networks_by_id = {}
+        nw_infos = {}
+        for instance in instances:
+            vifs = vifs_by_instance[instance['instance_uuid']]
+            networks = {}
+            for vif in vifs:
+                network_id = vif.get('network_id')
+                if network_id is None:
+                    continue
+                if network_id not in networks_by_id:
+                    networks_by_id[network_id] = self._get_network_by_id(
+                            context, network_id)
+                networks[vif['uuid']] = networks_by_id[network_id]
+            nw_infos[instance['instance_uuid']] = \
+                    self.build_network_info_model(context, vifs, networks,
+                                                  instance['rxtx_factor'],
+                                                  instance['host'])
+        return nw_infos
+
     def build_network_info_model(self, context, vifs, networks,
                                  rxtx_factor, instance_host):
         """Builds a NetworkInfo object containing all network information
@@ -1457,6 +1595,7 @@ class NetworkManager(manager.SchedulerDependentManager):
             values = {'allocated': True,
                       'virtual_interface_id': vif['id']}
             self.db.fixed_ip_update(context, address, values)
+            self._add_dhcp_host(network, address, instance_ref, vif)
 
         name = instance_ref['display_name']
 
@@ -1493,6 +1632,7 @@ class NetworkManager(manager.SchedulerDependentManager):
         self.db.fixed_ip_update(context, address,
                                 {'allocated': False,
                                  'virtual_interface_id': None})
+        self._remove_dhcp_host(fixed_ip_ref['network_id'], address)
 
         if teardown:
             network = self._get_network_by_id(context,
@@ -1806,17 +1946,13 @@ class NetworkManager(manager.SchedulerDependentManager):
         if not fixed_cidr:
             fixed_cidr = netaddr.IPNetwork(network['cidr'])
         num_ips = len(fixed_cidr)
-        ips = []
-        for index in range(num_ips):
-            address = str(fixed_cidr[index])
-            if index < bottom_reserved or num_ips - index <= top_reserved:
-                reserved = True
-            else:
-                reserved = False
-
-            ips.append({'network_id': network_id,
-                        'address': address,
-                        'reserved': reserved})
+        # A generator keeps memory bounded for large networks, the db layer
+        # inserts the addresses in chunks.
+        ips = ({'network_id': network_id,
+                'address': str(address),
+                'reserved': (index < bottom_reserved or
+                             num_ips - index <= top_reserved)}
+               for index, address in enumerate(fixed_cidr))
         self.db.fixed_ip_bulk_create(context, ips)
 
     def _allocate_fixed_ips(self, context, instance_id, host, networks,
@@ -1847,6 +1983,7 @@ class NetworkManager(manager.SchedulerDependentManager):
             if self.host == host or host is None:
                 # at this point i am the correct host, or host doesn't
                 # matter -> FlatManager
+                self._invalidate_dhcp_hosts(network['id'])
                 call_func(context, network)
             else:
                 # i'm not the right host, run call on correct host
@@ -1865,6 +2002,7 @@ class NetworkManager(manager.SchedulerDependentManager):
 
         # subcall from original setup_networks_on_host
         network = self.db.network_get(context, network_id)
+        self._invalidate_dhcp_hosts(network_id)
         call_func(context, network)
 
     def _setup_network_on_host(self, context, network):
@@ -2141,7 +2279,7 @@ class FlatDHCPManager(RPCAllocateFixedIP, FloatingIP, NetworkManager):
             dev = self.driver.get_dev(network)
             # NOTE(dprince): dhcp DB queries require elevated context
             elevated = context.elevated()
-            self.driver.update_dhcp(elevated, dev, network)
+            self._update_dhcp(elevated, dev, network)
             if(CONF.use_ipv6):
                 self.driver.update_ra(context, dev, network)
                 gateway = utils.get_my_linklocal(dev)
@@ -2154,7 +2292,7 @@ class FlatDHCPManager(RPCAllocateFixedIP, FloatingIP, NetworkManager):
             dev = self.driver.get_dev(network)
             # NOTE(dprince): dhcp DB queries require elevated context
             elevated = context.elevated()
-            self.driver.update_dhcp(elevated, dev, network)
+            self._update_dhcp(elevated, dev, network)
 
     def _get_network_dict(self, network):
         """Returns the dict representing necessary and meta network fields."""
@@ -2231,6 +2369,7 @@ class VlanManager(RPCAllocateFixedIP, FloatingIP, NetworkManager):
         values = {'allocated': True,
                   'virtual_interface_id': vif['id']}
         self.db.fixed_ip_update(context, address, values)
+        self._add_dhcp_host(network, address, instance, vif)
 
         if self._validate_instance_zone_for_dns_domain(context, instance):
             name = instance['display_name']
@@ -2326,7 +2465,7 @@ class VlanManager(RPCAllocateFixedIP, FloatingIP, NetworkManager):
         return NetworkManager.create_networks(
             self, context, vpn=True, **kwargs)
 
-    @lockutils.synchronized('setup_network', 'nova-', external=True)
+    @utils.synchronized('setup_network', external=True)
     def _setup_network_on_host(self, context, network):
         """Sets up network on this host."""
         if not network['vpn_public_address']:
@@ -2351,21 +2490,21 @@ class VlanManager(RPCAllocateFixedIP, FloatingIP, NetworkManager):
             dev = self.driver.get_dev(network)
             # NOTE(dprince): dhcp DB queries require elevated context
             elevated = context.elevated()
-            self.driver.update_dhcp(elevated, dev, network)
+            self._update_dhcp(elevated, dev, network)
             if(CONF.use_ipv6):
                 self.driver.update_ra(context, dev, network)
                 gateway = utils.get_my_linklocal(dev)
                 self.db.network_update(context, network['id'],
                                        {'gateway_v6': gateway})
 
-    @lockutils.synchronized('setup_network', 'nova-', external=True)
+    @utils.synchronized('setup_network', external=True)
     def _teardown_network_on_host(self, context, network):
         if not CONF.fake_network:
             network['dhcp_server'] = self._get_dhcp_ip(context, network)
             dev = self.driver.get_dev(network)
             # NOTE(dprince): dhcp DB queries require elevated context
             elevated = context.elevated()
-            self.driver.update_dhcp(elevated, dev, network)
+            self._update_dhcp(elevated, dev, network)
 
             # NOTE(ethuleau): For multi hosted networks, if the network is no
             # more used on this host and if VPN forwarding rule aren't handed
@@ -2376,6 +2515,8 @@ class VlanManager(RPCAllocateFixedIP, FloatingIP, NetworkManager):
                 not self.db.network_in_use_on_host(context, network['id'],
                                                    self.host)):
                 LOG.debug("Remove unused gateway %s", network['bridge'])
+                self._cancel_dhcp_update(network['id'])
+                self._invalidate_dhcp_hosts(network['id'])
                 self.driver.kill_dhcp(dev)
                 self.l3driver.remove_gateway(network)
                 if not CONF.share_dhcp_address:
@@ -2384,7 +2525,7 @@ class VlanManager(RPCAllocateFixedIP, FloatingIP, NetworkManager):
                     self.db.fixed_ip_update(context, network['dhcp_server'],
                                             values)
             else:
-                self.driver.update_dhcp(context, dev, network)
+                self._update_dhcp(context, dev, network)
 
     def _get_network_dict(self, network):
         """Returns the dict representing necessary and meta network fields."""
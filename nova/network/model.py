@@ -390,3 +390,43 @@ class NetworkInfo(list):
 
             network_info.append((network_dict, info_dict))
         return network_info
+
+
+def vif_addresses(network_info):
+    """Return the addresses of each VIF with a network.
+
+    network_info is a NetworkInfo, or its JSON as kept in the info cache.
+    JSON is read as it is, without hydrating it into models, since that
+    takes most of the time of listing the addresses of many instances.
+    Returns a dict per VIF like::
+
+        {'network_id': 'n8v29837fn234782f08fjxk3ofhb84',
+         'network_label': 'my_network',
+         'fixed_ips': [{'address': '10.0.0.2', 'version': 4, ...}],
+         'floating_ips': [{'address': '172.16.0.2', 'version': 4, ...}]}
+
+    The IPs are those of network_info, and are not to be changed.
+    """
+    def with_version(ip):
+        # Like the models, find out the version of IPs stored without one
+        if ip.get('version') or not ip.get('address'):
+            return ip
+        return dict(ip, version=netaddr.IPAddress(ip['address']).version)
+
+    if isinstance(network_info, basestring):
+        network_info = jsonutils.loads(network_info)
+    addresses = []
+    for vif in network_info or []:
+        network = vif.get('network')
+        if not network:
+            continue
+        fixed_ips = [with_version(fixed_ip)
+                     for subnet in network.get('subnets') or []
+                     for fixed_ip in subnet.get('ips') or []]
+        floating_ips = [with_version(floating_ip) for fixed_ip in fixed_ips
+                        for floating_ip in fixed_ip.get('floating_ips') or []]
+        addresses.append({'network_id': network.get('id'),
+                          'network_label': network.get('label'),
+                          'fixed_ips': fixed_ips,
+                          'floating_ips': floating_ips})
+    return addresses
@@ -15,17 +15,33 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+from eventlet import pools
+
 from nova.openstack.common import cfg
 from nova.openstack.common import excutils
 from nova.openstack.common import log as logging
+from nova.openstack.common import timeutils
 from quantumclient import client
+from quantumclient.common import exceptions
 from quantumclient.v2_0 import client as clientv20
 
 CONF = cfg.CONF
 LOG = logging.getLogger(__name__)
 
+# Seconds before it expires that the cached admin token is replaced
+TOKEN_EXPIRY_MARGIN = 300
+
+_admin_auth = {'token': None, 'expires': None}
+_pools = {}
+
 
 def _get_auth_token():
+    token = _admin_auth['token']
+    expires = _admin_auth['expires']
+    if token and (expires is None or
+                  timeutils.is_newer_than(expires, TOKEN_EXPIRY_MARGIN)):
+        return token
+
     try:
         httpclient = client.HTTPClient(
             username=CONF.quantum_admin_username,
@@ -38,21 +54,86 @@ def _get_auth_token():
     except Exception:
         with excutils.save_and_reraise_exception():
             LOG.exception(_("_get_auth_token() failed"))
+
+    expires = httpclient.service_catalog.get_token().get('expires')
+    if expires:
+        expires = timeutils.normalize_time(timeutils.parse_isotime(expires))
+    _admin_auth['token'] = httpclient.auth_token
+    _admin_auth['expires'] = expires
     return httpclient.auth_token
 
 
+def _clear_auth_token():
+    _admin_auth['token'] = None
+    _admin_auth['expires'] = None
+
+
+class ClientPool(pools.Pool):
+    """Clients of one quantum endpoint.
+
+    Each client keeps its connections open, so requests made through the
+    pool don't connect anew every time.
+    """
+
+    def __init__(self, endpoint_url, timeout):
+        self.endpoint_url = endpoint_url
+        self.timeout = timeout
+        super(ClientPool, self).__init__(
+                max_size=CONF.quantum_client_pool_size)
+
+    def create(self):
+        # The token is set for each request
+        return clientv20.Client(endpoint_url=self.endpoint_url,
+                                timeout=self.timeout,
+                                auth_strategy=None)
+
+
+def _get_pool():
+    key = (CONF.quantum_url, CONF.quantum_url_timeout)
+    pool = _pools.get(key)
+    if pool is None:
+        pool = _pools[key] = ClientPool(*key)
+    return pool
+
+
+class PooledClient(object):
+    """Quantum v2.0 client making each request with a pooled client."""
+
+    def __init__(self, token, admin=False):
+        self.token = token
+        self.admin = admin
+
+    def __getattr__(self, name):
+        if not callable(getattr(clientv20.Client, name)):
+            raise AttributeError(name)
+
+        def call(*args, **kwargs):
+            try:
+                return self._call(name, args, kwargs)
+            except exceptions.Unauthorized:
+                if not self.admin:
+                    raise
+                # The cached admin token was revoked before it expired
+                _clear_auth_token()
+                self.token = _get_auth_token()
+                return self._call(name, args, kwargs)
+        return call
+
+    def _call(self, name, args, kwargs):
+        pool = _get_pool()
+        quantum = pool.get()
+        try:
+            quantum.httpclient.auth_token = self.token
+            return getattr(quantum, name)(*args, **kwargs)
+        finally:
+            pool.put(quantum)
+
+
 def _get_client(token=None):
-    if not token and CONF.quantum_auth_strategy:
+    admin = not token and bool(CONF.quantum_auth_strategy)
+    if admin:
         token = _get_auth_token()
-    params = {
-        'endpoint_url': CONF.quantum_url,
-        'timeout': CONF.quantum_url_timeout,
-    }
-    if token:
-        params['token'] = token
-    else:
-        params['auth_strategy'] = None
-    return clientv20.Client(**params)
+    return PooledClient(token, admin=admin)
 
 
 def get_client(context, admin=False):
@@ -16,6 +16,8 @@
 #
 # vim: tabstop=4 shiftwidth=4 softtabstop=4
 
+import copy
+
 from nova.compute import api as compute_api
 from nova.db import base
 from nova import exception
@@ -48,6 +50,10 @@ quantum_opts = [
                default='keystone',
                help='auth strategy for connecting to '
                     'quantum in admin context'),
+    cfg.IntOpt('quantum_client_pool_size',
+               default=10,
+               help='Maximum number of quantum clients, each with its own '
+                    'connection, kept for requests'),
     ]
 
 CONF = cfg.CONF
@@ -57,10 +63,27 @@ LOG = logging.getLogger(__name__)
 
 NET_EXTERNAL = 'router:external'
 
+# Most ids passed to quantum in one list call. The ids go in the query
+# string, and request lines of more than 8 KB are refused by the server.
+MAX_IDS_PER_QUERY = 50
+
 refresh_cache = network_api.refresh_cache
 update_instance_info_cache = network_api.update_instance_cache_with_nw_info
 
 
+def _list_by_ids(list_func, resources, id_key, ids, **kwargs):
+    """Call list_func for at most MAX_IDS_PER_QUERY ids at a time.
+
+    Returns the resources of every call, concatenated.
+    """
+    ids = list(ids)
+    result = []
+    for i in xrange(0, len(ids), MAX_IDS_PER_QUERY):
+        kwargs[id_key] = ids[i:i + MAX_IDS_PER_QUERY]
+        result.extend(list_func(**kwargs).get(resources, []))
+    return result
+
+
 class API(base.Base):
     """API for interacting with the quantum 2.x API."""
 
@@ -325,6 +348,19 @@ class API(base.Base):
                  'fixed_ip_address': fixed_address}
         client.update_floatingip(fip['id'], {'floatingip': param})
 
+        if fip['port_id'] and fip['port_id'] != port_id:
+            port = client.show_port(fip['port_id'])['port']
+            orig_instance_uuid = port['device_id']
+            msg_dict = dict(address=floating_address,
+                            instance_id=orig_instance_uuid)
+            LOG.info(_('re-assign floating IP %(address)s from '
+                       'instance %(instance_id)s') % msg_dict)
+            orig_instance = self.db.instance_get_by_uuid(context,
+                                                         orig_instance_uuid)
+
+            # purge cached nw info for the original instance
+            update_instance_info_cache(self, context, orig_instance)
+
     def get_all(self, context):
         client = quantumv2.get_client(context)
         return client.list_networks()
@@ -536,48 +572,113 @@ class API(base.Base):
         """Force add a network to the project."""
         raise NotImplementedError()
 
+    def get_instances_nw_info(self, context, instances, update_cache=True):
+        """Return the network info of instances, keyed by their uuids.
+
+        The ports, networks, subnets, DHCP ports and floating ips of all
+        the instances are looked up together.
+        """
+        models = self._build_network_info_models(context, instances)
+        result = {}
+        for instance in instances:
+            nw_info = network_model.NetworkInfo.hydrate(
+                models[instance['uuid']])
+            if update_cache:
+                update_instance_info_cache(self, context, instance, nw_info)
+            result[instance['uuid']] = nw_info
+        return result
+
     def _build_network_info_model(self, context, instance, networks=None):
-        search_opts = {'tenant_id': instance['project_id'],
-                       'device_id': instance['uuid'], }
-        data = quantumv2.get_client(context,
-                                    admin=True).list_ports(**search_opts)
-        ports = data.get('ports', [])
-        if not networks:
-            networks = self._get_available_networks(context,
-                                                    instance['project_id'])
-        else:
-            # ensure ports are in preferred network order
-            _ensure_requested_network_ordering(
-                lambda x: x['network_id'],
-                ports,
-                [n['id'] for n in networks])
+        return self._build_network_info_models(context, [instance],
+                                               networks)[instance['uuid']]
+
+    def _build_network_info_models(self, context, instances, networks=None):
+        """Build the network info of instances, keyed by their uuids.
 
+        Rather than asking quantum for each port, this makes one call each
+        for the ports of the instances, their networks, subnets and
+        floating ips, and the DHCP ports of the subnets.
+        """
+        if not instances:
+            return {}
+        client = quantumv2.get_client(context, admin=True)
+        ports = []
+        for i in xrange(0, len(instances), MAX_IDS_PER_QUERY):
+            chunk = instances[i:i + MAX_IDS_PER_QUERY]
+            project_ids = list(set(instance['project_id']
+                                   for instance in chunk))
+            data = client.list_ports(
+                tenant_id=project_ids,
+                device_id=[instance['uuid'] for instance in chunk])
+            ports.extend(data.get('ports', []))
+
+        requested = [net['id'] for net in networks or []]
+        networks = dict((net['id'], net) for net in networks or [])
+        missing = set(port['network_id'] for port in ports) - set(networks)
+        for net in _list_by_ids(client.list_networks, 'networks', 'id',
+                                missing):
+            networks[net['id']] = net
+
+        subnet_ids = set(ip['subnet_id'] for port in ports
+                         for ip in port['fixed_ips'])
+        subnets = self._get_subnets(client, subnet_ids)
+        floating_ips = {}
+        for fip in _list_by_ids(client.list_floatingips, 'floatingips',
+                                'port_id', [port['id'] for port in ports]):
+            key = (fip['port_id'], fip['fixed_ip_address'])
+            floating_ips.setdefault(key, []).append(
+                fip['floating_ip_address'])
+
+        ports_by_instance = {}
+        for port in ports:
+            ports_by_instance.setdefault(port['device_id'], []).append(port)
+
+        models = {}
+        for instance in instances:
+            instance_ports = ports_by_instance.get(instance['uuid'], [])
+            if requested:
+                # ensure ports are in preferred network order
+                _ensure_requested_network_ordering(
+                    lambda x: x['network_id'],
+                    instance_ports,
+                    requested)
+            models[instance['uuid']] = self._build_vifs(
+                instance_ports, networks, subnets, floating_ips)
+        return models
+
+    def _build_vifs(self, ports, networks, subnets, floating_ips):
         nw_info = network_model.NetworkInfo()
         for port in ports:
-            network_name = None
-            for net in networks:
-                if port['network_id'] == net['id']:
-                    network_name = net['name']
-                    break
-
-            network_IPs = [network_model.FixedIP(address=ip_address)
-                           for ip_address in [ip['ip_address']
-                                              for ip in port['fixed_ips']]]
-            # TODO(gongysh) get floating_ips for each fixed_ip
-
-            subnets = self._get_subnets_from_port(context, port)
-            for subnet in subnets:
-                subnet['ips'] = [fixed_ip for fixed_ip in network_IPs
-                                 if fixed_ip.is_in_subnet(subnet)]
+            net = networks.get(port['network_id'], {})
+            network_IPs = []
+            for ip in port['fixed_ips']:
+                fixed_ip = network_model.FixedIP(address=ip['ip_address'])
+                key = (port['id'], ip['ip_address'])
+                for address in floating_ips.get(key, []):
+                    fixed_ip.add_floating_ip(
+                        network_model.IP(address=address, type='floating'))
+                network_IPs.append(fixed_ip)
+
+            port_subnets = []
+            seen = set()
+            for ip in port['fixed_ips']:
+                subnet_id = ip['subnet_id']
+                if subnet_id in seen or subnet_id not in subnets:
+                    continue
+                seen.add(subnet_id)
+                subnet = copy.deepcopy(subnets[subnet_id])
+                subnet['ips'] = [network_ip for network_ip in network_IPs
+                                 if network_ip.is_in_subnet(subnet)]
+                port_subnets.append(subnet)
 
             network = network_model.Network(
                 id=port['network_id'],
                 bridge='',  # Quantum ignores this field
                 injected=CONF.flat_injected,
-                label=network_name,
-                tenant_id=net['tenant_id']
+                label=net.get('name'),
+                tenant_id=net.get('tenant_id')
             )
-            network['subnets'] = subnets
+            network['subnets'] = port_subnets
             nw_info.append(network_model.VIF(
                 id=port['id'],
                 address=port['mac_address'],
@@ -585,39 +686,35 @@ class API(base.Base):
                 type=port.get('binding:vif_type')))
         return nw_info
 
-    def _get_subnets_from_port(self, context, port):
-        """Return the subnets for a given port."""
+    def _get_subnets(self, client, subnet_ids):
+        """Return the Subnet models of subnet_ids, keyed by id."""
 
-        fixed_ips = port['fixed_ips']
-        # No fixed_ips for the port means there is no subnet associated
-        # with the network the port is created on.
         # Since list_subnets(id=[]) returns all subnets visible for the
-        # current tenant, returned subnets may contain subnets which is not
-        # related to the port. To avoid this, the method returns here.
-        if not fixed_ips:
-            return []
-        search_opts = {'id': [ip['subnet_id'] for ip in fixed_ips]}
-        data = quantumv2.get_client(context).list_subnets(**search_opts)
-        ipam_subnets = data.get('subnets', [])
-        subnets = []
-
+        # current tenant, returned subnets may contain subnets which are not
+        # related to the ports. To avoid this, the method returns here.
+        if not subnet_ids:
+            return {}
+        ipam_subnets = _list_by_ids(client.list_subnets, 'subnets', 'id',
+                                    subnet_ids)
+
+        # attempt to populate DHCP server field
+        dhcp_servers = {}
+        network_ids = set(subnet['network_id'] for subnet in ipam_subnets)
+        for p in _list_by_ids(client.list_ports, 'ports', 'network_id',
+                              network_ids, device_owner='network:dhcp'):
+            for ip_pair in p['fixed_ips']:
+                dhcp_servers.setdefault(ip_pair['subnet_id'],
+                                        ip_pair['ip_address'])
+
+        subnets = {}
         for subnet in ipam_subnets:
             subnet_dict = {'cidr': subnet['cidr'],
                            'gateway': network_model.IP(
                                 address=subnet['gateway_ip'],
                                 type='gateway'),
             }
-
-            # attempt to populate DHCP server field
-            search_opts = {'network_id': subnet['network_id'],
-                           'device_owner': 'network:dhcp'}
-            data = quantumv2.get_client(context).list_ports(**search_opts)
-            dhcp_ports = data.get('ports', [])
-            for p in dhcp_ports:
-                for ip_pair in p['fixed_ips']:
-                    if ip_pair['subnet_id'] == subnet['id']:
-                        subnet_dict['dhcp_server'] = ip_pair['ip_address']
-                        break
+            if subnet['id'] in dhcp_servers:
+                subnet_dict['dhcp_server'] = dhcp_servers[subnet['id']]
 
             subnet_object = network_model.Subnet(**subnet_dict)
             for dns in subnet.get('dns_nameservers', []):
@@ -625,7 +722,7 @@ class API(base.Base):
                     network_model.IP(address=dns, type='dns'))
 
             # TODO(gongysh) get the routes for this subnet
-            subnets.append(subnet_object)
+            subnets[subnet['id']] = subnet_object
         return subnets
 
     def get_dns_domains(self, context):
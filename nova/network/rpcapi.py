@@ -45,6 +45,7 @@ class NetworkAPI(rpc_proxy.RpcProxy):
         1.4 - Add get_backdoor_port()
         1.5 - Adds associate
         1.6 - Adds instance_uuid to _{dis,}associate_floating_ip
+        1.7 - Adds get_instances_nw_info
     '''
 
     #
@@ -182,6 +183,10 @@ class NetworkAPI(rpc_proxy.RpcProxy):
                 instance_id=instance_id, instance_uuid=instance_uuid,
                 rxtx_factor=rxtx_factor, host=host, project_id=project_id))
 
+    def get_instances_nw_info(self, ctxt, instances):
+        return self.call(ctxt, self.make_msg('get_instances_nw_info',
+                instances=instances), version='1.7')
+
     def validate_networks(self, ctxt, networks):
         return self.call(ctxt, self.make_msg('validate_networks',
                 networks=networks))
@@ -153,13 +153,47 @@ def send_update_with_states(context, instance, old_vm_state, new_vm_state,
                     instance=instance)
 
 
+def send_updates_with_states(context, instances, old_vm_state, new_vm_state,
+        old_task_state, new_task_state, service="compute", host=None):
+    """Send compute.instance.update notifications for instances going through
+    the same state change, like the instances created by one request.
+
+    The system metadata comes from the instances, and their bandwidth usage
+    is looked up together.
+    """
+
+    if not CONF.notify_on_state_change:
+        # skip all this if updates are disabled
+        return
+
+    (audit_start, audit_end) = audit_period_bounds(current_period=True)
+    bandwidths = bandwidth_usages(instances, audit_start)
+
+    for instance in instances:
+        system_metadata = instance.get('system_metadata')
+        if system_metadata is not None:
+            system_metadata = dict((item['key'], item['value'])
+                                   for item in system_metadata)
+        try:
+            _send_instance_update_notification(context, instance,
+                    old_vm_state=old_vm_state, old_task_state=old_task_state,
+                    new_vm_state=new_vm_state, new_task_state=new_task_state,
+                    service=service, host=host,
+                    system_metadata=system_metadata,
+                    bandwidth=bandwidths[instance['uuid']])
+        except Exception:
+            LOG.exception(_("Failed to send state update notification"),
+                    instance=instance)
+
+
 def _send_instance_update_notification(context, instance, old_vm_state=None,
             old_task_state=None, new_vm_state=None, new_task_state=None,
-            service="compute", host=None):
+            service="compute", host=None, system_metadata=None,
+            bandwidth=None):
     """Send 'compute.instance.update' notification to inform observers
     about instance state changes"""
 
-    payload = info_from_instance(context, instance, None, None)
+    payload = info_from_instance(context, instance, None, system_metadata)
 
     if not new_vm_state:
         new_vm_state = instance["vm_state"]
@@ -181,8 +215,9 @@ def _send_instance_update_notification(context, instance, old_vm_state=None,
     payload["audit_period_ending"] = audit_end
 
     # add bw usage info:
-    bw = bandwidth_usage(instance, audit_start)
-    payload["bandwidth"] = bw
+    if bandwidth is None:
+        bandwidth = bandwidth_usage(instance, audit_start)
+    payload["bandwidth"] = bandwidth
 
     publisher_id = notifier_api.publisher_id(service, host)
 
@@ -214,42 +249,62 @@ def bandwidth_usage(instance_ref, audit_start,
     """Get bandwidth usage information for the instance for the
     specified audit period.
     """
+    return bandwidth_usages([instance_ref], audit_start,
+            ignore_missing_network_data)[instance_ref['uuid']]
 
-    admin_context = nova.context.get_admin_context(read_deleted='yes')
-
-    if (instance_ref.get('info_cache') and
-        instance_ref['info_cache'].get('network_info') is not None):
-
-        cached_info = instance_ref['info_cache']['network_info']
-        nw_info = network_model.NetworkInfo.hydrate(cached_info)
-    else:
-        try:
-            nw_info = network.API().get_instance_nw_info(admin_context,
-                    instance_ref)
-        except Exception:
-            LOG.exception(_('Failed to get nw_info'), instance=instance_ref)
-            if ignore_missing_network_data:
-                return
-            raise
-
-    macs = [vif['address'] for vif in nw_info]
-    uuids = [instance_ref["uuid"]]
 
-    bw_usages = db.bw_usage_get_by_uuids(admin_context, uuids, audit_start)
-    bw_usages = [b for b in bw_usages if b.mac in macs]
+def bandwidth_usages(instance_refs, audit_start,
+        ignore_missing_network_data=True):
+    """Get bandwidth usage information for instances for the specified
+    audit period, keyed by instance uuid.
+    """
 
-    bw = {}
+    admin_context = nova.context.get_admin_context(read_deleted='yes')
 
+    nw_infos = {}
+    usages = {}
+    for instance_ref in instance_refs:
+        if (instance_ref.get('info_cache') and
+            instance_ref['info_cache'].get('network_info') is not None):
+
+            cached_info = instance_ref['info_cache']['network_info']
+            nw_info = network_model.NetworkInfo.hydrate(cached_info)
+        else:
+            try:
+                nw_info = network.API().get_instance_nw_info(admin_context,
+                        instance_ref)
+            except Exception:
+                LOG.exception(_('Failed to get nw_info'),
+                              instance=instance_ref)
+                if ignore_missing_network_data:
+                    usages[instance_ref['uuid']] = None
+                    continue
+                raise
+        nw_infos[instance_ref['uuid']] = nw_info
+        usages[instance_ref['uuid']] = {}
+
+    if not nw_infos:
+        return usages
+
+    bw_usages = db.bw_usage_get_by_uuids(admin_context, nw_infos.keys(),
+                                         audit_start)
     for b in bw_usages:
+        nw_info = nw_infos.get(b.uuid)
+        if nw_info is None:
+            continue
+        macs = [vif['address'] for vif in nw_info]
+        if b.mac not in macs:
+            continue
+
         label = 'net-name-not-found-%s' % b['mac']
         for vif in nw_info:
             if vif['address'] == b['mac']:
                 label = vif['network']['label']
                 break
 
-        bw[label] = dict(bw_in=b.bw_in, bw_out=b.bw_out)
+        usages[b.uuid][label] = dict(bw_in=b.bw_in, bw_out=b.bw_out)
 
-    return bw
+    return usages
 
 
 def image_meta(system_metadata):
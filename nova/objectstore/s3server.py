@@ -40,11 +40,13 @@ import hashlib
 import os
 import os.path
 import urllib
+import uuid
 
 import routes
 import webob
 
 from nova.openstack.common import cfg
+from nova.openstack.common import excutils
 from nova.openstack.common import fileutils
 from nova import paths
 from nova import utils
@@ -66,6 +68,15 @@ s3_opts = [
 CONF = cfg.CONF
 CONF.register_opts(s3_opts)
 
+CHUNK_SIZE = 64 * 1024
+
+# Most keys a bucket listing returns, like S3
+MAX_KEYS = 1000
+
+# Objects are written here and then renamed into their bucket. S3 bucket
+# names can't start with a dot, so this is never mistaken for one.
+TEMP_DIRECTORY = '.tmp'
+
 
 def get_wsgi_server():
     return wsgi.Server("S3 Objectstore",
@@ -95,10 +106,46 @@ class S3Application(wsgi.Router):
                 controller=lambda *a, **kw: BucketHandler(self)(*a, **kw))
         self.directory = os.path.abspath(root_directory)
         fileutils.ensure_tree(self.directory)
+        self.temp_directory = os.path.join(self.directory, TEMP_DIRECTORY)
+        fileutils.ensure_tree(self.temp_directory)
         self.bucket_depth = bucket_depth
+        # Sorted object names of the buckets listed so far. They are read
+        # from disk once and then kept current by the handlers.
+        self.object_names = {}
         super(S3Application, self).__init__(mapper)
 
 
+class FileIter(object):
+    """Iterates over a file in chunks, or over a range of it.
+
+    Ranges are read from a response with conditional_response set, and
+    only the requested part of the file is read.
+    """
+
+    def __init__(self, file, start=0, stop=None):
+        self.file = file
+        self.start = start
+        self.stop = stop
+
+    def __iter__(self):
+        self.file.seek(self.start)
+        left = self.stop - self.start if self.stop is not None else -1
+        while left != 0:
+            size = CHUNK_SIZE if left < 0 else min(CHUNK_SIZE, left)
+            chunk = self.file.read(size)
+            if not chunk:
+                break
+            if left > 0:
+                left -= len(chunk)
+            yield chunk
+
+    def app_iter_range(self, start, stop):
+        return FileIter(self.file, start, stop)
+
+    def close(self):
+        self.file.close()
+
+
 class BaseRequestHandler(object):
     """Base class emulating Tornado's web framework pattern in WSGI.
 
@@ -179,6 +226,9 @@ class BaseRequestHandler(object):
 
         if isinstance(value, basestring):
             parts.append(utils.xhtml_escape(value))
+        elif isinstance(value, bool):
+            # S3 clients only take lower case
+            parts.append(str(value).lower())
         elif isinstance(value, int) or isinstance(value, long):
             parts.append(str(value))
         elif isinstance(value, datetime.datetime):
@@ -194,6 +244,23 @@ class BaseRequestHandler(object):
         else:
             raise Exception("Unknown S3 value type %r", value)
 
+    def _object_names(self, bucket_name, path):
+        """Return the sorted names of the objects in a bucket."""
+        object_names = self.application.object_names.get(bucket_name)
+        if object_names is not None:
+            return object_names
+        object_names = []
+        for root, dirs, files in os.walk(path):
+            for file_name in files:
+                object_names.append(os.path.join(root, file_name))
+        skip = len(path) + 1
+        for i in range(self.application.bucket_depth):
+            skip += 2 * (i + 1) + 1
+        object_names = [n[skip:] for n in object_names]
+        object_names.sort()
+        self.application.object_names[bucket_name] = object_names
+        return object_names
+
     def _object_path(self, bucket, object_name):
         if self.application.bucket_depth < 1:
             return os.path.abspath(os.path.join(
@@ -211,6 +278,8 @@ class RootHandler(BaseRequestHandler):
         names = os.listdir(self.application.directory)
         buckets = []
         for name in names:
+            if name == TEMP_DIRECTORY:
+                continue
             path = os.path.join(self.application.directory, name)
             info = os.stat(path)
             buckets.append({
@@ -227,7 +296,8 @@ class BucketHandler(BaseRequestHandler):
     def get(self, bucket_name):
         prefix = self.get_argument("prefix", u"")
         marker = self.get_argument("marker", u"")
-        max_keys = int(self.get_argument("max-keys", 50000))
+        max_keys = min(int(self.get_argument("max-keys", MAX_KEYS)),
+                       MAX_KEYS)
         path = os.path.abspath(os.path.join(self.application.directory,
                                             bucket_name))
         terse = int(self.get_argument("terse", 0))
@@ -235,15 +305,7 @@ class BucketHandler(BaseRequestHandler):
             not os.path.isdir(path)):
             self.set_status(404)
             return
-        object_names = []
-        for root, dirs, files in os.walk(path):
-            for file_name in files:
-                object_names.append(os.path.join(root, file_name))
-        skip = len(path) + 1
-        for i in range(self.application.bucket_depth):
-            skip += 2 * (i + 1) + 1
-        object_names = [n[skip:] for n in object_names]
-        object_names.sort()
+        object_names = self._object_names(bucket_name, path)
         contents = []
 
         start_pos = 0
@@ -253,7 +315,7 @@ class BucketHandler(BaseRequestHandler):
             start_pos = bisect.bisect_left(object_names, prefix, start_pos)
 
         truncated = False
-        for object_name in object_names[start_pos:]:
+        for object_name in object_names[start_pos:start_pos + max_keys + 1]:
             if not object_name.startswith(prefix):
                 break
             if len(contents) >= max_keys:
@@ -287,6 +349,7 @@ class BucketHandler(BaseRequestHandler):
             self.set_status(403)
             return
         fileutils.ensure_tree(path)
+        self.application.object_names.pop(bucket_name, None)
         self.finish()
 
     def delete(self, bucket_name):
@@ -300,6 +363,7 @@ class BucketHandler(BaseRequestHandler):
             self.set_status(403)
             return
         os.rmdir(path)
+        self.application.object_names.pop(bucket_name, None)
         self.set_status(204)
         self.finish()
 
@@ -312,15 +376,16 @@ class ObjectHandler(BaseRequestHandler):
             not os.path.isfile(path)):
             self.set_status(404)
             return
-        info = os.stat(path)
+        object_file = open(path, "r")
+        info = os.fstat(object_file.fileno())
         self.set_header("Content-Type", "application/unknown")
         self.set_header("Last-Modified", datetime.datetime.utcfromtimestamp(
             info.st_mtime))
-        object_file = open(path, "r")
-        try:
-            self.finish(object_file.read())
-        finally:
-            object_file.close()
+        # The file is streamed, and webob answers Range requests with the
+        # part of it they ask for
+        self.response.conditional_response = True
+        self.response.app_iter = FileIter(object_file)
+        self.response.content_length = info.st_size
 
     def put(self, bucket, object_name):
         object_name = urllib.unquote(object_name)
@@ -336,11 +401,23 @@ class ObjectHandler(BaseRequestHandler):
             return
         directory = os.path.dirname(path)
         fileutils.ensure_tree(directory)
-        object_file = open(path, "w")
-        object_file.write(self.request.body)
-        object_file.close()
-        self.set_header('ETag',
-                        '"%s"' % hashlib.md5(self.request.body).hexdigest())
+        # Readers see the old object or the new one, never a partial write
+        md5 = hashlib.md5()
+        temp_path = os.path.join(self.application.temp_directory,
+                                 uuid.uuid4().hex)
+        try:
+            with open(temp_path, "w") as object_file:
+                body_file = self.request.body_file
+                for chunk in iter(lambda: body_file.read(CHUNK_SIZE), ''):
+                    md5.update(chunk)
+                    object_file.write(chunk)
+            os.rename(temp_path, path)
+        except Exception:
+            with excutils.save_and_reraise_exception():
+                if os.path.exists(temp_path):
+                    os.unlink(temp_path)
+        self._add_object_name(bucket, object_name)
+        self.set_header('ETag', '"%s"' % md5.hexdigest())
         self.finish()
 
     def delete(self, bucket, object_name):
@@ -351,5 +428,22 @@ class ObjectHandler(BaseRequestHandler):
             self.set_status(404)
             return
         os.unlink(path)
+        self._remove_object_name(bucket, object_name)
         self.set_status(204)
         self.finish()
+
+    def _add_object_name(self, bucket, object_name):
+        object_names = self.application.object_names.get(bucket)
+        if object_names is None:
+            return
+        i = bisect.bisect_left(object_names, object_name)
+        if i == len(object_names) or object_names[i] != object_name:
+            object_names.insert(i, object_name)
+
+    def _remove_object_name(self, bucket, object_name):
+        object_names = self.application.object_names.get(bucket)
+        if object_names is None:
+            return
+        i = bisect.bisect_left(object_names, object_name)
+        if i < len(object_names) and object_names[i] == object_name:
+            del object_names[i]
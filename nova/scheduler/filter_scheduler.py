@@ -25,6 +25,7 @@ from nova.openstack.common import log as logging
 from nova.openstack.common.notifier import api as notifier
 from nova.scheduler import driver
 from nova.scheduler import scheduler_options
+from nova import tracing
 
 CONF = cfg.CONF
 LOG = logging.getLogger(__name__)
@@ -237,6 +238,7 @@ class FilterScheduler(driver.Scheduler):
                     "instance %(instance_uuid)s") % locals()
             raise exception.NoValidHost(reason=msg)
 
+    @tracing.traced('scheduler.schedule')
     def _schedule(self, context, request_spec, filter_properties,
                   instance_uuids=None):
         """Returns a list of hosts that meet the required specs,
@@ -466,6 +466,12 @@ class Service(object):
                            periodic_interval_max=self.periodic_interval_max)
             self.timers.append(periodic)
 
+        if CONF.lock_stats_interval:
+            lock_stats = utils.LoopingCall(utils.log_lock_stats)
+            lock_stats.start(interval=CONF.lock_stats_interval,
+                             initial_delay=CONF.lock_stats_interval)
+            self.timers.append(lock_stats)
+
     def _create_service_ref(self, context):
         service_ref = db.service_create(context,
                                         {'host': self.host,
@@ -19,7 +19,6 @@
 
 from nova.openstack.common import cfg
 from nova.openstack.common import importutils
-from nova.openstack.common import lockutils
 from nova.openstack.common import log as logging
 from nova import utils
 
@@ -43,7 +42,7 @@ class API(object):
         'db': 'nova.servicegroup.drivers.db.DbDriver'
     }
 
-    @lockutils.synchronized('nova.servicegroup.api.new', 'nova-')
+    @utils.synchronized('nova.servicegroup.api.new')
     def __new__(cls, *args, **kwargs):
 
         if not cls._driver:
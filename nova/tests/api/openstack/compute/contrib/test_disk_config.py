@@ -123,7 +123,13 @@ class DiskConfigTestCase(test.TestCase):
 
             return inst
 
+        def fake_instance_create_multi(context, values_list):
+            return [fake_instance_create(context, inst)
+                    for inst in values_list]
+
         self.stubs.Set(nova.db, 'instance_create', fake_instance_create)
+        self.stubs.Set(nova.db, 'instance_create_multi',
+                       fake_instance_create_multi)
 
         self.app = compute.APIRouter(init_only=('servers', 'images'))
 
@@ -1728,6 +1728,9 @@ class ServersControllerCreateTest(test.TestCase):
             self.instance_cache_by_uuid[instance['uuid']] = instance
             return instance
 
+        def instance_create_multi(context, values_list):
+            return [instance_create(context, inst) for inst in values_list]
+
         def instance_get(context, instance_id):
             """Stub for compute/api create() pulling in instance after
             scheduling
@@ -1770,6 +1773,7 @@ class ServersControllerCreateTest(test.TestCase):
         self.stubs.Set(db, 'project_get_networks',
                        project_get_networks)
         self.stubs.Set(db, 'instance_create', instance_create)
+        self.stubs.Set(db, 'instance_create_multi', instance_create_multi)
         self.stubs.Set(db, 'instance_system_metadata_update',
                 fake_method)
         self.stubs.Set(db, 'instance_get', instance_get)
@@ -2809,79 +2809,83 @@ class ComputeTestCase(BaseTestCase):
 
     def test_heal_instance_info_cache(self):
         # Update on every call for the test
-        self.flags(heal_instance_info_cache_interval=-1)
+        self.flags(heal_instance_info_cache_interval=-1,
+                   heal_instance_info_cache_batch_size=2)
         ctxt = context.get_admin_context()
 
         instance_map = {}
         instances = []
-        for x in xrange(5):
+        for x in xrange(6):
             uuid = 'fake-uuid-%s' % x
             instance_map[uuid] = {'uuid': uuid, 'host': CONF.host}
             instances.append(instance_map[uuid])
 
-        call_info = {'get_all_by_host': 0, 'get_by_uuid': 0,
-                'get_nw_info': 0, 'expected_instance': None}
+        call_info = {'get_all_by_host': 0, 'get_by_filters': 0,
+                     'get_nw_info': 0, 'healed': []}
 
         def fake_instance_get_all_by_host(context, host):
             call_info['get_all_by_host'] += 1
             return instances[:]
 
-        def fake_instance_get_by_uuid(context, instance_uuid):
-            if instance_uuid not in instance_map:
-                raise exception.InstanceNotFound(instance_id=instance_uuid)
-            call_info['get_by_uuid'] += 1
-            return instance_map[instance_uuid]
-
-        # NOTE(comstud): Override the stub in setUp()
-        def fake_get_instance_nw_info(context, instance):
-            # Note that this exception gets caught in compute/manager
-            # and is ignored.  However, the below increment of
-            # 'get_nw_info' won't happen, and you'll get an assert
-            # failure checking it below.
-            self.assertEqual(call_info['expected_instance'], instance)
+        def fake_instance_get_all_by_filters(context, filters):
+            call_info['get_by_filters'] += 1
+            return [instance_map[uuid] for uuid in filters['uuid']
+                    if uuid in instance_map]
+
+        def fake_get_instances_nw_info(context, instances, update_cache):
+            self.assertFalse(update_cache)
             call_info['get_nw_info'] += 1
+            return dict((instance['uuid'],
+                         network_model.NetworkInfo.hydrate([]))
+                        for instance in instances)
+
+        def fake_info_cache_update(context, instance, values):
+            self.assertEqual(values, {'network_info': '[]'})
+            call_info['healed'].append(instance['uuid'])
 
         self.stubs.Set(self.compute.conductor_api, 'instance_get_all_by_host',
                 fake_instance_get_all_by_host)
-        self.stubs.Set(self.compute.conductor_api, 'instance_get_by_uuid',
-                fake_instance_get_by_uuid)
-        self.stubs.Set(self.compute, '_get_instance_nw_info',
-                fake_get_instance_nw_info)
+        self.stubs.Set(self.compute.conductor_api,
+                'instance_get_all_by_filters',
+                fake_instance_get_all_by_filters)
+        self.stubs.Set(self.compute.network_api, 'get_instances_nw_info',
+                fake_get_instances_nw_info)
+        self.stubs.Set(self.compute.conductor_api,
+                'instance_info_cache_update', fake_info_cache_update)
 
-        call_info['expected_instance'] = instances[0]
         self.compute._heal_instance_info_cache(ctxt)
         self.assertEqual(1, call_info['get_all_by_host'])
-        self.assertEqual(0, call_info['get_by_uuid'])
+        self.assertEqual(0, call_info['get_by_filters'])
         self.assertEqual(1, call_info['get_nw_info'])
+        self.assertEqual(['fake-uuid-0', 'fake-uuid-1'], call_info['healed'])
 
-        call_info['expected_instance'] = instances[1]
+        call_info['healed'] = []
         self.compute._heal_instance_info_cache(ctxt)
         self.assertEqual(1, call_info['get_all_by_host'])
-        self.assertEqual(1, call_info['get_by_uuid'])
+        self.assertEqual(1, call_info['get_by_filters'])
         self.assertEqual(2, call_info['get_nw_info'])
+        self.assertEqual(['fake-uuid-2', 'fake-uuid-3'], call_info['healed'])
 
         # Make an instance switch hosts
-        instances[2]['host'] = 'not-me'
+        instances[4]['host'] = 'not-me'
         # Make an instance disappear
-        instance_map.pop(instances[3]['uuid'])
-        # '2' and '3' should be skipped..
-        call_info['expected_instance'] = instances[4]
+        instance_map.pop(instances[5]['uuid'])
+        # Neither is left in the batch, so the network API isn't called
         self.compute._heal_instance_info_cache(ctxt)
-        self.assertEqual(call_info['get_all_by_host'], 1)
-        # Incremented for '2' and '4'.. '3' caused a raise above.
-        self.assertEqual(call_info['get_by_uuid'], 3)
-        self.assertEqual(call_info['get_nw_info'], 3)
+        self.assertEqual(1, call_info['get_all_by_host'])
+        self.assertEqual(2, call_info['get_by_filters'])
+        self.assertEqual(2, call_info['get_nw_info'])
         # Should be no more left.
         self.assertEqual(len(self.compute._instance_uuids_to_heal), 0)
 
-        # This should cause a DB query now so we get first instance
+        # This should cause a DB query now so we get the first batch
         # back again
-        call_info['expected_instance'] = instances[0]
+        call_info['healed'] = []
         self.compute._heal_instance_info_cache(ctxt)
-        self.assertEqual(call_info['get_all_by_host'], 2)
-        # Stays the same, beacuse the instance came from the DB
-        self.assertEqual(call_info['get_by_uuid'], 3)
-        self.assertEqual(call_info['get_nw_info'], 4)
+        self.assertEqual(2, call_info['get_all_by_host'])
+        self.assertEqual(2, call_info['get_by_filters'])
+        self.assertEqual(3, call_info['get_nw_info'])
+        self.assertEqual(['fake-uuid-0', 'fake-uuid-1'], call_info['healed'])
 
     def test_poll_rescued_instances(self):
         timed_out_time = timeutils.utcnow() - datetime.timedelta(minutes=5)
@@ -5219,7 +5223,6 @@ class ComputeAPITestCase(BaseTestCase):
     def test_update_block_device_mapping(self):
         swap_size = 1
         instance_type = {'swap': swap_size}
-        instance = self._create_fake_instance()
         mappings = [
                 {'virtual': 'ami', 'device': 'sda1'},
                 {'virtual': 'root', 'device': '/dev/sda1'},
@@ -5268,12 +5271,12 @@ class ComputeAPITestCase(BaseTestCase):
                 {'device_name': '/dev/sdd4',
                  'no_device': True}]
 
-        self.compute_api._update_image_block_device_mapping(
-            self.context, instance_type, instance['uuid'], mappings)
+        templates = self.compute_api._merge_block_device_mapping([],
+            self.compute_api._image_block_device_mapping(instance_type,
+                                                         mappings))
 
         bdms = [self._parse_db_block_device_mapping(bdm_ref)
-                for bdm_ref in db.block_device_mapping_get_all_by_instance(
-                    self.context, instance['uuid'])]
+                for bdm_ref in templates]
         expected_result = [
             {'virtual_name': 'swap', 'device_name': '/dev/sdb1',
              'volume_size': swap_size},
@@ -5288,12 +5291,12 @@ class ComputeAPITestCase(BaseTestCase):
         expected_result.sort()
         self.assertThat(bdms, matchers.DictListMatches(expected_result))
 
-        self.compute_api._update_block_device_mapping(
-            self.context, instance_types.get_default_instance_type(),
-            instance['uuid'], block_device_mapping)
+        self.compute_api._merge_block_device_mapping(templates,
+            self.compute_api._block_device_mapping_values(
+                instance_types.get_default_instance_type(),
+                block_device_mapping))
         bdms = [self._parse_db_block_device_mapping(bdm_ref)
-                for bdm_ref in db.block_device_mapping_get_all_by_instance(
-                    self.context, instance['uuid'])]
+                for bdm_ref in templates]
         expected_result = [
             {'snapshot_id': '00000000-aaaa-bbbb-cccc-000000000000',
                'device_name': '/dev/sda1'},
@@ -5324,12 +5327,6 @@ class ComputeAPITestCase(BaseTestCase):
         expected_result.sort()
         self.assertThat(bdms, matchers.DictListMatches(expected_result))
 
-        for bdm in db.block_device_mapping_get_all_by_instance(
-            self.context, instance['uuid']):
-            db.block_device_mapping_destroy(self.context, bdm['id'])
-        instance = db.instance_get_by_uuid(self.context, instance['uuid'])
-        self.compute.terminate_instance(self.context, instance)
-
     def test_volume_size(self):
         ephemeral_size = 2
         swap_size = 3
@@ -5372,6 +5369,39 @@ class ComputeAPITestCase(BaseTestCase):
 
         db.instance_destroy(self.context, refs[0]['uuid'])
 
+    def test_create_multiple_instances_together(self):
+        # The instances and their block device mappings are created in
+        # one go.
+        calls = []
+        orig_create_multi = db.instance_create_multi
+
+        def fake_create_multi(context, values_list):
+            calls.append(len(values_list))
+            return orig_create_multi(context, values_list)
+
+        self.stubs.Set(db, 'instance_create_multi', fake_create_multi)
+        bdm = [{'device_name': '/dev/vdb',
+                'snapshot_id': '00000000-aaaa-bbbb-cccc-000000000000'}]
+        (refs, resv_id) = self.compute_api.create(self.context,
+                instance_types.get_default_instance_type(), None,
+                min_count=3, max_count=3, block_device_mapping=bdm,
+                metadata={'foo': 'bar'})
+        try:
+            self.assertEqual(calls, [3])
+            self.assertEqual(len(set(ref['uuid'] for ref in refs)), 3)
+            for ref in refs:
+                bdms = db.block_device_mapping_get_all_by_instance(
+                    self.context, ref['uuid'])
+                self.assertEqual(['/dev/vdb'],
+                                 [mapping['device_name']
+                                  for mapping in bdms])
+                self.assertEqual({'foo': 'bar'},
+                                 db.instance_metadata_get(self.context,
+                                                          ref['uuid']))
+        finally:
+            for ref in refs:
+                db.instance_destroy(self.context, ref['uuid'])
+
     def test_instance_architecture(self):
         # Test the instance architecture.
         i_ref = self._create_fake_instance()
@@ -145,6 +145,35 @@ class FakeNetworkManager(network_manager.NetworkManager):
             return [ip for ip in self.fixed_ips
                     if ip['virtual_interface_id'] == vif_id]
 
+        def fixed_ips_by_address_filter(self, context, address=None,
+                                        address_like=None):
+            # Rather than emulating LIKE return every row when there is a
+            # pattern, the manager checks them against the regex anyway.
+            results = []
+            for vif in self.vifs:
+                for fixed_ip in self.fixed_ips_by_virtual_interface(
+                        context, vif['id']):
+                    if address_like is None and \
+                            fixed_ip['address'] != address:
+                        continue
+                    floating_addresses = [
+                            floating_ip['address']
+                            for floating_ip in self.floating_ips
+                            if floating_ip['fixed_ip_id'] == fixed_ip['id']]
+                    for floating_address in floating_addresses or [None]:
+                        results.append(
+                                {'instance_uuid': vif['instance_uuid'],
+                                 'address': fixed_ip['address'],
+                                 'floating_address': floating_address})
+            return results
+
+        def virtual_interface_get_all_with_ipv6(self, context):
+            return [{'instance_uuid': vif['instance_uuid'],
+                     'address': vif['address'],
+                     'cidr_v6': self.network_get(context,
+                                                 vif['network_id'])['cidr_v6']}
+                    for vif in self.vifs]
+
     def __init__(self):
         self.db = self.FakeDB()
         self.deallocate_called = None
@@ -219,6 +219,7 @@ policy_data = """
     "network:remove_fixed_ip_from_instance": "",
     "network:add_network_to_project": "",
     "network:get_instance_nw_info": "",
+    "network:get_instances_nw_info": "",
 
     "network:get_dns_domains": "",
     "network:add_dns_entry": "",
@@ -24,6 +24,10 @@ class GuestFS(object):
         self.mounts = []
         self.files = {}
         self.auginit = False
+        self.attach_method = 'appliance'
+
+    def set_attach_method(self, attach_method):
+        self.attach_method = attach_method
 
     def launch(self):
         self.running = True
@@ -37,7 +41,13 @@ class GuestFS(object):
         self.closed = True
 
     def add_drive_opts(self, file, *args, **kwargs):
-        self.drives.append((file, kwargs['format']))
+        self.drives.append((file, kwargs['format'], kwargs.get('label')))
+
+    def remove_drive(self, label):
+        self.drives = [drive for drive in self.drives if drive[2] != label]
+
+    def umount_all(self):
+        self.mounts = []
 
     def inspect_os(self):
         return ["/dev/guestvgf/lv_root"]
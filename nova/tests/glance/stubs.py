@@ -14,6 +14,8 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import StringIO
+
 import glanceclient.exc
 
 
@@ -22,7 +24,20 @@ NOW_GLANCE_FORMAT = "2010-10-11T10:30:22"
 
 class StubGlanceClient(object):
 
+    endpoint_scheme = 'http'
+    endpoint_hostname = 'fake_host'
+    endpoint_port = 9292
+    endpoint_path = ''
+    auth_token = None
+
+    # How the fake server answers requests for image data
+    honour_ranges = True
+    keep_alive = False
+    max_response_size = None
+
     def __init__(self, images=None):
+        self.image_data = {}
+        self.requests = []
         self._images = []
         _images = images or []
         map(lambda image: self.create(**image), _images)
@@ -56,6 +71,9 @@ class StubGlanceClient(object):
         self.get(image_id)
         return []
 
+    def get_connection(self):
+        return FakeConnection(self)
+
     def create(self, **metadata):
         metadata['created_at'] = NOW_GLANCE_FORMAT
         metadata['updated_at'] = NOW_GLANCE_FORMAT
@@ -110,3 +128,68 @@ class FakeImage(object):
             self.__dict__['raw'][key] = value
         except KeyError:
             raise AttributeError(key)
+
+
+class FakeConnection(object):
+    """A connection serving the data of the images of a client."""
+
+    def __init__(self, client):
+        self.client = client
+
+    def request(self, method, url, headers=None):
+        self.url = url
+        self.headers = headers or {}
+        self.client.requests.append((self, self.headers.get('Range')))
+
+    def getresponse(self):
+        image_id = self.url.split('/')[-1]
+        image = self.client.get(image_id)
+        data = self.client.image_data.get(image_id, '')
+        headers = {}
+        checksum = getattr(image, 'checksum', None)
+        if checksum:
+            headers['x-image-meta-checksum'] = checksum
+
+        status = 200
+        byte_range = self.headers.get('Range')
+        if byte_range and self.client.honour_ranges:
+            start, end = byte_range.split('=')[1].split('-')
+            start = int(start)
+            end = int(end) + 1 if end else len(data)
+            if start >= len(data):
+                headers['content-range'] = 'bytes */%d' % len(data)
+                return FakeResponse(416, headers, '', True)
+            status = 206
+            headers['content-range'] = 'bytes %d-%d/%d' % (start, end - 1,
+                                                           len(data))
+            data = data[start:end]
+        headers['content-length'] = str(len(data))
+        if self.client.max_response_size is not None:
+            data = data[:self.client.max_response_size]
+        return FakeResponse(status, headers, data,
+                            not self.client.keep_alive)
+
+    def close(self):
+        pass
+
+
+class FakeResponse(object):
+    def __init__(self, status, headers, body, will_close):
+        self.status = status
+        self.headers = headers
+        self.will_close = will_close
+        self.length = int(headers.get('content-length', 0))
+        self._body = StringIO.StringIO(body)
+
+    def getheader(self, name, default=None):
+        return self.headers.get(name, default)
+
+    def read(self, amt=None):
+        chunk = self._body.read(amt)
+        self.length -= len(chunk)
+        if not chunk or not self.length:
+            self._body.close()
+        return chunk
+
+    def isclosed(self):
+        return self._body.closed
@@ -17,7 +17,10 @@
 
 
 import datetime
+import hashlib
+import os
 import random
+import StringIO
 import time
 
 import glanceclient.exc
@@ -30,6 +33,7 @@ from nova import test
 from nova.tests.api.openstack import fakes
 from nova.tests.glance import stubs as glance_stubs
 from nova.tests import matchers
+from nova import utils
 
 CONF = cfg.CONF
 
@@ -102,6 +106,8 @@ class TestGlanceImageService(test.TestCase):
 
     def setUp(self):
         super(TestGlanceImageService, self).setUp()
+        self.stubs.Set(glance, '_idle_connections', {})
+        self.stubs.Set(glance, '_server_failures', {})
         fakes.stub_out_compute_api_snapshot(self.stubs)
 
         client = glance_stubs.StubGlanceClient()
@@ -468,6 +474,159 @@ class TestGlanceImageService(test.TestCase):
         self.flags(glance_num_retries=1)
         service.download(self.context, image_id, writer)
 
+    def _create_image_with_data(self, data, **kwargs):
+        client = glance_stubs.StubGlanceClient()
+        for key, value in kwargs.items():
+            setattr(client, key, value)
+        client.create(id='1', size=len(data),
+                      checksum=hashlib.md5(data).hexdigest())
+        client.image_data['1'] = data
+        return client, self._create_image_service(client)
+
+    def test_download_resumes(self):
+        self.flags(glance_num_retries=2)
+        data = 'abcdefghij' * 2
+        client, service = self._create_image_with_data(data,
+                max_response_size=7)
+        writer = StringIO.StringIO()
+        service.download(self.context, '1', writer)
+        self.assertEqual(writer.getvalue(), data)
+        self.assertEqual([byte_range for conn, byte_range in client.requests],
+                         ['bytes=0-', 'bytes=7-19', 'bytes=14-19'])
+
+    def test_download_cut_short_too_often(self):
+        self.flags(glance_num_retries=1)
+        client, service = self._create_image_with_data('abcdefghij' * 2,
+                max_response_size=7)
+        self.assertRaises(exception.GlanceConnectionFailed,
+                service.download, self.context, '1', StringIO.StringIO())
+
+    def test_download_checksum_mismatch(self):
+        client, service = self._create_image_with_data('abcdefghij')
+        client.image_data['1'] = 'abcdefghiX'
+        self.assertRaises(exception.ImageUnacceptable,
+                service.download, self.context, '1', StringIO.StringIO())
+
+    def test_download_resumes_file(self):
+        data = 'abcdefghij' * 2
+        for honour_ranges in (True, False):
+            client, service = self._create_image_with_data(data,
+                    honour_ranges=honour_ranges)
+            with utils.tempdir() as tmpdir:
+                path = os.path.join(tmpdir, 'image.part')
+                with open(path, 'wb') as image_file:
+                    image_file.write(data[:5])
+                with open(path, 'r+b') as image_file:
+                    image_file.seek(0, os.SEEK_END)
+                    service.download(self.context, '1', image_file)
+                with open(path, 'rb') as image_file:
+                    self.assertEqual(image_file.read(), data)
+            self.assertEqual([byte_range for conn, byte_range
+                              in client.requests], ['bytes=5-'])
+
+    def test_download_resumes_file_checksum_mismatch(self):
+        client, service = self._create_image_with_data('abcdefghij')
+        with utils.tempdir() as tmpdir:
+            path = os.path.join(tmpdir, 'image.part')
+            with open(path, 'wb') as image_file:
+                image_file.write('XXXXX')
+            with open(path, 'r+b') as image_file:
+                image_file.seek(0, os.SEEK_END)
+                self.assertRaises(exception.ImageUnacceptable,
+                        service.download, self.context, '1', image_file)
+
+    def _download_to_part_file(self, service, part_data):
+        with utils.tempdir() as tmpdir:
+            path = os.path.join(tmpdir, 'image.part')
+            with open(path, 'wb') as image_file:
+                image_file.write(part_data)
+            with open(path, 'r+b') as image_file:
+                image_file.seek(0, os.SEEK_END)
+                service.download(self.context, '1', image_file)
+            with open(path, 'rb') as image_file:
+                return image_file.read()
+
+    def test_download_complete_file_checksum_mismatch(self):
+        # Nothing is left to fetch, so the checksum comes from the image
+        client, service = self._create_image_with_data('abcdefghij')
+        self.assertRaises(exception.ImageUnacceptable,
+                          self._download_to_part_file, service, 'abcdefghiX')
+        self.assertEqual([byte_range for conn, byte_range in client.requests],
+                         ['bytes=10-'])
+
+    def test_download_complete_file(self):
+        client, service = self._create_image_with_data('abcdefghij')
+        self.assertEqual(self._download_to_part_file(service, 'abcdefghij'),
+                         'abcdefghij')
+
+    def test_download_restarts_file_larger_than_image(self):
+        client, service = self._create_image_with_data('abcdefghij')
+        self.assertEqual(self._download_to_part_file(service,
+                                                     'abcdefghijklm'),
+                         'abcdefghij')
+        self.assertEqual([byte_range for conn, byte_range in client.requests],
+                         ['bytes=13-', 'bytes=0-'])
+
+    def test_download_in_ranges(self):
+        self.flags(glance_download_connections=3)
+        self.stubs.Set(glance, 'MIN_RANGE_SIZE', 4)
+        data = 'abcdefghij' * 2
+        client, service = self._create_image_with_data(data)
+        with utils.tempdir() as tmpdir:
+            path = os.path.join(tmpdir, 'image')
+            with open(path, 'wb') as image_file:
+                service.download(self.context, '1', image_file)
+            with open(path, 'rb') as image_file:
+                self.assertEqual(image_file.read(), data)
+        self.assertEqual(sorted(byte_range for conn, byte_range
+                                in client.requests),
+                         ['bytes=0-5', 'bytes=12-19', 'bytes=6-11'])
+
+    def test_download_reuses_connections(self):
+        client, service = self._create_image_with_data('abcdefghij',
+                keep_alive=True)
+        service.download(self.context, '1', StringIO.StringIO())
+        service.download(self.context, '1', StringIO.StringIO())
+        self.assertEqual(len(client.requests), 2)
+        self.assertTrue(client.requests[0][0] is client.requests[1][0])
+
+    def test_download_through_http_client(self):
+        # glanceclient releases after 0.9.0 keep the HTTPClient apart
+        http, service = self._create_image_with_data('abcdefghij')
+
+        class Client(object):
+            images = http.images
+            http_client = http
+
+        service = self._create_image_service(Client())
+        writer = StringIO.StringIO()
+        service.download(self.context, '1', writer)
+        self.assertEqual(writer.getvalue(), 'abcdefghij')
+        self.assertEqual(len(http.requests), 1)
+
+    def test_download_without_connections(self):
+        class MyGlanceStubClient(glance_stubs.StubGlanceClient):
+            """A client of a glanceclient without get_connection()."""
+            get_connection = None
+
+            def data(self, image_id):
+                data = self.image_data[image_id]
+                return [data[:4], data[4:]]
+
+        client = MyGlanceStubClient()
+        client.create(id='1', size=10,
+                      checksum=hashlib.md5('abcdefghij').hexdigest())
+        client.image_data['1'] = 'abcdefghij'
+        service = self._create_image_service(client)
+        writer = StringIO.StringIO()
+        service.download(self.context, '1', writer)
+        self.assertEqual(writer.getvalue(), 'abcdefghij')
+
+        # Resuming fetches the whole image and skips what is there
+        self.assertEqual(self._download_to_part_file(service, 'abcdef'),
+                         'abcdefghij')
+        self.assertEqual(client.requests, [])
+
     def test_client_forbidden_converts_to_imagenotauthed(self):
         class MyGlanceStubClient(glance_stubs.StubGlanceClient):
             """A client that raises a Forbidden exception."""
@@ -554,6 +713,7 @@ class TestGlanceClientWrapper(test.TestCase):
 
     def setUp(self):
         super(TestGlanceClientWrapper, self).setUp()
+        self.stubs.Set(glance, '_server_failures', {})
         # host1 has no scheme, which is http by default
         self.flags(glance_api_servers=['host1:9292', 'https://host2:9293',
             'http://host3:9294'])
@@ -707,6 +867,21 @@ class TestGlanceClientWrapper(test.TestCase):
         client2.call(ctxt, 1, 'get', 'meow')
         self.assertEqual(info['num_calls'], 2)
 
+    def test_failed_server_tried_last(self):
+        def _fake_shuffle(servers):
+            pass
+
+        self.stubs.Set(random, 'shuffle', _fake_shuffle)
+        glance._server_failures[('host1', 9292, False)] = time.time()
+        servers = glance.get_api_servers()
+        self.assertEqual([servers.next() for i in xrange(3)],
+                         [('host2', 9293, True), ('host3', 9294, False),
+                          ('host1', 9292, False)])
+
+        self.flags(glance_server_retry_interval=-1)
+        self.assertEqual(glance.get_api_servers().next(),
+                         ('host1', 9292, False))
+
 
 class TestGlanceUrl(test.TestCase):
 
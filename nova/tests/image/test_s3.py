@@ -15,12 +15,15 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import base64
 import binascii
 import eventlet
 import mox
 import os
-import tempfile
+import StringIO
+import tarfile
 
+from Crypto.Cipher import AES
 import fixtures
 
 from nova import context
@@ -68,18 +71,20 @@ ami_manifest_xml = """<?xml version="1.0" ?>
 file_manifest_xml = """<?xml version="1.0" ?>
 <manifest>
         <image>
-                <ec2_encrypted_key>foo</ec2_encrypted_key>
+                <ec2_encrypted_key>%(key)s</ec2_encrypted_key>
                 <user_encrypted_key>foo</user_encrypted_key>
-                <ec2_encrypted_iv>foo</ec2_encrypted_iv>
-                <parts count="1">
-                        <part index="0">
-                               <filename>foo</filename>
-                        </part>
+                <ec2_encrypted_iv>%(iv)s</ec2_encrypted_iv>
+                <parts count="%(count)d">
+%(parts)s
                 </parts>
         </image>
 </manifest>
 """
 
+file_manifest_part_xml = """                        <part index="%(index)d">
+                               <filename>%(filename)s</filename>
+                        </part>"""
+
 
 class TestS3ImageService(test.TestCase):
     def setUp(self):
@@ -161,12 +166,40 @@ class TestS3ImageService(test.TestCase):
              'no_device': True}]
         self.assertEqual(block_device_mapping, expected_bdm)
 
-    def test_s3_create_is_public(self):
-        metadata = {'properties': {
-                    'image_location': 'mybucket/my.img.manifest.xml'},
-                    'name': 'mybucket/my.img'}
-        handle, tempf = tempfile.mkstemp(dir='/tmp')
+    def _make_bundle(self, image_data, part_size=4096):
+        """Return the manifest and parts of an encrypted bundle."""
+        tarball = StringIO.StringIO()
+        tar_file = tarfile.open(fileobj=tarball, mode='w:gz')
+        directory = tarfile.TarInfo('my.img')
+        directory.type = tarfile.DIRTYPE
+        tar_file.addfile(directory)
+        member = tarfile.TarInfo('my.img/image')
+        member.size = len(image_data)
+        tar_file.addfile(member, StringIO.StringIO(image_data))
+        tar_file.close()
+
+        data = tarball.getvalue()
+        padding = AES.block_size - len(data) % AES.block_size
+        data += chr(padding) * padding
+        self.image_key = os.urandom(16)
+        self.image_iv = os.urandom(16)
+        encrypted = AES.new(self.image_key, AES.MODE_CBC,
+                            self.image_iv).encrypt(data)
 
+        parts = {}
+        part_xml = []
+        for index, offset in enumerate(xrange(0, len(encrypted), part_size)):
+            filename = 'my.img.part.%d' % index
+            parts[filename] = encrypted[offset:offset + part_size]
+            part_xml.append(file_manifest_part_xml % {'index': index,
+                                                      'filename': filename})
+        manifest = file_manifest_xml % {'key': binascii.b2a_hex('key'),
+                                        'iv': binascii.b2a_hex('iv'),
+                                        'count': len(parts),
+                                        'parts': '\n'.join(part_xml)}
+        return manifest, parts
+
+    def _stub_bundle(self, manifest, parts):
         ignore = mox.IgnoreArg()
         mockobj = self.mox.CreateMockAnything()
         self.stubs.Set(self.image_service, '_conn', mockobj)
@@ -176,23 +209,60 @@ class TestS3ImageService(test.TestCase):
         self.stubs.Set(mockobj, 'get_key', mockobj)
         mockobj(ignore).AndReturn(mockobj)
         self.stubs.Set(mockobj, 'get_contents_as_string', mockobj)
-        mockobj().AndReturn(file_manifest_xml)
-        self.stubs.Set(self.image_service, '_download_file', mockobj)
-        mockobj(ignore, ignore, ignore).AndReturn(tempf)
-        self.stubs.Set(binascii, 'a2b_hex', mockobj)
-        mockobj(ignore).AndReturn('foo')
-        mockobj(ignore).AndReturn('foo')
-        self.stubs.Set(self.image_service, '_decrypt_image', mockobj)
-        mockobj(ignore, ignore, ignore, ignore, ignore).AndReturn(mockobj)
-        self.stubs.Set(self.image_service, '_untarzip_image', mockobj)
-        mockobj(ignore, ignore).AndReturn(tempf)
+        mockobj().AndReturn(manifest)
         self.mox.ReplayAll()
 
+        self.downloaded = []
+
+        def fake_download_file(bucket, filename, local_dir):
+            self.downloaded.append(filename)
+            local_filename = os.path.join(local_dir, filename)
+            with open(local_filename, 'w') as part:
+                part.write(parts[filename])
+            return local_filename
+
+        def fake_decrypt_text(context, project_id, text):
+            text = base64.b64decode(text)
+            if text == 'key':
+                return binascii.b2a_hex(self.image_key)
+            return binascii.b2a_hex(self.image_iv)
+
+        self.uploaded = []
+        real_update = self.image_service.service.update
+
+        def fake_update(context, image_id, metadata, data=None, **kwargs):
+            if data is not None:
+                self.uploaded.append(data.read())
+            return real_update(context, image_id, metadata, **kwargs)
+
+        self.stubs.Set(self.image_service, '_download_file',
+                       fake_download_file)
+        self.stubs.Set(self.image_service.cert_rpcapi, 'decrypt_text',
+                       fake_decrypt_text)
+        self.stubs.Set(self.image_service.service, 'update', fake_update)
+        self.stubs.Set(eventlet, 'spawn_n', lambda f: f())
+
+    def _s3_create(self):
+        metadata = {'properties': {
+                    'image_location': 'mybucket/my.img.manifest.xml'},
+                    'name': 'mybucket/my.img'}
         img = self.image_service._s3_create(self.context, metadata)
-        eventlet.sleep()
         translated = self.image_service._translate_id_to_uuid(self.context,
                                                               img)
         uuid = translated['id']
+        return uuid, fake.FakeImageService().show(self.context, uuid)
+
+    def test_s3_create_is_public(self):
+        self.flags(s3_image_download_concurrency=2)
+        image_data = os.urandom(20000)
+        manifest, parts = self._make_bundle(image_data)
+        self._stub_bundle(manifest, parts)
+
+        uuid, image = self._s3_create()
+        self.assertEqual(self.uploaded, [image_data])
+        self.assertEqual(self.downloaded, sorted(parts))
+        self.assertEqual(image['size'], len(image_data))
+
         image_service = fake.FakeImageService()
         updated_image = image_service.update(self.context, uuid,
                         {'is_public': True}, purge_props=False)
@@ -201,10 +271,20 @@ class TestS3ImageService(test.TestCase):
         self.assertEqual(updated_image['properties']['image_state'],
                           'available')
 
+    def test_s3_create_truncated_part(self):
+        manifest, parts = self._make_bundle(os.urandom(20000))
+        last_part = sorted(parts)[-1]
+        parts[last_part] = parts[last_part][:-1]
+        self._stub_bundle(manifest, parts)
+
+        _uuid, image = self._s3_create()
+        self.assertEqual(image['status'], 'queued')
+        self.assertEqual(image['properties']['image_state'],
+                         'failed_decrypt')
+
     def test_s3_malicious_tarballs(self):
-        self.assertRaises(exception.NovaException,
-            self.image_service._test_for_malicious_tarball,
-            "/unused", os.path.join(os.path.dirname(__file__), 'abs.tar.gz'))
-        self.assertRaises(exception.NovaException,
-            self.image_service._test_for_malicious_tarball,
-            "/unused", os.path.join(os.path.dirname(__file__), 'rel.tar.gz'))
+        for tarball in ('abs.tar.gz', 'rel.tar.gz'):
+            with open(os.path.join(os.path.dirname(__file__),
+                                   tarball)) as tar_file:
+                self.assertRaises(exception.NovaException,
+                    self.image_service._open_tarball_image, tar_file)
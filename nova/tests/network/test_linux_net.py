@@ -17,6 +17,7 @@
 
 import os
 
+import fixtures
 import mox
 
 from nova import context
@@ -302,6 +303,48 @@ class LinuxNetworkTestCase(test.TestCase):
 
         self.assertEquals(actual_hosts, expected)
 
+    def test_get_dhcp_host_entries_for_nw00(self):
+        self.flags(use_single_default_gateway=True)
+
+        expected = {
+            "192.168.0.100": "DE:AD:BE:EF:00:00,fake_instance00.novalocal,"
+                             "192.168.0.100,net:NW-0",
+            "192.168.1.101": "DE:AD:BE:EF:00:03,fake_instance01.novalocal,"
+                             "192.168.1.101,net:NW-3",
+            "192.168.0.102": "DE:AD:BE:EF:00:04,fake_instance00.novalocal,"
+                             "192.168.0.102,net:NW-4",
+        }
+        actual = self.driver.get_dhcp_host_entries(self.context, networks[0])
+
+        self.assertEquals(actual, expected)
+
+    def test_get_dhcp_host_entry(self):
+        self.flags(use_single_default_gateway=True)
+        data = get_associated(self.context, 0)[0]
+        vif = {'id': data['vif_id'], 'address': data['vif_address']}
+        instance = {'hostname': data['instance_hostname']}
+
+        actual = self.driver.get_dhcp_host_entry(data['address'], vif,
+                                                 instance)
+
+        self.assertEquals(actual, self.driver._host_dhcp(data))
+
+    def test_update_dhcp_hosts(self):
+        tempdir = self.useFixture(fixtures.TempDir()).path
+        self.flags(networks_path=tempdir)
+        self.stubs.Set(self.driver, 'restart_dhcp',
+                       lambda *args, **kwargs: None)
+        entries = {'10.0.0.10': 'host10',
+                   '10.0.0.9': 'host9'}
+
+        self.driver.update_dhcp_hosts(self.context, 'eth0', networks[0],
+                                      entries)
+
+        conffile = self.driver._dhcp_file('eth0', 'conf')
+        with open(conffile) as f:
+            self.assertEquals(f.read(), 'host9\nhost10')
+        self.assertEquals(os.listdir(tempdir), ['nova-eth0.conf'])
+
     def test_get_dns_hosts_for_nw00(self):
         expected = (
                 "192.168.0.100\tfake_instance00.novalocal\n"
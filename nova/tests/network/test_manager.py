@@ -205,6 +205,38 @@ class FlatNetworkTestCase(test.TestCase):
                       for ip_num in xrange(1, num_fixed_ips + 1)]
             self.assertThat(info['ips'], matchers.DictListMatches(check))
 
+    def test_get_instances_nw_info(self):
+        vifs = [{'uuid': 'vif1', 'instance_uuid': 'uuid1', 'network_id': 1},
+                {'uuid': 'vif2', 'instance_uuid': 'uuid2', 'network_id': 1},
+                {'uuid': 'vif3', 'instance_uuid': 'uuid2', 'network_id': 2}]
+        self.mox.StubOutWithMock(db, 'virtual_interface_get_by_instances')
+        self.mox.StubOutWithMock(self.network, '_get_network_by_id')
+        self.mox.StubOutWithMock(self.network, 'build_network_info_model')
+
+        db.virtual_interface_get_by_instances(self.context,
+                ['uuid1', 'uuid2', 'uuid3']).AndReturn(vifs)
+        # Each network is only looked up once
+        self.network._get_network_by_id(self.context, 1).AndReturn('net1')
+        self.network.build_network_info_model(self.context, vifs[:1],
+                {'vif1': 'net1'}, 1.0, 'host1').AndReturn('info1')
+        self.network._get_network_by_id(self.context, 2).AndReturn('net2')
+        self.network.build_network_info_model(self.context, vifs[1:],
+                {'vif2': 'net1', 'vif3': 'net2'}, 2.0,
+                'host2').AndReturn('info2')
+        self.network.build_network_info_model(self.context, [], {}, 1.0,
+                'host1').AndReturn('info3')
+        self.mox.ReplayAll()
+
+        instances = [{'instance_uuid': 'uuid1', 'rxtx_factor': 1.0,
+                      'host': 'host1'},
+                     {'instance_uuid': 'uuid2', 'rxtx_factor': 2.0,
+                      'host': 'host2'},
+                     {'instance_uuid': 'uuid3', 'rxtx_factor': 1.0,
+                      'host': 'host1'}]
+        result = self.network.get_instances_nw_info(self.context, instances)
+        self.assertEqual({'uuid1': 'info1', 'uuid2': 'info2',
+                          'uuid3': 'info3'}, result)
+
     def test_validate_networks(self):
         self.mox.StubOutWithMock(db, 'network_get')
         self.mox.StubOutWithMock(db, 'network_get_all_by_uuids')
@@ -1469,6 +1501,42 @@ class CommonNetworkTestCase(test.TestCase):
         self.assertEqual(len(res), 1)
         self.assertEqual(res[0]['instance_uuid'], _vifs[2]['instance_uuid'])
 
+    def test_get_instance_uuids_by_floating_ip(self):
+        manager = fake_network.FakeNetworkManager()
+        _vifs = manager.db.virtual_interface_get_all(None)
+        fake_context = context.RequestContext('user', 'project')
+
+        res = manager.get_instance_uuids_by_ip_filter(fake_context,
+                                                      {'ip': '172.16.1.2'})
+        self.assertEqual(res, [{'instance_uuid': _vifs[1]['instance_uuid'],
+                                'ip': '172.16.1.2'}])
+
+        # A matching fixed ip is only returned once
+        res = manager.get_instance_uuids_by_ip_filter(fake_context,
+                                                      {'ip': '17.\\.16\\.'})
+        self.assertEqual([r['ip'] for r in res],
+                         ['172.16.0.1', '172.16.0.2', '173.16.0.2'])
+
+    def test_ip_filter_to_like(self):
+        self.assertEqual(network_manager._ip_filter_to_like('10.0.'),
+                         '10_0_%')
+        self.assertEqual(network_manager._ip_filter_to_like('^10\\.0\\.'),
+                         '10.0.%')
+        self.assertEqual(network_manager._ip_filter_to_like('10.0.0.1$'),
+                         '10_0_0_1')
+        self.assertEqual(network_manager._ip_filter_to_like('172.16.0.*'),
+                         '172_16_0%')
+        self.assertEqual(network_manager._ip_filter_to_like('10.0+'),
+                         '10_0%')
+        self.assertEqual(network_manager._ip_filter_to_like('1[0-9]'),
+                         '1%')
+        self.assertEqual(network_manager._ip_filter_to_like('10\\d'),
+                         '10%')
+        self.assertEqual(network_manager._ip_filter_to_like('10_%'),
+                         '10\\_\\%%')
+        self.assertEqual(network_manager._ip_filter_to_like('.*'), '%')
+        self.assertEqual(network_manager._ip_filter_to_like('10|11'), '%')
+
     def test_get_network(self):
         manager = fake_network.FakeNetworkManager()
         fake_context = context.RequestContext('user', 'project')
@@ -1565,6 +1633,94 @@ class RPCAllocateTestCase(test.TestCase):
         self.assertEqual(rval, address)
 
 
+class DhcpHostsTestCase(test.TestCase):
+    """Tests the cached dhcp-host entries of the network manager."""
+    def setUp(self):
+        super(DhcpHostsTestCase, self).setUp()
+        self.network = network_manager.VlanManager(host=HOST)
+        self.context = context.get_admin_context()
+        self.loads = []
+        self.writes = []
+
+        def fake_get_entries(context, network_ref):
+            self.loads.append(network_ref['id'])
+            return {'192.168.0.100': 'host00'}
+
+        def fake_update_hosts(context, dev, network_ref, entries):
+            self.writes.append(dict(entries))
+
+        self.stubs.Set(self.network.driver, 'get_dhcp_host_entries',
+                       fake_get_entries)
+        self.stubs.Set(self.network.driver, 'update_dhcp_hosts',
+                       fake_update_hosts)
+        self.stubs.Set(self.network.driver, 'get_dhcp_host_entry',
+                       lambda address, vif, instance: instance['hostname'])
+
+    def test_update_dhcp_reads_db_once(self):
+        self.flags(dhcp_hosts_update_delay=0)
+        self.network._update_dhcp(self.context, 'br100', networks[0])
+        self.network._add_dhcp_host(networks[0], '192.168.0.101',
+                                    {'hostname': 'host01'}, {'id': 1})
+        self.network._update_dhcp(self.context, 'br100', networks[0])
+        self.network._remove_dhcp_host(networks[0]['id'], '192.168.0.100')
+        self.network._update_dhcp(self.context, 'br100', networks[0])
+
+        self.assertEqual(self.loads, [networks[0]['id']])
+        self.assertEqual(self.writes,
+                         [{'192.168.0.100': 'host00'},
+                          {'192.168.0.100': 'host00',
+                           '192.168.0.101': 'host01'},
+                          {'192.168.0.101': 'host01'}])
+
+    def test_add_dhcp_host_before_load_is_ignored(self):
+        self.flags(dhcp_hosts_update_delay=0)
+        self.network._add_dhcp_host(networks[0], '192.168.0.101',
+                                    {'hostname': 'host01'}, {'id': 1})
+        self.network._update_dhcp(self.context, 'br100', networks[0])
+        self.assertEqual(self.writes, [{'192.168.0.100': 'host00'}])
+
+    def test_invalidate_dhcp_hosts_reloads(self):
+        self.flags(dhcp_hosts_update_delay=0)
+        self.network._update_dhcp(self.context, 'br100', networks[0])
+        self.network._invalidate_dhcp_hosts(networks[0]['id'])
+        self.network._update_dhcp(self.context, 'br100', networks[0])
+        self.assertEqual(self.loads, [networks[0]['id']] * 2)
+
+    def test_update_dhcp_is_debounced(self):
+        self.flags(dhcp_hosts_update_delay=1)
+        scheduled = []
+
+        class FakeThread(object):
+            def cancel(self):
+                pass
+
+        def fake_spawn_after(seconds, func, *args, **kwargs):
+            scheduled.append((seconds, func, args, kwargs))
+            return FakeThread()
+
+        self.stubs.Set(network_manager.greenthread, 'spawn_after',
+                       fake_spawn_after)
+        for i in xrange(3):
+            self.network._update_dhcp(self.context, 'br100', networks[0])
+        self.assertEqual(len(scheduled), 1)
+        self.assertEqual(self.writes, [])
+
+        seconds, func, args, kwargs = scheduled[0]
+        self.assertEqual(seconds, 1)
+        func(*args, **kwargs)
+        self.assertEqual(len(self.writes), 1)
+
+        self.network._update_dhcp(self.context, 'br100', networks[0])
+        self.assertEqual(len(scheduled), 2)
+
+    def test_cancel_dhcp_update(self):
+        self.flags(dhcp_hosts_update_delay=1)
+        self.network._update_dhcp(self.context, 'br100', networks[0])
+        self.network._cancel_dhcp_update(networks[0]['id'])
+        self.assertEqual(self.network._dhcp_updates, {})
+        self.assertEqual(self.writes, [])
+
+
 class BackdoorPortTestCase(test.TestCase):
     """Tests nova.network.manager.get_backdoor_port."""
     def setUp(self):
@@ -350,3 +350,21 @@ class NetworkInfoTests(test.TestCase):
                 [fake_network_cache_model.new_ip({'address': '10.10.0.2'}),
                  fake_network_cache_model.new_ip(
                         {'address': '10.10.0.3'})] * 4)
+
+    def test_vif_addresses(self):
+        vif = fake_network_cache_model.new_vif()
+        vif['network']['subnets'][0]['ips'][0].add_floating_ip(
+                fake_network_cache_model.new_ip({'address': '192.168.1.1',
+                                                 'type': 'floating'}))
+        ninfo = model.NetworkInfo([vif, model.VIF(id=2, network=None)])
+        expected = [{'network_id': 1,
+                     'network_label': 'public',
+                     'fixed_ips': vif.fixed_ips(),
+                     'floating_ips': vif.floating_ips()}]
+        self.assertEqual(model.vif_addresses(ninfo), expected)
+
+        addresses = model.vif_addresses(ninfo.json())
+        self.assertEqual(addresses, expected)
+        self.assertFalse(isinstance(addresses[0]['fixed_ips'][0],
+                                    model.IP))
+        self.assertEqual(model.vif_addresses(None), [])
@@ -15,6 +15,7 @@
 #
 # vim: tabstop=4 shiftwidth=4 softtabstop=4
 
+import datetime
 import uuid
 
 import mox
@@ -25,7 +26,10 @@ from nova.network import model
 from nova.network import quantumv2
 from nova.network.quantumv2 import api as quantumapi
 from nova.openstack.common import cfg
+from nova.openstack.common import timeutils
 from nova import test
+from quantumclient import client as quantum_client
+from quantumclient.common import exceptions as quantum_exceptions
 from quantumclient.v2_0 import client
 
 
@@ -86,19 +90,29 @@ class MyComparator(mox.Comparator):
 
 
 class TestQuantumClient(test.TestCase):
+    def setUp(self):
+        super(TestQuantumClient, self).setUp()
+        quantumv2._clear_auth_token()
+        self.addCleanup(quantumv2._clear_auth_token)
+        self.addCleanup(timeutils.clear_time_override)
+        self.tokens = []
+
+        def fake_list_networks(quantum, **kwargs):
+            self.assertEqual(quantum.httpclient.endpoint_url,
+                             CONF.quantum_url)
+            self.tokens.append(quantum.httpclient.auth_token)
+            return {'networks': []}
+
+        self.stubs.Set(client.Client, 'list_networks', fake_list_networks)
+
     def test_withtoken(self):
         self.flags(quantum_url='http://anyhost/')
         self.flags(quantum_url_timeout=30)
         my_context = context.RequestContext('userid',
                                             'my_tenantid',
                                             auth_token='token')
-        self.mox.StubOutWithMock(client.Client, "__init__")
-        client.Client.__init__(
-            endpoint_url=CONF.quantum_url,
-            token=my_context.auth_token,
-            timeout=CONF.quantum_url_timeout).AndReturn(None)
-        self.mox.ReplayAll()
-        quantumv2.get_client(my_context)
+        quantumv2.get_client(my_context).list_networks()
+        self.assertEqual(self.tokens, ['token'])
 
     def test_withouttoken_keystone_connection_error(self):
         self.flags(quantum_auth_strategy='keystone')
@@ -113,13 +127,49 @@ class TestQuantumClient(test.TestCase):
         self.flags(quantum_url='http://anyhost/')
         self.flags(quantum_url_timeout=30)
         my_context = context.RequestContext('userid', 'my_tenantid')
-        self.mox.StubOutWithMock(client.Client, "__init__")
-        client.Client.__init__(
-            endpoint_url=CONF.quantum_url,
-            auth_strategy=None,
-            timeout=CONF.quantum_url_timeout).AndReturn(None)
-        self.mox.ReplayAll()
-        quantumv2.get_client(my_context)
+        quantumv2.get_client(my_context).list_networks()
+        self.assertEqual(self.tokens, [None])
+
+    def _stub_authenticate(self, lifetime):
+        def fake_authenticate(httpclient):
+            httpclient.auth_token = 'admin_token%d' % len(self.authenticated)
+            expires = timeutils.utcnow() + datetime.timedelta(
+                seconds=lifetime)
+            httpclient.service_catalog = quantum_client.ServiceCatalog(
+                {'access': {'token': {'id': httpclient.auth_token,
+                                      'expires': timeutils.isotime(expires)}}})
+            self.authenticated.append(httpclient.auth_token)
+
+        self.authenticated = []
+        self.stubs.Set(quantum_client.HTTPClient, 'authenticate',
+                       fake_authenticate)
+
+    def test_admin_token_cached(self):
+        self._stub_authenticate(3600)
+        timeutils.set_time_override()
+        my_context = context.RequestContext('userid', 'my_tenantid')
+        quantumv2.get_client(my_context, admin=True).list_networks()
+        quantumv2.get_client(my_context, admin=True).list_networks()
+        self.assertEqual(self.authenticated, ['admin_token0'])
+        # Replaced shortly before it expires
+        timeutils.advance_time_seconds(3600 - 60)
+        quantumv2.get_client(my_context, admin=True).list_networks()
+        self.assertEqual(self.tokens,
+                         ['admin_token0', 'admin_token0', 'admin_token1'])
+
+    def test_admin_token_revoked(self):
+        self._stub_authenticate(3600)
+
+        def fake_list_ports(quantum, **kwargs):
+            self.tokens.append(quantum.httpclient.auth_token)
+            if quantum.httpclient.auth_token == 'admin_token0':
+                raise quantum_exceptions.Unauthorized()
+            return {'ports': []}
+
+        self.stubs.Set(client.Client, 'list_ports', fake_list_ports)
+        my_context = context.RequestContext('userid', 'my_tenantid')
+        quantumv2.get_client(my_context, admin=True).list_ports()
+        self.assertEqual(self.tokens, ['admin_token0', 'admin_token1'])
 
 
 class TestQuantumv2(test.TestCase):
@@ -238,6 +288,22 @@ class TestQuantumv2(test.TestCase):
         self.assertTrue(model.IP(address='8.8.%s.1' % id_suffix) in
                         nw_inf[index]['network']['subnets'][0]['dns'])
 
+    def _stub_admin_client(self):
+        # Network info is built with the admin client alone
+        self.mox.ResetAll()
+        quantumv2.get_client(mox.IgnoreArg(),
+                             admin=True).MultipleTimes().AndReturn(
+            self.moxed_client)
+
+    def _instance_ports(self, port_data, instance=None):
+        instance = instance or self.instance
+        ports = []
+        for port in port_data:
+            port = dict(port)
+            port['device_id'] = instance['uuid']
+            ports.append(port)
+        return ports
+
     def _get_instance_nw_info(self, number):
         api = quantumapi.API()
         self.mox.StubOutWithMock(api.db, 'instance_info_cache_update')
@@ -246,24 +312,24 @@ class TestQuantumv2(test.TestCase):
                                           mox.IgnoreArg())
         port_data = number == 1 and self.port_data1 or self.port_data2
         self.moxed_client.list_ports(
-            tenant_id=self.instance['project_id'],
-            device_id=self.instance['uuid']).AndReturn(
-                {'ports': port_data})
+            tenant_id=[self.instance['project_id']],
+            device_id=[self.instance['uuid']]).AndReturn(
+                {'ports': self._instance_ports(port_data)})
         nets = number == 1 and self.nets1 or self.nets2
         self.moxed_client.list_networks(
-            tenant_id=self.instance['project_id'],
-            shared=False).AndReturn({'networks': nets})
-        self.moxed_client.list_networks(
-            shared=True).AndReturn({'networks': []})
-        for i in xrange(1, number + 1):
-            subnet_data = i == 1 and self.subnet_data1 or self.subnet_data2
-            self.moxed_client.list_subnets(
-                id=mox.SameElementsAs(['my_subid%s' % i])).AndReturn(
-                    {'subnets': subnet_data})
-            self.moxed_client.list_ports(
-                network_id=subnet_data[0]['network_id'],
-                device_owner='network:dhcp').AndReturn(
-                    {'ports': []})
+            id=mox.SameElementsAs([net['id'] for net in nets])).AndReturn(
+                {'networks': nets})
+        subnet_data = self.subnet_data1 + self.subnet_data2[:number - 1]
+        self.moxed_client.list_subnets(
+            id=mox.SameElementsAs(['my_subid%s' % i
+                                   for i in xrange(1, number + 1)])
+            ).AndReturn({'subnets': subnet_data})
+        self.moxed_client.list_ports(
+            network_id=mox.SameElementsAs([net['id'] for net in nets]),
+            device_owner='network:dhcp').AndReturn({'ports': []})
+        self.moxed_client.list_floatingips(
+            port_id=[port['id'] for port in port_data]).AndReturn(
+                {'floatingips': []})
         self.mox.ReplayAll()
         nw_inf = api.get_instance_nw_info(self.context, self.instance)
         for i in xrange(0, number):
@@ -271,65 +337,59 @@ class TestQuantumv2(test.TestCase):
 
     def test_get_instance_nw_info_1(self):
         # Test to get one port in one network and subnet.
-        quantumv2.get_client(mox.IgnoreArg(),
-                             admin=True).MultipleTimes().AndReturn(
-            self.moxed_client)
+        self._stub_admin_client()
         self._get_instance_nw_info(1)
 
     def test_get_instance_nw_info_2(self):
         # Test to get one port in each of two networks and subnets.
-        quantumv2.get_client(mox.IgnoreArg(),
-                             admin=True).MultipleTimes().AndReturn(
-            self.moxed_client)
+        self._stub_admin_client()
         self._get_instance_nw_info(2)
 
     def test_get_instance_nw_info_with_nets(self):
         # Test get instance_nw_info with networks passed in.
+        self._stub_admin_client()
         api = quantumapi.API()
         self.mox.StubOutWithMock(api.db, 'instance_info_cache_update')
         api.db.instance_info_cache_update(
             mox.IgnoreArg(),
             self.instance['uuid'], mox.IgnoreArg())
         self.moxed_client.list_ports(
-            tenant_id=self.instance['project_id'],
-            device_id=self.instance['uuid']).AndReturn(
-                {'ports': self.port_data1})
+            tenant_id=[self.instance['project_id']],
+            device_id=[self.instance['uuid']]).AndReturn(
+                {'ports': self._instance_ports(self.port_data1)})
         self.moxed_client.list_subnets(
             id=mox.SameElementsAs(['my_subid1'])).AndReturn(
                 {'subnets': self.subnet_data1})
         self.moxed_client.list_ports(
-            network_id='my_netid1',
+            network_id=['my_netid1'],
             device_owner='network:dhcp').AndReturn(
                 {'ports': self.dhcp_port_data1})
-        quantumv2.get_client(mox.IgnoreArg(),
-                             admin=True).MultipleTimes().AndReturn(
-            self.moxed_client)
+        self.moxed_client.list_floatingips(
+            port_id=['my_portid1']).AndReturn({'floatingips': []})
         self.mox.ReplayAll()
         nw_inf = api.get_instance_nw_info(self.context,
                                           self.instance,
                                           networks=self.nets1)
         self._verify_nw_info(nw_inf, 0)
+        subnet = nw_inf[0]['network']['subnets'][0]
+        self.assertEquals('10.0.1.9', subnet.get_meta('dhcp_server'))
 
     def test_get_instance_nw_info_without_subnet(self):
         # Test get instance_nw_info for a port without subnet.
+        self._stub_admin_client()
         api = quantumapi.API()
         self.mox.StubOutWithMock(api.db, 'instance_info_cache_update')
         api.db.instance_info_cache_update(
             mox.IgnoreArg(),
             self.instance['uuid'], mox.IgnoreArg())
         self.moxed_client.list_ports(
-            tenant_id=self.instance['project_id'],
-            device_id=self.instance['uuid']).AndReturn(
-                {'ports': self.port_data3})
-        self.moxed_client.list_networks(
-            shared=False,
-            tenant_id=self.instance['project_id']).AndReturn(
-                {'networks': self.nets1})
+            tenant_id=[self.instance['project_id']],
+            device_id=[self.instance['uuid']]).AndReturn(
+                {'ports': self._instance_ports(self.port_data3)})
         self.moxed_client.list_networks(
-            shared=True).AndReturn({'networks': []})
-        quantumv2.get_client(mox.IgnoreArg(),
-                             admin=True).MultipleTimes().AndReturn(
-            self.moxed_client)
+            id=['my_netid1']).AndReturn({'networks': self.nets1})
+        self.moxed_client.list_floatingips(
+            port_id=['my_portid3']).AndReturn({'floatingips': []})
         self.mox.ReplayAll()
 
         nw_inf = api.get_instance_nw_info(self.context,
@@ -342,6 +402,87 @@ class TestQuantumv2(test.TestCase):
         self.assertEquals('my_mac%s' % id_suffix, nw_inf[0]['address'])
         self.assertEquals(0, len(nw_inf[0]['network']['subnets']))
 
+    def test_get_instances_nw_info(self):
+        # The ports of both instances are looked up together.
+        self._stub_admin_client()
+        api = quantumapi.API()
+        instance2 = dict(self.instance, uuid=str(uuid.uuid4()))
+        ports = (self._instance_ports(self.port_data1) +
+                 self._instance_ports(self.port_data2[1:], instance2))
+        self.moxed_client.list_ports(
+            tenant_id=[self.instance['project_id']],
+            device_id=[self.instance['uuid'], instance2['uuid']]).AndReturn(
+                {'ports': ports})
+        self.moxed_client.list_networks(
+            id=mox.SameElementsAs(['my_netid1', 'my_netid2'])).AndReturn(
+                {'networks': self.nets2})
+        self.moxed_client.list_subnets(
+            id=mox.SameElementsAs(['my_subid1', 'my_subid2'])).AndReturn(
+                {'subnets': self.subnet_data1 + self.subnet_data2})
+        self.moxed_client.list_ports(
+            network_id=mox.SameElementsAs(['my_netid1', 'my_netid2']),
+            device_owner='network:dhcp').AndReturn(
+                {'ports': self.dhcp_port_data1})
+        self.moxed_client.list_floatingips(
+            port_id=['my_portid1', 'my_portid2']).AndReturn(
+                {'floatingips': [self.fip_associated]})
+        self.mox.ReplayAll()
+
+        result = api.get_instances_nw_info(self.context,
+                                           [self.instance, instance2],
+                                           update_cache=False)
+        self._verify_nw_info(result[self.instance['uuid']], 0)
+        self.assertEquals([],
+                          result[self.instance['uuid']].floating_ips())
+        nw_inf2 = result[instance2['uuid']]
+        self.assertEquals('my_portid2', nw_inf2[0]['id'])
+        self.assertEquals('my_netname2', nw_inf2[0]['network']['label'])
+        self.assertEquals(['172.24.4.228'],
+                          [ip['address'] for ip in nw_inf2.floating_ips()])
+
+    def test_get_instances_nw_info_chunks_ids(self):
+        # Ids are passed to quantum at most MAX_IDS_PER_QUERY at a time.
+        self.stubs.Set(quantumapi, 'MAX_IDS_PER_QUERY', 1)
+        self._stub_admin_client()
+        api = quantumapi.API()
+        instance2 = dict(self.instance, uuid=str(uuid.uuid4()))
+        ports1 = self._instance_ports(self.port_data1)
+        ports2 = self._instance_ports(self.port_data2[1:], instance2)
+        self.moxed_client.list_ports(
+            tenant_id=[self.instance['project_id']],
+            device_id=[self.instance['uuid']]).AndReturn({'ports': ports1})
+        self.moxed_client.list_ports(
+            tenant_id=[self.instance['project_id']],
+            device_id=[instance2['uuid']]).AndReturn({'ports': ports2})
+        for i in (0, 1):
+            self.moxed_client.list_networks(
+                id=[self.nets2[i]['id']]).InAnyOrder('networks').AndReturn(
+                    {'networks': [self.nets2[i]]})
+        for subnet in self.subnet_data1 + self.subnet_data2:
+            self.moxed_client.list_subnets(
+                id=[subnet['id']]).InAnyOrder('subnets').AndReturn(
+                    {'subnets': [subnet]})
+        for net_id in ('my_netid1', 'my_netid2'):
+            self.moxed_client.list_ports(
+                network_id=[net_id],
+                device_owner='network:dhcp').InAnyOrder('dhcp').AndReturn(
+                    {'ports': []})
+        self.moxed_client.list_floatingips(
+            port_id=['my_portid1']).AndReturn({'floatingips': []})
+        self.moxed_client.list_floatingips(
+            port_id=['my_portid2']).AndReturn(
+                {'floatingips': [self.fip_associated]})
+        self.mox.ReplayAll()
+
+        result = api.get_instances_nw_info(self.context,
+                                           [self.instance, instance2],
+                                           update_cache=False)
+        self._verify_nw_info(result[self.instance['uuid']], 0)
+        nw_inf2 = result[instance2['uuid']]
+        self.assertEquals('my_portid2', nw_inf2[0]['id'])
+        self.assertEquals(['172.24.4.228'],
+                          [ip['address'] for ip in nw_inf2.floating_ips()])
+
     def _allocate_for_instance(self, net_idx=1, **kwargs):
         api = quantumapi.API()
         self.mox.StubOutWithMock(api, 'get_instance_nw_info')
@@ -886,6 +1027,47 @@ class TestQuantumv2(test.TestCase):
         api.associate_floating_ip(self.context, self.instance,
                                   address, fixed_address)
 
+    def test_associate_floating_ip_reassigned(self):
+        api = quantumapi.API()
+        address = self.fip_associated['floating_ip_address']
+        fixed_address = self.fip_associated['fixed_ip_address']
+        fip_id = self.fip_associated['id']
+        fip = dict(self.fip_associated, port_id='orig_port_id')
+        orig_instance = {'uuid': 'orig-instance-uuid'}
+
+        search_opts = {'device_owner': 'compute:nova',
+                       'device_id': self.instance['uuid']}
+        self.moxed_client.list_ports(**search_opts).\
+            AndReturn({'ports': [self.port_data2[1]]})
+        self.moxed_client.list_floatingips(floating_ip_address=address).\
+            AndReturn({'floatingips': [fip]})
+        self.moxed_client.update_floatingip(
+            fip_id, {'floatingip': {'port_id': self.fip_associated['port_id'],
+                                    'fixed_ip_address': fixed_address}})
+        self.moxed_client.show_port('orig_port_id').AndReturn(
+            {'port': {'id': 'orig_port_id',
+                      'device_id': orig_instance['uuid']}})
+        self.mox.StubOutWithMock(api.db, 'instance_get_by_uuid')
+        api.db.instance_get_by_uuid(mox.IgnoreArg(),
+                                    orig_instance['uuid']).\
+            AndReturn(orig_instance)
+
+        # The caches of both instances are refreshed
+        self.mox.StubOutWithMock(api, '_get_instance_nw_info')
+        self.mox.StubOutWithMock(api.db, 'instance_info_cache_update')
+        for instance in (orig_instance, self.instance):
+            nw_info = self.mox.CreateMock(model.NetworkInfo)
+            nw_info.json()
+            api._get_instance_nw_info(mox.IgnoreArg(), instance).\
+                AndReturn(nw_info)
+            api.db.instance_info_cache_update(mox.IgnoreArg(),
+                                              instance['uuid'],
+                                              mox.IgnoreArg())
+
+        self.mox.ReplayAll()
+        api.associate_floating_ip(self.context, self.instance,
+                                  address, fixed_address)
+
     def test_associate_floating_ip_not_found_fixed_ip(self):
         api = quantumapi.API()
         address = self.fip_associated['floating_ip_address']
@@ -185,6 +185,10 @@ class NetworkRpcAPITestCase(test.TestCase):
                 rxtx_factor='fake_factor', host='fake_host',
                 project_id='fake_id')
 
+    def test_get_instances_nw_info(self):
+        self._test_network_api('get_instances_nw_info', rpc_method='call',
+                instances=[{'instance_uuid': 'fake_uuid'}], version='1.7')
+
     def test_validate_networks(self):
         self._test_network_api('validate_networks', rpc_method='call',
                 networks={})
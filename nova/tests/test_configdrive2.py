@@ -16,6 +16,7 @@
 #    under the License.
 
 
+import fixtures
 import mox
 import os
 import tempfile
@@ -23,6 +24,7 @@ import tempfile
 from nova import test
 
 from nova.openstack.common import log
+from nova.tests.virt.disk import test_iso9660
 from nova import utils
 from nova.virt import configdrive
 
@@ -93,3 +95,20 @@ class ConfigDriveTestCase(test.TestCase):
         finally:
             if imagefile:
                 utils.delete_if_exists(imagefile)
+
+    def test_create_configdrive_iso_in_process(self):
+        self.flags(config_drive_use_mkisofs=False)
+        self.mox.StubOutWithMock(utils, 'execute')
+        self.mox.ReplayAll()
+
+        imagefile = os.path.join(self.useFixture(fixtures.TempDir()).path,
+                                 'disk.config')
+        with configdrive.config_drive_helper() as c:
+            c._add_file('this/is/a/path/hello', 'This is some content')
+            c.make_drive(imagefile)
+
+        # No directory tree was written
+        self.assertEqual(c.tempdir, None)
+        self.assertEqual(test_iso9660.read_tree(open(imagefile).read(),
+                                                joliet=True),
+                         {'this/is/a/path/hello': 'This is some content'})
@@ -20,10 +20,16 @@
 """Unit tests for the DB API."""
 
 import datetime
+import random
 import uuid as stdlib_uuid
 
+import sqlalchemy
+
 from nova import context
 from nova import db
+from nova.db.sqlalchemy import api as sqlalchemy_api
+from nova.db.sqlalchemy import models
+from nova.db.sqlalchemy.session import get_engine
 from nova import exception
 from nova.openstack.common import cfg
 from nova.openstack.common import timeutils
@@ -85,6 +91,44 @@ class DbApiTestCase(test.TestCase):
 
         self.flags(osapi_compute_unique_server_name_scope=None)
 
+    def test_instance_create_multi(self):
+        db.security_group_create(self.context,
+                                 {'name': 'web', 'project_id': self.project_id,
+                                  'user_id': self.user_id})
+        values_list = [{'reservation_id': 'a', 'project_id': self.project_id,
+                        'hostname': 'host%d' % i,
+                        'metadata': {'foo': 'bar%d' % i},
+                        'system_metadata': {'image_kernel_id': 'k'},
+                        'info_cache': {'network_info': '[]'},
+                        'security_groups': ['default', 'web']}
+                       for i in xrange(3)]
+        instances = db.instance_create_multi(self.context, values_list)
+
+        self.assertEqual(['host0', 'host1', 'host2'],
+                         [instance['hostname'] for instance in instances])
+        for i, instance in enumerate(instances):
+            instance = db.instance_get_by_uuid(self.context, instance['uuid'])
+            self.assertEqual({'foo': 'bar%d' % i},
+                             dict((item['key'], item['value'])
+                                  for item in instance['metadata']))
+            self.assertEqual(['image_kernel_id'],
+                             [item['key']
+                              for item in instance['system_metadata']])
+            self.assertEqual('[]', instance['info_cache']['network_info'])
+            self.assertEqual(['default', 'web'],
+                             sorted(group['name']
+                                    for group in instance['security_groups']))
+            self.assertTrue(db.get_ec2_instance_id_by_uuid(self.context,
+                                                           instance['uuid']))
+
+    def test_instance_create_multi_unique_hostname(self):
+        self.flags(osapi_compute_unique_server_name_scope='project')
+        self.assertRaises(exception.InstanceExists,
+                          db.instance_create_multi, self.context,
+                          [{'project_id': self.project_id, 'hostname': 'a'},
+                           {'project_id': self.project_id, 'hostname': 'A'}])
+        self.assertEqual([], db.instance_get_all(self.context))
+
     def test_ec2_ids_not_found_are_printable(self):
         def check_exc_format(method):
             try:
@@ -1544,6 +1588,202 @@ class TestIpAllocation(test.TestCase):
         self.assertEqual(fixed_ip['instance_uuid'], self.instance['uuid'])
         self.assertEqual(fixed_ip['network_id'], self.network['id'])
 
+    def test_fixed_ip_associate_pool_uses_every_free_ip(self):
+        for i in xrange(1, 6):
+            self.create_fixed_ip(address='192.168.0.%d' % i,
+                                 network_id=self.network['id'])
+        self.create_fixed_ip(address='192.168.0.6', reserved=True,
+                             network_id=self.network['id'])
+        self.create_fixed_ip(address='192.168.0.7', host='fake_host',
+                             network_id=self.network['id'])
+
+        addresses = set(db.fixed_ip_associate_pool(self.ctxt,
+                                                   self.network['id'],
+                                                   self.instance['uuid'])
+                        for i in xrange(5))
+
+        self.assertEqual(addresses,
+                         set('192.168.0.%d' % i for i in xrange(1, 6)))
+        self.assertRaises(exception.NoMoreFixedIps,
+                          db.fixed_ip_associate_pool,
+                          self.ctxt, self.network['id'],
+                          self.instance['uuid'])
+
+    def test_fixed_ip_associate_pool_sets_network_and_host(self):
+        address = self.create_fixed_ip()
+        self.assertEqual(address,
+                         db.fixed_ip_associate_pool(self.ctxt,
+                                                    self.network['id'],
+                                                    host='fake_host'))
+        fixed_ip = db.fixed_ip_get_by_address(self.ctxt, address)
+        self.assertEqual(fixed_ip['network_id'], self.network['id'])
+        self.assertEqual(fixed_ip['host'], 'fake_host')
+        self.assertEqual(fixed_ip['instance_uuid'], None)
+
+    def test_fixed_ip_associate_pool_prefers_lowest_free_ip(self):
+        addresses = ['192.168.0.3', '192.168.0.1', '192.168.0.2']
+        for address in addresses:
+            self.create_fixed_ip(address=address,
+                                 network_id=self.network['id'])
+        self.stubs.Set(random, 'shuffle', self.fail)
+
+        allocated = [db.fixed_ip_associate_pool(self.ctxt, self.network['id'],
+                                                self.instance['uuid'])
+                     for address in addresses]
+        self.assertEqual(allocated, addresses)
+
+    def test_fixed_ip_associate_pool_skips_ip_taken_concurrently(self):
+        self.create_fixed_ip(address='192.168.0.1',
+                             network_id=self.network['id'])
+        self.create_fixed_ip(address='192.168.0.2',
+                             network_id=self.network['id'])
+        other = db.instance_create(self.ctxt, {})
+        real_claim_row = sqlalchemy_api._claim_row
+        claimed = []
+
+        def fake_claim_row(context, model, free_filters, row_id, values,
+                           session):
+            if not claimed:
+                # Another allocation wins the race for the first row.
+                real_claim_row(context, model, free_filters, row_id,
+                               {'instance_uuid': other['uuid']}, session)
+            claimed.append(row_id)
+            return real_claim_row(context, model, free_filters, row_id,
+                                  values, session)
+
+        self.stubs.Set(sqlalchemy_api, '_claim_row', fake_claim_row)
+        address = db.fixed_ip_associate_pool(self.ctxt, self.network['id'],
+                                             self.instance['uuid'])
+
+        self.assertEqual(address, '192.168.0.2')
+        self.assertEqual(len(claimed), 2)
+        fixed_ip = db.fixed_ip_get_by_address(self.ctxt, '192.168.0.1')
+        self.assertEqual(fixed_ip['instance_uuid'], other['uuid'])
+
+    def test_floating_ip_allocate_address_uses_every_free_ip(self):
+        for i in xrange(1, 4):
+            db.floating_ip_create(self.ctxt, {'address': '10.0.0.%d' % i,
+                                              'pool': 'nova'})
+        db.floating_ip_create(self.ctxt, {'address': '10.0.0.4',
+                                          'pool': 'other'})
+
+        addresses = set(db.floating_ip_allocate_address(self.ctxt,
+                                                        'project1', 'nova')
+                        for i in xrange(3))
+
+        self.assertEqual(addresses,
+                         set('10.0.0.%d' % i for i in xrange(1, 4)))
+        self.assertRaises(exception.NoMoreFloatingIps,
+                          db.floating_ip_allocate_address,
+                          self.ctxt, 'project1', 'nova')
+
+    def test_fixed_ip_bulk_create_from_generator(self):
+        ips = ({'address': '192.168.1.%d' % i,
+                'network_id': self.network['id'],
+                'reserved': i == 0}
+               for i in xrange(256))
+        db.fixed_ip_bulk_create(self.ctxt, ips)
+
+        fixed_ip = db.fixed_ip_get_by_address(self.ctxt, '192.168.1.0')
+        self.assertTrue(fixed_ip['reserved'])
+        self.assertFalse(fixed_ip['deleted'])
+        self.assertNotEqual(fixed_ip['created_at'], None)
+        fixed_ip = db.fixed_ip_get_by_address(self.ctxt, '192.168.1.255')
+        self.assertFalse(fixed_ip['reserved'])
+        self.assertEqual(fixed_ip['network_id'], self.network['id'])
+
+    def test_floating_ip_bulk_create(self):
+        ips = [{'address': '10.0.0.%d' % i, 'pool': 'nova'}
+               for i in xrange(1, 4)]
+        db.floating_ip_bulk_create(self.ctxt, iter(ips))
+        addresses = [ip['address']
+                     for ip in db.floating_ip_get_all(self.ctxt)]
+        self.assertEqual(sorted(addresses),
+                         ['10.0.0.1', '10.0.0.2', '10.0.0.3'])
+
+    def test_floating_ip_bulk_create_existing_address(self):
+        db.floating_ip_create(self.ctxt, {'address': '10.0.0.2'})
+        ips = [{'address': '10.0.0.%d' % i} for i in xrange(1, 4)]
+        self.assertRaises(exception.FloatingIpExists,
+                          db.floating_ip_bulk_create, self.ctxt, ips)
+        # Nothing is created if any address already exists.
+        addresses = [ip['address']
+                     for ip in db.floating_ip_get_all(self.ctxt)]
+        self.assertEqual(addresses, ['10.0.0.2'])
+
+    def _create_vif_with_ips(self, mac, fixed_address, floating_addresses):
+        vif = db.virtual_interface_create(self.ctxt,
+                {'address': mac, 'network_id': self.network['id'],
+                 'instance_uuid': self.instance['uuid']})
+        self.create_fixed_ip(address=fixed_address,
+                             network_id=self.network['id'],
+                             virtual_interface_id=vif['id'])
+        fixed_ip = db.fixed_ip_get_by_address(self.ctxt, fixed_address)
+        for address in floating_addresses:
+            db.floating_ip_create(self.ctxt, {'address': address,
+                                              'fixed_ip_id': fixed_ip['id']})
+
+    def test_fixed_ips_by_address_filter(self):
+        self._create_vif_with_ips('00:00:00:00:00:01', '192.168.5.1',
+                                  ['172.16.0.1', '172.16.0.2'])
+        self._create_vif_with_ips('00:00:00:00:00:02', '192.168.6.1', [])
+        self.create_fixed_ip(address='192.168.5.2',
+                             network_id=self.network['id'])
+
+        result = db.fixed_ips_by_address_filter(self.ctxt,
+                                                address_like='192_168_5%')
+        self.assertEqual(result,
+                         [{'instance_uuid': self.instance['uuid'],
+                           'address': '192.168.5.1',
+                           'floating_address': '172.16.0.1'},
+                          {'instance_uuid': self.instance['uuid'],
+                           'address': '192.168.5.1',
+                           'floating_address': '172.16.0.2'}])
+
+        result = db.fixed_ips_by_address_filter(self.ctxt,
+                                                address_like='172.16.0.2')
+        self.assertEqual([r['floating_address'] for r in result],
+                         ['172.16.0.2'])
+
+        result = db.fixed_ips_by_address_filter(self.ctxt,
+                                                address='192.168.6.1')
+        self.assertEqual(result, [{'instance_uuid': self.instance['uuid'],
+                                   'address': '192.168.6.1',
+                                   'floating_address': None}])
+
+        self.assertEqual(db.fixed_ips_by_address_filter(self.ctxt), [])
+
+    def test_virtual_interface_get_all_with_ipv6(self):
+        self._create_vif_with_ips('00:00:00:00:00:01', '192.168.5.1', [])
+        network_v6 = db.network_create_safe(self.ctxt,
+                                            {'cidr_v6': 'fe80::/64'})
+        db.virtual_interface_create(self.ctxt,
+                {'address': '00:00:00:00:00:02',
+                 'network_id': network_v6['id'],
+                 'instance_uuid': self.instance['uuid']})
+
+        result = db.virtual_interface_get_all_with_ipv6(self.ctxt)
+        self.assertEqual(result, [{'instance_uuid': self.instance['uuid'],
+                                   'address': '00:00:00:00:00:02',
+                                   'cidr_v6': 'fe80::/64'}])
+
+    def test_virtual_interface_get_by_instances(self):
+        other = db.instance_create(self.ctxt, {})
+        for address, instance in (('00:00:00:00:00:01', self.instance),
+                                  ('00:00:00:00:00:02', other),
+                                  ('00:00:00:00:00:03', self.instance)):
+            db.virtual_interface_create(self.ctxt,
+                    {'address': address, 'instance_uuid': instance['uuid']})
+        db.instance_create(self.ctxt, {})
+
+        result = db.virtual_interface_get_by_instances(self.ctxt,
+                [self.instance['uuid'], other['uuid']])
+        self.assertEqual(sorted(vif['address'] for vif in result),
+                         ['00:00:00:00:00:01', '00:00:00:00:00:02',
+                          '00:00:00:00:00:03'])
+        self.assertEqual(db.virtual_interface_get_by_instances(self.ctxt, []),
+                         [])
+
 
 class InstanceDestroyConstraints(test.TestCase):
 
@@ -1666,3 +1906,104 @@ class VolumeUsageDBApiTestCase(test.TestCase):
         for key, value in expected_vol_usages.items():
             self.assertEqual(vol_usages[0][key], value)
         timeutils.clear_time_override()
+
+
+class ArchiveTestCase(test.TestCase):
+
+    def setUp(self):
+        super(ArchiveTestCase, self).setUp()
+        self.context = context.get_admin_context()
+        self.metadata = sqlalchemy.MetaData()
+        self.metadata.bind = get_engine()
+        self.instances = sqlalchemy.Table('instances', self.metadata,
+                                          autoload=True)
+        self.shadow_instances = sqlalchemy.Table('shadow_instances',
+                                                 self.metadata,
+                                                 autoload=True)
+
+    def _create_deleted_instances(self, count):
+        uuids = []
+        for i in xrange(count):
+            instance = db.instance_create(self.context, {})
+            db.instance_destroy(self.context, instance['uuid'])
+            uuids.append(instance['uuid'])
+        return uuids
+
+    def _uuids(self, table):
+        return [row.uuid for row in
+                table.select().order_by(table.c.id).execute()]
+
+    def test_shadow_tables_match_live_tables(self):
+        for table in models.BASE.metadata.sorted_tables:
+            if 'deleted' not in table.c:
+                continue
+            table = sqlalchemy.Table(table.name, self.metadata,
+                                     autoload=True)
+            shadow_table = sqlalchemy.Table('shadow_' + table.name,
+                                            self.metadata, autoload=True)
+            self.assertEqual(sorted(table.c.keys()),
+                             sorted(shadow_table.c.keys()))
+
+    def test_archive_deleted_rows_for_table(self):
+        live = db.instance_create(self.context, {})
+        deleted = self._create_deleted_instances(3)
+
+        self.assertEqual(db.archive_deleted_rows_for_table(
+                self.context, 'instances', max_rows=2), 2)
+        self.assertEqual(self._uuids(self.shadow_instances), deleted[:2])
+        self.assertEqual(self._uuids(self.instances),
+                         [live['uuid'], deleted[2]])
+
+        self.assertEqual(db.archive_deleted_rows_for_table(
+                self.context, 'instances', max_rows=2), 1)
+        self.assertEqual(self._uuids(self.shadow_instances), deleted)
+        self.assertEqual(self._uuids(self.instances), [live['uuid']])
+
+        self.assertEqual(db.archive_deleted_rows_for_table(
+                self.context, 'instances'), 0)
+
+    def test_archive_deleted_rows_for_table_skips_failing_rows(self):
+        deleted = self._create_deleted_instances(4)
+        ids = [row.id for row in
+               self.instances.select().order_by(self.instances.c.id).
+               execute()]
+
+        # The first row is already in the shadow table
+        self.shadow_instances.insert().execute(id=ids[0], uuid='old')
+        # and the second is still referenced
+        conn = get_engine().connect()
+        conn.execute("CREATE TRIGGER still_referenced BEFORE DELETE ON "
+                     "instances WHEN old.id = %d BEGIN "
+                     "SELECT RAISE(ABORT, 'referenced'); END" % ids[1])
+        self.addCleanup(conn.execute, "DROP TRIGGER still_referenced")
+
+        self.assertEqual(db.archive_deleted_rows_for_table(
+                self.context, 'instances', max_rows=2), 2)
+        self.assertEqual(self._uuids(self.shadow_instances),
+                         ['old'] + deleted[2:])
+        self.assertEqual(self._uuids(self.instances), deleted[:2])
+
+        self.assertEqual(db.archive_deleted_rows_for_table(
+                self.context, 'instances'), 0)
+
+    def test_archive_deleted_rows_for_table_without_shadow_table(self):
+        self.assertEqual(db.archive_deleted_rows_for_table(
+                self.context, 'migrate_version'), 0)
+
+    def test_archive_deleted_rows(self):
+        deleted = self._create_deleted_instances(3)
+
+        while True:
+            rows_archived = db.archive_deleted_rows(self.context, max_rows=2)
+            self.assertTrue(rows_archived <= 2)
+            if not rows_archived:
+                break
+
+        self.assertEqual(self._uuids(self.shadow_instances), deleted)
+        self.assertEqual(self._uuids(self.instances), [])
+        # The soft deleted info caches of the instances are archived too.
+        info_caches = sqlalchemy.Table('instance_info_caches', self.metadata,
+                                       autoload=True)
+        self.assertEqual(info_caches.select().
+                         where(info_caches.c.deleted != False).
+                         execute().fetchall(), [])
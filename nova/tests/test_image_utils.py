@@ -16,6 +16,8 @@
 
 import os
 
+from nova import exception
+from nova.image import glance
 from nova import test
 from nova import utils
 
@@ -236,3 +238,34 @@ ID        TAG                 VM SIZE                DATE       VM CLOCK
         self.assertEquals(67108864, image_info.virtual_size)
         self.assertEquals(98304, image_info.disk_size)
         self.assertEquals(3, len(image_info.snapshots))
+
+    def test_fetch_resume(self):
+        class FakeImageService(object):
+            """Fails to reach glance on the first download."""
+            def __init__(self):
+                self.starts = []
+
+            def download(self, context, image_id, data):
+                self.starts.append(data.tell())
+                data.write('abc')
+                if len(self.starts) == 1:
+                    raise exception.GlanceConnectionFailed(host='fake',
+                            port=9292, reason='fake')
+
+        service = FakeImageService()
+        self.stubs.Set(glance, 'get_remote_image_service',
+                       lambda context, image_href: (service, image_href))
+        with utils.tempdir() as tmpdir:
+            path = os.path.join(tmpdir, 'image.part')
+            self.assertRaises(exception.GlanceConnectionFailed, images.fetch,
+                              None, 'fake', path, None, None, resume=True)
+            images.fetch(None, 'fake', path, None, None, resume=True)
+            self.assertEqual(service.starts, [0, 3])
+            with open(path) as image_file:
+                self.assertEqual(image_file.read(), 'abcabc')
+
+            # Without resume what was downloaded is removed
+            service.starts = []
+            self.assertRaises(exception.GlanceConnectionFailed, images.fetch,
+                              None, 'fake', path, None, None)
+            self.assertFalse(os.path.exists(path))
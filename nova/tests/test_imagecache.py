@@ -383,6 +383,10 @@ class ImageCacheManagerTestCase(test.TestCase):
                 res = image_cache_manager._verify_checksum(img, fname)
                 self.assertTrue(res)
 
+                # Later verifications can go a segment at a time
+                self.assertTrue(imagecache.read_stored_info(
+                        fname, field='sha1-segments'))
+
     def test_verify_checksum_disabled(self):
         img = {'container_format': 'ami', 'id': '42'}
 
@@ -707,6 +711,8 @@ class ImageCacheManagerTestCase(test.TestCase):
         self.flags(instances_path='/instance_path')
         self.flags(base_dir_name='_base')
         self.flags(remove_unused_base_images=True)
+        # The inventory is tested with real files below
+        self.flags(image_cache_full_scan_interval=0)
 
         base_file_list = ['00000001',
                           'ephemeral_0_20_None',
@@ -926,6 +932,256 @@ class ImageCacheManagerTestCase(test.TestCase):
             self.assertTrue(os.path.exists(base_filename))
             self.assertTrue(os.path.exists(base_filename + '.info'))
 
+    def _make_cache(self, tmpdir, base_files):
+        self.flags(instances_path=tmpdir)
+        base_dir = os.path.join(tmpdir, '_base')
+        os.mkdir(base_dir)
+        old = time.time() - (25 * 3600)
+        for base_file in base_files:
+            path = os.path.join(base_dir, base_file)
+            with open(path, 'w') as f:
+                f.write('Touched')
+            os.utime(path, (old, old))
+        return base_dir
+
+    def _instance(self, name, image_ref):
+        return {'image_ref': image_ref,
+                'host': CONF.host,
+                'name': name,
+                'uuid': name,
+                'vm_state': '',
+                'task_state': ''}
+
+    def test_inventory_full_scan(self):
+        hashed_1 = hashlib.sha1('1').hexdigest()
+        hashed_2 = hashlib.sha1('2').hexdigest()
+        hashed_3 = hashlib.sha1('3').hexdigest()
+
+        with utils.tempdir() as tmpdir:
+            base_dir = self._make_cache(tmpdir,
+                                        [hashed_1, hashed_2, hashed_3])
+            os.mkdir(os.path.join(tmpdir, 'instance-2'))
+            with open(os.path.join(tmpdir, 'instance-2', 'disk'), 'w'):
+                pass
+
+            # instance-2 was rebuilt from image 1, but is still backed by 2
+            self.stubs.Set(virtutils, 'get_disk_backing_file',
+                           lambda path: hashed_2)
+
+            image_cache_manager = imagecache.ImageCacheManager()
+            image_cache_manager.verify_base_images(
+                None, [self._instance('instance-1', '1'),
+                       self._instance('instance-2', '1')])
+
+            self.assertFalse(os.path.exists(os.path.join(base_dir,
+                                                         hashed_3)))
+            inventory = imagecache._read_inventory()
+            self.assertTrue(time.time() - inventory['scanned'] < 60)
+            self.assertEqual(sorted(inventory['base_files']),
+                             sorted([hashed_1, hashed_2]))
+            self.assertEqual(
+                sorted(inventory['base_files'][hashed_1]['users']),
+                ['instance-1', 'instance-2'])
+            self.assertEqual(
+                inventory['base_files'][hashed_2]['users'].keys(),
+                ['instance-2'])
+
+    def test_inventory_pass(self):
+        hashed_1 = hashlib.sha1('1').hexdigest()
+        hashed_2 = hashlib.sha1('2').hexdigest()
+        hashed_3 = hashlib.sha1('3').hexdigest()
+
+        with utils.tempdir() as tmpdir:
+            base_dir = self._make_cache(tmpdir,
+                                        [hashed_1, hashed_2, hashed_3])
+            inventory = {'scanned': time.time(),
+                         'base_files': {hashed_2: {'users': {}},
+                                        hashed_3: {'users': {}}}}
+            with open(imagecache.get_inventory_filename(), 'w') as f:
+                json.dump(inventory, f)
+            imagecache.add_image_user(hashed_2, 'instance-2')
+
+            def fail(*args):
+                self.fail('Unexpected scan')
+
+            image_cache_manager = imagecache.ImageCacheManager()
+            self.stubs.Set(image_cache_manager, '_list_base_images', fail)
+            self.stubs.Set(image_cache_manager, '_list_backing_images', fail)
+            image_cache_manager.verify_base_images(
+                None, [self._instance('instance-2', '1')])
+
+            # Base files not in the inventory are left for the next scan
+            self.assertTrue(os.path.exists(os.path.join(base_dir,
+                                                        hashed_1)))
+            self.assertTrue(os.path.exists(os.path.join(base_dir,
+                                                        hashed_2)))
+            self.assertFalse(os.path.exists(os.path.join(base_dir,
+                                                         hashed_3)))
+            inventory = imagecache._read_inventory()
+            self.assertEqual(inventory['base_files'].keys(), [hashed_2])
+
+            imagecache.remove_image_user('instance-2')
+            inventory = imagecache._read_inventory()
+            self.assertEqual(inventory['base_files'][hashed_2]['users'], {})
+
+    def test_inventory_full_scan_due(self):
+        hashed_1 = hashlib.sha1('1').hexdigest()
+
+        with utils.tempdir() as tmpdir:
+            base_dir = self._make_cache(tmpdir, [hashed_1])
+            inventory = {'scanned': time.time() - (25 * 3600),
+                         'base_files': {}}
+            with open(imagecache.get_inventory_filename(), 'w') as f:
+                json.dump(inventory, f)
+
+            image_cache_manager = imagecache.ImageCacheManager()
+            image_cache_manager.verify_base_images(None, [])
+
+            self.assertFalse(os.path.exists(os.path.join(base_dir,
+                                                         hashed_1)))
+            inventory = imagecache._read_inventory()
+            self.assertTrue(time.time() - inventory['scanned'] < 60)
+
+    def test_add_image_user_without_inventory(self):
+        with utils.tempdir() as tmpdir:
+            self._make_cache(tmpdir, [])
+            imagecache.add_image_user('aaa', 'instance-1')
+            self.assertTrue(imagecache._read_inventory() is None)
+
+    def test_verify_checksum_recently_checked(self):
+        self.flags(checksum_base_images=True)
+
+        def fail(*args):
+            self.fail('Unexpected checksum')
+
+        self.stubs.Set(imagecache, '_checksum_file', fail)
+        image_cache_manager = imagecache.ImageCacheManager()
+        image_cache_manager.checksum_times['/tmp/aaa'] = time.time()
+        self.assertTrue(image_cache_manager._verify_checksum('42',
+                                                             '/tmp/aaa'))
+
+    def test_hash_segments(self):
+        self.stubs.Set(imagecache, 'CHECKSUM_SEGMENT_SIZE', 16)
+        self.stubs.Set(imagecache, 'CHECKSUM_BUFFER_SIZE', 4)
+        delays = []
+        self.stubs.Set(imagecache, '_native_sleep', delays.append)
+
+        with utils.tempdir() as tmpdir:
+            fname = os.path.join(tmpdir, 'aaa')
+            with open(fname, 'w') as f:
+                f.write('x' * 40)
+
+            whole = hashlib.sha1()
+            segments, complete = imagecache._hash_segments(fname, 0, None,
+                                                           4, whole)
+            self.assertTrue(complete)
+            self.assertEqual(segments,
+                             [hashlib.sha1('x' * 16).hexdigest()] * 2 +
+                             [hashlib.sha1('x' * 8).hexdigest()])
+            self.assertEqual(whole.hexdigest(),
+                             hashlib.sha1('x' * 40).hexdigest())
+            self.assertEqual(len(delays), 10)
+            self.assertTrue(8 < delays[-1] <= 10)
+
+            # At the deadline, only the segment already started is finished
+            segments, complete = imagecache._hash_segments(fname, 16, 1, 0,
+                                                           None)
+            self.assertFalse(complete)
+            self.assertEqual(segments, [])
+
+    def test_hash_segments_deadline_at_end(self):
+        # A file ending on a segment boundary as time runs out is complete
+        self.stubs.Set(imagecache, 'CHECKSUM_SEGMENT_SIZE', 16)
+        self.stubs.Set(imagecache, 'CHECKSUM_BUFFER_SIZE', 4)
+        times = [0, 0]
+        self.stubs.Set(time, 'time', lambda: times.pop(0) if times else 2)
+
+        with utils.tempdir() as tmpdir:
+            fname = os.path.join(tmpdir, 'aaa')
+            with open(fname, 'w') as f:
+                f.write('x' * 32)
+
+            segments, complete = imagecache._hash_segments(fname, 16, 1, 0,
+                                                           None)
+            self.assertTrue(complete)
+            self.assertEqual(segments, [hashlib.sha1('x' * 16).hexdigest()])
+
+    def _checksum_in_segments(self, tmpdir, data):
+        self.flags(checksum_base_images=True)
+        self.flags(instances_path=tmpdir)
+        self.flags(image_info_filename_pattern=('$instances_path/'
+                                                '%(image)s.info'))
+        self.stubs.Set(imagecache, 'CHECKSUM_SEGMENT_SIZE', 16)
+        self.stubs.Set(imagecache, 'CHECKSUM_BUFFER_SIZE', 4)
+
+        # Run out of time after each segment
+        def fake_checksum_file(path, offset=0, deadline=None, whole=None):
+            segments, complete = imagecache._hash_segments(path, offset,
+                                                           None, 0, whole)
+            if deadline and len(segments) > 1:
+                return segments[:1], False
+            return segments, complete
+
+        self.stubs.Set(imagecache, '_checksum_file', fake_checksum_file)
+
+        fname = os.path.join(tmpdir, 'aaa')
+        with open(fname, 'w') as f:
+            f.write(data)
+        imagecache.write_stored_checksum(fname)
+
+        # Make the checksum due
+        info_fname = imagecache.get_info_filename(fname)
+        with open(info_fname) as f:
+            info = json.load(f)
+        info['sha1-timestamp'] -= 24 * 3600
+        with open(info_fname, 'w') as f:
+            json.dump(info, f)
+        return fname
+
+    def test_verify_checksum_resumes(self):
+        with utils.tempdir() as tmpdir:
+            fname = self._checksum_in_segments(tmpdir, 'x' * 40)
+            image_cache_manager = imagecache.ImageCacheManager()
+            image_cache_manager.checksum_deadline = time.time() + 3600
+
+            for verified in (1, 2):
+                self.assertTrue(image_cache_manager._verify_checksum(
+                        '42', fname) is None)
+                self.assertEqual(imagecache.read_stored_info(
+                        fname, field='sha1-verified'), verified)
+
+            self.assertTrue(image_cache_manager._verify_checksum('42',
+                                                                 fname))
+            self.assertEqual(imagecache.read_stored_info(
+                    fname, field='sha1-verified'), 0)
+            (checksum, timestamp) = imagecache.read_stored_checksum(fname)
+            self.assertTrue(time.time() - timestamp < 60)
+
+    def test_verify_checksum_resumed_fails(self):
+        with utils.tempdir() as tmpdir:
+            fname = self._checksum_in_segments(tmpdir, 'x' * 40)
+            image_cache_manager = imagecache.ImageCacheManager()
+            image_cache_manager.checksum_deadline = time.time() + 3600
+
+            self.assertTrue(image_cache_manager._verify_checksum(
+                    '42', fname) is None)
+            with open(fname, 'w') as f:
+                f.write('x' * 20 + 'y' * 20)
+            self.assertFalse(image_cache_manager._verify_checksum('42',
+                                                                  fname))
+
+    def test_verify_checksum_no_time_left(self):
+        self.flags(checksum_base_images=True)
+
+        def fail(*args):
+            self.fail('Unexpected checksum')
+
+        self.stubs.Set(imagecache, 'read_stored_checksum', fail)
+        image_cache_manager = imagecache.ImageCacheManager()
+        image_cache_manager.checksum_deadline = time.time() - 1
+        self.assertTrue(image_cache_manager._verify_checksum(
+                '42', '/tmp/aaa') is None)
+
     def test_compute_manager(self):
         was = {'called': False}
 
@@ -0,0 +1,156 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 OpenStack LLC.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import hashlib
+import os
+
+import fixtures
+import webob
+
+from nova import test
+from nova.tests.image import fake as fake_image
+from nova.virt import images
+from nova.virt.libvirt import imagepeer
+
+
+class ImagePeerAppTestCase(test.TestCase):
+    def setUp(self):
+        super(ImagePeerAppTestCase, self).setUp()
+        self.base_dir = self.useFixture(fixtures.TempDir()).path
+        self.app = imagepeer.ImagePeerApp(self.base_dir)
+        self.data = 'image data' * 1000
+        self.checksum = hashlib.md5(self.data).hexdigest()
+        path = os.path.join(self.base_dir, hashlib.sha1('fake').hexdigest())
+        with open(path, 'wb') as base_file:
+            base_file.write(self.data)
+
+    def _get(self, image_id, checksum=None):
+        req = webob.Request.blank('/images/%s' % image_id)
+        if checksum:
+            req.headers['X-Image-Checksum'] = checksum
+        return req.get_response(self.app)
+
+    def test_get(self):
+        resp = self._get('fake', self.checksum)
+        self.assertEqual(resp.status_int, 200)
+        self.assertEqual(resp.body, self.data)
+        self.assertEqual(resp.headers['X-Image-Checksum'], self.checksum)
+
+    def test_get_without_checksum(self):
+        self.assertEqual(self._get('fake').status_int, 403)
+
+    def test_get_checksum_mismatch(self):
+        self.assertEqual(self._get('fake', 'bad').status_int, 404)
+
+    def test_get_missing(self):
+        self.assertEqual(self._get('missing', self.checksum).status_int, 404)
+        self.assertEqual(self._get('', self.checksum).status_int, 404)
+
+    def test_checksum_is_cached(self):
+        self._get('fake', self.checksum)
+        self.stubs.Set(hashlib, 'md5', None)
+        self.assertEqual(self._get('fake', self.checksum).status_int, 200)
+
+
+class FetchToRawTestCase(test.TestCase):
+    def setUp(self):
+        super(FetchToRawTestCase, self).setUp()
+        self.peer_dir = self.useFixture(fixtures.TempDir()).path
+        self.path = os.path.join(self.useFixture(fixtures.TempDir()).path,
+                                 'base')
+        self.flags(libvirt_image_peer_listen='127.0.0.1',
+                   force_raw_images=False)
+        server = imagepeer.start_server(self.peer_dir)
+        self.addCleanup(server.stop)
+        self.peer = '127.0.0.1:%d' % server.port
+
+        fake_image.stub_out_image_service(self.stubs)
+        self.addCleanup(fake_image.FakeImageService_reset)
+        self.image_service = fake_image.FakeImageService()
+        self.image_id = '155d900f-4e14-4e4c-a73d-069cbf4541e6'
+        self.data = 'image data' * 1000
+        self.image_service.update(None, self.image_id,
+                {'checksum': hashlib.md5(self.data).hexdigest()})
+
+        self.moved = []
+
+        def fake_move_to_raw(image_href, path_tmp, path):
+            self.moved.append(image_href)
+            os.rename(path_tmp, path)
+
+        self.stubs.Set(images, 'move_to_raw', fake_move_to_raw)
+
+    def _write_peer_file(self, data):
+        path = os.path.join(self.peer_dir,
+                            hashlib.sha1(self.image_id).hexdigest())
+        with open(path, 'wb') as base_file:
+            base_file.write(data)
+
+    def test_no_peers(self):
+        self._write_peer_file(self.data)
+        self.assertFalse(imagepeer.fetch_to_raw(None, self.image_id,
+                                                self.path))
+
+    def test_fetch_from_peer(self):
+        self._write_peer_file(self.data)
+        self.flags(libvirt_image_peers=['127.0.0.1:1', self.peer])
+        self.assertTrue(imagepeer.fetch_to_raw(None, self.image_id,
+                                               self.path))
+        self.assertEqual(self.moved, [self.image_id])
+        with open(self.path) as base_file:
+            self.assertEqual(base_file.read(), self.data)
+
+    def test_force_raw_images(self):
+        self._write_peer_file(self.data)
+        self.flags(libvirt_image_peers=[self.peer], force_raw_images=True)
+        self.assertEqual(imagepeer.start_server(self.peer_dir), None)
+        self.assertFalse(imagepeer.fetch_to_raw(None, self.image_id,
+                                                self.path))
+        self.assertEqual(self.moved, [])
+
+    def test_peer_without_image(self):
+        self.flags(libvirt_image_peers=[self.peer])
+        self.assertFalse(imagepeer.fetch_to_raw(None, self.image_id,
+                                                self.path))
+        self.assertEqual(self.moved, [])
+
+    def test_peer_with_converted_image(self):
+        self._write_peer_file('converted')
+        self.flags(libvirt_image_peers=[self.peer])
+        self.assertFalse(imagepeer.fetch_to_raw(None, self.image_id,
+                                                self.path))
+        self.assertFalse(os.path.exists(self.path + '.peer'))
+
+    def test_peer_sends_corrupt_image(self):
+        # The peer takes the image to be what glance has
+        checksum = hashlib.md5(self.data).hexdigest()
+        self.stubs.Set(imagepeer.ImagePeerApp, '_checksum',
+                       lambda self, path, stat: checksum)
+        self._write_peer_file('corrupt')
+        self.flags(libvirt_image_peers=[self.peer])
+        self.assertFalse(imagepeer.fetch_to_raw(None, self.image_id,
+                                                self.path))
+        self.assertFalse(os.path.exists(self.path + '.peer'))
+
+    def test_partial_glance_download_kept(self):
+        with open(self.path + '.part', 'wb') as part_file:
+            part_file.write(self.data[:100])
+        self._write_peer_file('corrupt')
+        self.flags(libvirt_image_peers=[self.peer])
+        self.assertFalse(imagepeer.fetch_to_raw(None, self.image_id,
+                                                self.path))
+        with open(self.path + '.part', 'rb') as part_file:
+            self.assertEqual(part_file.read(), self.data[:100])
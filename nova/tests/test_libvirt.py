@@ -59,6 +59,7 @@ from nova.virt.libvirt import config as vconfig
 from nova.virt.libvirt import driver as libvirt_driver
 from nova.virt.libvirt import firewall
 from nova.virt.libvirt import imagebackend
+from nova.virt.libvirt import imagecache
 from nova.virt.libvirt import utils as libvirt_utils
 from nova.virt.libvirt import volume
 from nova.virt.libvirt import volume_nfs
@@ -2773,6 +2774,8 @@ class LibvirtConnTestCase(test.TestCase):
         shutil.rmtree(os.path.join(CONF.instances_path, instance['name']))
         self.mox.StubOutWithMock(libvirt_driver.LibvirtDriver, '_cleanup_lvm')
         libvirt_driver.LibvirtDriver._cleanup_lvm(instance)
+        self.mox.StubOutWithMock(imagecache, 'remove_image_user')
+        imagecache.remove_image_user(instance['name'])
 
         # Start test
         self.mox.ReplayAll()
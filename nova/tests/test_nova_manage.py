@@ -20,6 +20,8 @@ import os
 import StringIO
 import sys
 
+import fixtures
+
 from nova import context
 from nova import db
 from nova import exception
@@ -372,3 +374,29 @@ class ProjectCommandsTestCase(test.TestCase):
         self.assertRaises(SystemExit,
                           self.commands.quota, 'admin', 'volumes1', '10'
                           )
+
+
+class DbCommandsTestCase(test.TestCase):
+    def setUp(self):
+        super(DbCommandsTestCase, self).setUp()
+        self.commands = nova_manage.DbCommands()
+
+    def test_archive_deleted_rows_negative(self):
+        self.assertRaises(SystemExit,
+                          self.commands.archive_deleted_rows, -1)
+
+    def test_archive_deleted_rows_until_complete(self):
+        batches = [2, 2, 1, 0]
+        calls = []
+
+        def fake_archive_deleted_rows(context, max_rows):
+            calls.append(max_rows)
+            return batches.pop(0)
+
+        self.stubs.Set(db, 'archive_deleted_rows', fake_archive_deleted_rows)
+        output = StringIO.StringIO()
+        self.useFixture(fixtures.MonkeyPatch('sys.stdout', output))
+        self.commands.archive_deleted_rows('2', until_complete=True)
+
+        self.assertEqual(calls, [2, 2, 2, 2])
+        self.assertTrue('Archived 5 rows in total' in output.getvalue())
@@ -21,6 +21,7 @@ Unittets for S3 objectstore clone.
 """
 
 import boto
+import hashlib
 import os
 import shutil
 import tempfile
@@ -128,6 +129,53 @@ class S3APITestCase(test.TestCase):
 
         self._ensure_no_buckets(bucket.get_all_keys())
 
+    def test_put_and_get_large_key(self):
+        key_contents = os.urandom(3 * s3server.CHUNK_SIZE + 5)
+        bucket = self.conn.create_bucket('testbucket')
+        key = bucket.new_key('somekey')
+        key.set_contents_from_string(key_contents)
+        self.assertEquals(key.etag,
+                          '"%s"' % hashlib.md5(key_contents).hexdigest())
+
+        key = bucket.get_key('somekey')
+        self.assertEquals(key.get_contents_as_string(), key_contents)
+        self.assertEquals(os.listdir(os.path.join(CONF.buckets_path,
+                                                  s3server.TEMP_DIRECTORY)),
+                          [])
+
+    def test_get_key_range(self):
+        bucket = self.conn.create_bucket('testbucket')
+        bucket.new_key('somekey').set_contents_from_string('0123456789')
+
+        key = bucket.get_key('somekey')
+        self.assertEquals(
+            key.get_contents_as_string(headers={'Range': 'bytes=2-5'}),
+            '2345')
+        self.assertEquals(
+            key.get_contents_as_string(headers={'Range': 'bytes=-3'}),
+            '789')
+        self.assertRaises(boto_exception.S3ResponseError,
+                          key.get_contents_as_string,
+                          headers={'Range': 'bytes=20-30'})
+
+    def test_list_keys_paginated(self):
+        bucket = self.conn.create_bucket('testbucket')
+        for i in range(5):
+            bucket.new_key('key%d' % i).set_contents_from_string('x')
+
+        keys = bucket.get_all_keys(max_keys=2)
+        self.assertEquals([k.name for k in keys], ['key0', 'key1'])
+        self.assertTrue(keys.is_truncated)
+        keys = bucket.get_all_keys(max_keys=2, marker='key3')
+        self.assertEquals([k.name for k in keys], ['key4'])
+        self.assertFalse(keys.is_truncated)
+
+        # The listing follows objects added and deleted after it was read
+        bucket.new_key('key10').set_contents_from_string('x')
+        bucket.delete_key('key2')
+        self.assertEquals([k.name for k in bucket.list()],
+                          ['key0', 'key1', 'key10', 'key3', 'key4'])
+
     def test_unknown_bucket(self):
         bucket_name = 'falalala'
         self.assertRaises(boto_exception.S3ResponseError,
@@ -18,9 +18,13 @@
 Test suite for PowerVMDriver.
 """
 
+import re
+
 from nova import context
 from nova import db
+from nova import exception as nova_exception
 from nova import test
+from nova import utils
 
 from nova.compute import power_state
 from nova.openstack.common import log as logging
@@ -94,6 +98,12 @@ class FakeIVMOperator(object):
     def get_hostname(self):
         return 'fake-powervm'
 
+    def get_host_resources(self):
+        return {'memory_info': self.get_memory_info(),
+                'cpu_info': self.get_cpu_info(),
+                'disk_info': self.get_disk_info(),
+                'hostname': self.get_hostname()}
+
 
 class FakeBlockAdapter(powervm_blockdev.PowerVMLocalVolumeAdapter):
 
@@ -224,3 +234,128 @@ class PowerVMDriverTestCase(test.TestCase):
         joined_path = common.aix_path_join(path_one, path_two)
         expected_path = '/some/file/path/filename'
         self.assertEqual(joined_path, expected_path)
+
+    def test_host_stats_are_cached(self):
+        calls = []
+        fake_operator = FakeIVMOperator()
+
+        def fake_get_host_resources():
+            calls.append(1)
+            return FakeIVMOperator.get_host_resources(fake_operator)
+
+        fake_operator.get_host_resources = fake_get_host_resources
+        powervm = self.powervm_connection._powervm
+        powervm._operator = fake_operator
+        powervm.get_host_stats()
+        powervm.get_available_resource()
+        self.assertEqual(len(calls), 0)
+        powervm.get_host_stats(refresh=True)
+        self.assertEqual(len(calls), 1)
+        powervm._host_stats_time -= 60
+        powervm.get_host_stats()
+        self.assertEqual(len(calls), 2)
+
+
+class IVMOperatorTestCase(test.TestCase):
+    """Unit tests for the IVM commands run over ssh."""
+
+    def setUp(self):
+        super(IVMOperatorTestCase, self).setUp()
+        self.ivm_operator = operator.IVMOperator(
+                common.Connection('fake_host', 'fake_user', 'fake_pass'))
+        self.stubs.Set(self.ivm_operator, '_set_connection', lambda: None)
+        self.scripts = []
+        self.outputs = {}
+        self.stubs.Set(utils, 'ssh_execute', self._fake_ssh_execute)
+
+    def _fake_ssh_execute(self, ssh, script, check_exit_code=True):
+        """Runs scripts of commands each followed by a delimiter echo."""
+        self.scripts.append(script)
+        stdout = ''
+        for cmd, delimiter in re.findall(r'(.*?); echo "(\S+) \$\?"(?:; |$)',
+                                         script):
+            output, exit_status = self.outputs.get(cmd, ('', 0))
+            stdout += '%s%s %d\n' % (output, delimiter, exit_status)
+        return stdout, ''
+
+    def test_run_commands(self):
+        self.outputs = {'cmd1': ('a\nb\n', 0),
+                        'cmd2': ('', 0),
+                        'cmd3': ('no newline', 0)}
+        outputs = self.ivm_operator.run_commands(['cmd1', 'cmd2', 'cmd3'])
+        self.assertEqual(outputs, [['a', 'b'], [], ['no newline']])
+        self.assertEqual(len(self.scripts), 1)
+
+    def test_run_commands_failure(self):
+        self.outputs = {'cmd2': ('oops\n', 1)}
+        self.assertRaises(nova_exception.ProcessExecutionError,
+                          self.ivm_operator.run_commands, ['cmd1', 'cmd2'])
+        outputs = self.ivm_operator.run_commands(['cmd1', 'cmd2'],
+                                                 check_exit_code=False)
+        self.assertEqual(outputs, [[], ['oops']])
+
+    def test_get_host_resources(self):
+        command = self.ivm_operator.command
+        self.outputs = {
+            self.ivm_operator._memory_info_command(): ('65536,46336\n', 0),
+            self.ivm_operator._cpu_info_command(): ('8.00,6.30\n', 0),
+            command.lsvg(): ('rootvg\ndatavg\n', 0),
+            command.hostname(): ('fake-powervm\n', 0),
+            command.lsvg('rootvg -field totalpps usedpps freepps -fmt :'): (
+                '1271 (10168 megabytes):0 (0 megabytes):'
+                '1271 (10168 megabytes)\n', 0),
+            command.lsvg('datavg -field totalpps usedpps freepps -fmt :'): (
+                '100 (800 megabytes):50 (400 megabytes):'
+                '50 (400 megabytes)\n', 0)}
+        resources = self.ivm_operator.get_host_resources()
+        self.assertEqual(len(self.scripts), 2)
+        self.assertEqual(resources['memory_info'],
+                         {'total_mem': 65536, 'avail_mem': 46336})
+        self.assertEqual(resources['cpu_info'],
+                         {'total_procs': 8.0, 'avail_procs': 6.3})
+        self.assertEqual(resources['disk_info'],
+                         {'disk_total': 10968, 'disk_used': 400,
+                          'disk_avail': 10568})
+        self.assertEqual(resources['hostname'], 'fake-powervm')
+
+
+class FakeTransport(object):
+
+    def __init__(self, active):
+        self.active = active
+
+    def is_active(self):
+        return self.active
+
+
+class FakeSSHClient(object):
+
+    def __init__(self, active=True):
+        self.transport = FakeTransport(active)
+
+    def get_transport(self):
+        return self.transport
+
+
+class PowerVMConnectionTestCase(test.TestCase):
+
+    def setUp(self):
+        super(PowerVMConnectionTestCase, self).setUp()
+        self.connection = common.Connection('fake_host', 'fake_user',
+                                            'fake_pass')
+        self.stubs.Set(common, 'ssh_connect',
+                       lambda connection: FakeSSHClient())
+
+    def test_check_connection_connects(self):
+        ssh = common.check_connection(None, self.connection)
+        self.assertTrue(ssh.get_transport().is_active())
+
+    def test_check_connection_keeps_active_connection(self):
+        ssh = FakeSSHClient()
+        self.assertTrue(common.check_connection(ssh, self.connection) is ssh)
+
+    def test_check_connection_reconnects(self):
+        ssh = FakeSSHClient(active=False)
+        new_ssh = common.check_connection(ssh, self.connection)
+        self.assertFalse(new_ssh is ssh)
+        self.assertTrue(new_ssh.get_transport().is_active())
@@ -0,0 +1,130 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 OpenStack LLC.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+
+import fixtures
+
+from nova import context
+from nova.openstack.common import cfg
+from nova.openstack.common import jsonutils
+from nova.openstack.common.rpc import amqp
+from nova import test
+from nova import tracing
+
+CONF = cfg.CONF
+
+SPANS = []
+
+
+class FakeSink(object):
+    def emit(self, span):
+        SPANS.append(span)
+
+
+class FakeManager(object):
+    RPC_API_VERSION = '1.0'
+
+    def ping(self, ctxt):
+        with tracing.span('ping'):
+            return tracing.get_trace()
+
+
+class TracingTestCase(test.TestCase):
+    def setUp(self):
+        super(TracingTestCase, self).setUp()
+        self.flags(trace_sink='nova.tests.test_tracing.FakeSink')
+        self.stubs.Set(tracing, '_sink', None)
+        del SPANS[:]
+        self.context = context.RequestContext('fake-user', 'fake-project')
+
+    def test_not_sampled(self):
+        self.flags(trace_sample_rate=0)
+        with tracing.start_trace('root', self.context) as root:
+            with tracing.span('child') as child:
+                pass
+        self.assertEqual(root, None)
+        self.assertEqual(child, None)
+        self.assertEqual(self.context.trace, None)
+        self.assertEqual(SPANS, [])
+
+    def test_nested_spans(self):
+        self.flags(trace_sample_rate=1)
+        with tracing.start_trace('root', self.context, path='/servers'):
+            trace_id = self.context.trace['trace_id']
+            with tracing.span('child'):
+                with tracing.span('grandchild'):
+                    pass
+
+        # The trace only lasts as long as the root span
+        self.assertEqual(self.context.trace, None)
+        self.assertEqual([span['name'] for span in SPANS],
+                         ['grandchild', 'child', 'root'])
+        grandchild, child, root = SPANS
+        for span in SPANS:
+            self.assertEqual(span['trace_id'], trace_id)
+        self.assertEqual(root['parent_id'], None)
+        self.assertEqual(root['info'], {'path': '/servers'})
+        self.assertEqual(child['parent_id'], root['span_id'])
+        self.assertEqual(grandchild['parent_id'], child['span_id'])
+
+    def test_rpc_propagation(self):
+        self.flags(trace_sample_rate=1)
+        proxy = tracing.TracedRpcDispatcher([FakeManager()])
+        with tracing.start_trace('root', self.context):
+            msg = {'method': 'ping', 'args': {}}
+            amqp.pack_context(msg, self.context)
+            # Messages go through JSON on the wire
+            msg = jsonutils.loads(jsonutils.dumps(msg))
+
+        ctxt = amqp.unpack_context(CONF, msg)
+        trace = proxy.dispatch(ctxt, '1.0', 'ping')
+
+        root, ping, dispatch = SPANS[0], SPANS[1], SPANS[2]
+        self.assertEqual(dispatch['name'], 'rpc.ping')
+        self.assertEqual(dispatch['parent_id'], root['span_id'])
+        self.assertEqual(ping['parent_id'], dispatch['span_id'])
+        self.assertEqual(trace, {'trace_id': root['trace_id'],
+                                 'span_id': ping['span_id']})
+
+    def test_traced_proxy(self):
+        class Backend(object):
+            def get(self, value):
+                return value
+
+        proxy = tracing.TracedProxy(Backend(), 'db.')
+        self.assertEqual(proxy.get(1), 1)
+        self.assertEqual(SPANS, [])
+
+        self.flags(trace_sample_rate=1)
+        with tracing.start_trace('root', self.context):
+            self.assertEqual(proxy.get(2), 2)
+        self.assertEqual([span['name'] for span in SPANS], ['db.get', 'root'])
+
+    def test_file_sink(self):
+        path = os.path.join(self.useFixture(fixtures.TempDir()).path,
+                            'trace.log')
+        self.flags(trace_sample_rate=1,
+                   trace_sink='nova.tracing.FileSink',
+                   trace_file=path)
+        with tracing.start_trace('root', self.context):
+            with tracing.span('child'):
+                pass
+
+        with open(path) as f:
+            spans = [jsonutils.loads(line) for line in f]
+        self.assertEqual([span['name'] for span in spans], ['child', 'root'])
+        self.assertTrue(spans[1]['duration'] >= spans[0]['duration'])
@@ -21,7 +21,10 @@ import os
 import os.path
 import StringIO
 import tempfile
+import time
 
+import eventlet
+import fixtures
 import mox
 
 import nova
@@ -757,3 +760,95 @@ class LastBytesTestCase(test.TestCase):
         content = '1234567890'
         flo.write(content)
         self.assertEqual((content, 0), utils.last_bytes(flo, 1000))
+
+
+class LockStatsTestCase(test.TestCase):
+    def setUp(self):
+        super(LockStatsTestCase, self).setUp()
+        self.flags(lock_stats_interval=60)
+        utils.reset_lock_stats()
+        self.addCleanup(utils.reset_lock_stats)
+        self.now = 100.0
+        self.stubs.Set(time, 'time', lambda: self.now)
+
+    def test_wait_and_hold(self):
+        @utils.synchronized('stats-lock')
+        def locked(hold):
+            self.now += hold
+
+        def waiter():
+            locked(1)
+
+        @utils.synchronized('stats-lock')
+        def holder():
+            thread = eventlet.spawn(waiter)
+            # Let the waiter block on the semaphore
+            eventlet.sleep(0)
+            self.now += 3
+            return thread
+
+        holder().wait()
+
+        stats = utils.get_lock_stats()
+        self.assertEqual(stats['external'], {})
+        self.assertEqual(stats['semaphore']['stats-lock'],
+                         {'acquisitions': 2,
+                          'total_wait': 3.0,
+                          'max_wait': 3.0,
+                          'total_hold': 4.0,
+                          'max_hold': 3.0})
+
+    def test_external_locks_reported_separately(self):
+        self.flags(lock_path=self.useFixture(fixtures.TempDir()).path)
+
+        @utils.synchronized('stats-file-lock', external=True)
+        def locked():
+            self.now += 2
+
+        locked()
+        self.assertRaises(ValueError, utils.synchronized(
+                'stats-file-lock', external=True)(int), 'x')
+
+        stats = utils.get_lock_stats()
+        self.assertEqual(stats['semaphore'], {})
+        self.assertEqual(stats['external']['stats-file-lock']['acquisitions'],
+                         2)
+        self.assertEqual(stats['external']['stats-file-lock']['total_hold'],
+                         2.0)
+
+    def test_format_lock_stats(self):
+        @utils.synchronized('quick')
+        def quick():
+            pass
+
+        quick()
+        utils._lock_stats['semaphore']['slow'] = utils.LockStats()
+        utils._lock_stats['semaphore']['slow'].add(5, 1)
+
+        lines = utils.format_lock_stats(limit=1)
+        self.assertEqual(lines, ['semaphore lock "slow": 1 acquisitions, '
+                                 'waited 5.000s (max 5.000s), held 1.000s '
+                                 '(max 1.000s)'])
+
+    def test_not_recorded_when_disabled(self):
+        self.flags(lock_stats_interval=0)
+
+        @utils.synchronized('stats-lock')
+        def locked():
+            return 'done'
+
+        self.assertEqual(locked(), 'done')
+        self.assertEqual(utils.get_lock_stats(),
+                         {'semaphore': {}, 'external': {}})
+
+    def test_lock_names_bounded(self):
+        self.stubs.Set(utils, '_MAX_LOCK_NAMES', 2)
+        for name in ['0ad2bb2c-4c5a-4a6f-8a1b-2c2c7b1f0b6e',
+                     'b8b0a1c6-8b1e-4c1f-9d0e-6a1f3a2b3c4d',
+                     'a', 'b', 'c']:
+            utils.synchronized(name)(lambda: None)()
+
+        stats = utils.get_lock_stats()['semaphore']
+        self.assertEqual(sorted(stats), ['<other>', '<uuid>', 'a'])
+        self.assertEqual(stats['<uuid>']['acquisitions'], 2)
+        self.assertEqual(stats['<other>']['acquisitions'], 2)
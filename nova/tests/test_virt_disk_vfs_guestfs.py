@@ -16,6 +16,7 @@
 
 import sys
 
+from nova import exception
 from nova import test
 
 from nova.tests import fakeguestfs
@@ -174,3 +175,101 @@ class VirtDiskVFSGuestFSTest(test.TestCase):
         self.assertEquals(vfs.handle.files["/some/file"]["gid"], 600)
 
         vfs.teardown()
+
+    def test_appliance_pool(self):
+        self.flags(libguestfs_appliance_pool_size=1)
+        self.stubs.Set(vfsimpl, '_appliance_pool', None)
+
+        vfs = vfsimpl.VFSGuestFS(imgfile="/dummy.qcow2",
+                                 imgfmt="qcow2",
+                                 partition=1)
+        vfs.setup()
+
+        handle = vfs.handle
+        self.assertEqual(handle.running, True)
+        self.assertEqual(handle.attach_method, 'libvirt')
+        self.assertEqual(handle.drives,
+                         [("/dummy.qcow2", "qcow2", vfsimpl.DRIVE_LABEL)])
+        self.assertEqual(handle.mounts[0][1], "/dev/disk/guestfs/nova1")
+
+        vfs.teardown()
+
+        self.assertEqual(vfs.handle, None)
+        self.assertEqual(handle.running, True)
+        self.assertEqual(handle.closed, False)
+        self.assertEqual(handle.drives, [])
+        self.assertEqual(handle.mounts, [])
+
+        vfs = vfsimpl.VFSGuestFS(imgfile="/other.raw",
+                                 imgfmt="raw",
+                                 partition=-1)
+        vfs.setup()
+
+        self.assertTrue(vfs.handle is handle)
+        self.assertEqual(handle.drives,
+                         [("/other.raw", "raw", vfsimpl.DRIVE_LABEL)])
+
+        vfs.teardown()
+
+    def test_appliance_pool_discards_failed_handles(self):
+        self.flags(libguestfs_appliance_pool_size=1)
+        self.stubs.Set(vfsimpl, '_appliance_pool', None)
+
+        handles = []
+        mount_options = fakeguestfs.GuestFS.mount_options
+
+        def fake_mount_options(self, options, device, mntpoint):
+            handles.append(self)
+            if len(handles) == 1:
+                raise RuntimeError("mount: %s: bad superblock" % device)
+            mount_options(self, options, device, mntpoint)
+
+        self.stubs.Set(fakeguestfs.GuestFS, 'mount_options',
+                       fake_mount_options)
+
+        vfs = vfsimpl.VFSGuestFS(imgfile="/dummy.qcow2",
+                                 imgfmt="qcow2",
+                                 partition=-1)
+        self.assertRaises(exception.NovaException, vfs.setup)
+        self.assertEqual(vfs.handle, None)
+
+        self.assertEqual(handles[0].closed, True)
+
+        # The semaphore was released and the failed handle wasn't kept
+        vfs = vfsimpl.VFSGuestFS(imgfile="/dummy.qcow2",
+                                 imgfmt="qcow2",
+                                 partition=None)
+        vfs.setup()
+        self.assertFalse(vfs.handle is handles[0])
+        self.assertEqual(len(vfs.handle.drives), 1)
+        vfs.teardown()
+
+    def test_appliance_pool_disabled_without_hotplug(self):
+        self.flags(libguestfs_appliance_pool_size=1)
+        self.stubs.Set(vfsimpl, '_appliance_pool', None)
+        self.stubs.Set(vfsimpl, '_hotplug_supported', True)
+
+        handles = []
+        add_drive_opts = fakeguestfs.GuestFS.add_drive_opts
+
+        def fake_add_drive_opts(self, file, *args, **kwargs):
+            handles.append(self)
+            if self.running:
+                raise RuntimeError("hot-adding drives is only supported "
+                                   "with the libvirt attach-method")
+            add_drive_opts(self, file, *args, **kwargs)
+
+        self.stubs.Set(fakeguestfs.GuestFS, 'add_drive_opts',
+                       fake_add_drive_opts)
+
+        vfs = vfsimpl.VFSGuestFS(imgfile="/dummy.qcow2",
+                                 imgfmt="qcow2",
+                                 partition=None)
+        vfs.setup()
+
+        self.assertEqual(handles[0].closed, True)
+        self.assertEqual(vfs.pool, None)
+        self.assertEqual(vfs.device, "/dev/sda")
+        self.assertEqual(vfs.handle.drives, [("/dummy.qcow2", "qcow2", None)])
+        self.assertEqual(vfsimpl._get_appliance_pool(), None)
+        vfs.teardown()
@@ -31,6 +31,7 @@ from nova.tests.vmwareapi import db_fakes
 from nova.tests.vmwareapi import stubs
 from nova.virt.vmwareapi import driver
 from nova.virt.vmwareapi import fake as vmwareapi_fake
+from nova.virt.vmwareapi import vm_cache
 
 
 class VMWareAPIVMTestCase(test.TestCase):
@@ -276,3 +277,53 @@ class VMWareAPIVMTestCase(test.TestCase):
 
     def test_get_console_output(self):
         pass
+
+
+class VMWareAPIVMCacheTestCase(VMWareAPIVMTestCase):
+    """Runs the VM tests with the VM cache, which must read its writes."""
+
+    def setUp(self):
+        super(VMWareAPIVMCacheTestCase, self).setUp()
+        self.flags(vmwareapi_use_vm_cache=True)
+        # Updates are fetched by calling refresh() from the tests.
+        self.stubs.Set(vm_cache.VMCache, '_run', lambda *args: None)
+        self.conn = driver.VMWareESXDriver(None, False)
+        self.cache = self.conn._vmops._session.vm_cache
+
+    def _get_fake_vm(self):
+        return vmwareapi_fake._get_objects("VirtualMachine")[0]
+
+    def test_reads_are_served_from_cache(self):
+        self._create_vm()
+        self.cache.refresh(0)
+
+        def fake_call_method(*args, **kwargs):
+            self.fail('VM read from the server')
+
+        self.stubs.Set(driver.VMWareAPISession, '_call_method',
+                       fake_call_method)
+        self._get_fake_vm().set("runtime.powerState", "suspended")
+        info = self.conn.get_info({'name': 1})
+        self._check_vm_info(info, power_state.RUNNING)
+
+    def test_updates_are_applied(self):
+        self._create_vm()
+        self.cache.refresh(0)
+        self._get_fake_vm().set("runtime.powerState", "suspended")
+        self.cache.refresh(0)
+        info = self.conn.get_info({'name': 1})
+        self._check_vm_info(info, power_state.PAUSED)
+
+        del vmwareapi_fake._db_content["VirtualMachine"][
+                self._get_fake_vm().obj]
+        self.cache.refresh(0)
+        self.assertEqual(self.cache.get_vm_ref(1), None)
+
+    def test_resync_drops_vms_removed_while_not_following(self):
+        self._create_vm()
+        self.cache.refresh(0)
+        vm_ref = self._get_fake_vm().obj
+        del vmwareapi_fake._db_content["VirtualMachine"][vm_ref]
+        self.cache._create_filter()
+        self.cache.refresh(0)
+        self.assertEqual(self.cache.get_properties(vm_ref), None)
@@ -50,6 +50,7 @@ from nova.virt.xenapi import fake as xenapi_fake
 from nova.virt.xenapi import host
 from nova.virt.xenapi import pool
 from nova.virt.xenapi import pool_states
+from nova.virt.xenapi import record_cache
 from nova.virt.xenapi import vm_utils
 from nova.virt.xenapi import vmops
 from nova.virt.xenapi import volume_utils
@@ -3168,3 +3169,118 @@ class XenAPISessionTestCase(test.TestCase):
             ((6, 0, 50), 'XenServer'),
             session._get_product_version_and_brand()
         )
+
+
+class XenAPIRecordCacheTestCase(stubs.XenAPITestBase):
+    def setUp(self):
+        super(XenAPIRecordCacheTestCase, self).setUp()
+        self.flags(xenapi_connection_url='test_url',
+                   xenapi_connection_password='test_pass',
+                   xenapi_use_record_cache=True)
+        stubs.stubout_session(self.stubs, stubs.FakeSessionForVMTests)
+        # Events are fetched by calling refresh() from the tests.
+        self.stubs.Set(record_cache.greenthread, 'spawn',
+                       lambda *args: None)
+        self.vm_ref = xenapi_fake.create_vm('instance-1', 'Running')
+        self.session = xenapi_conn.XenAPISession('test_url', 'root',
+                                                 'test_pass',
+                                                 fake.FakeVirtAPI())
+        self.cache = self.session.record_cache
+        self.cache.refresh()
+
+    def test_reads_are_served_from_cache(self):
+        xenapi_fake.get_record('VM', self.vm_ref)['power_state'] = 'Halted'
+        self.assertEqual(vm_utils.lookup(self.session, 'instance-1',
+                                         check_cache=True), self.vm_ref)
+        rec = self.session.get_cached_rec('VM', self.vm_ref)
+        self.assertEqual(rec['power_state'], 'Running')
+
+        self.cache.refresh()
+        rec = self.session.get_cached_rec('VM', self.vm_ref)
+        self.assertEqual(rec['power_state'], 'Halted')
+
+    def test_events_add_and_remove_records(self):
+        vm_ref = xenapi_fake.create_vm('instance-2', 'Running')
+        self.assertEqual(self.cache.get_vm_refs_by_name('instance-2'), None)
+        self.cache.refresh()
+        self.assertEqual(self.cache.get_vm_refs_by_name('instance-2'),
+                         [vm_ref])
+
+        xenapi_fake.destroy_vm(vm_ref)
+        self.cache.refresh()
+        self.assertEqual(self.cache.get_vm_refs_by_name('instance-2'), None)
+        self.assertFalse(vm_ref in self.cache.get_all_records('VM'))
+
+    def test_changes_made_through_session_are_read_back(self):
+        self.session.call_xenapi('VM.set_name_label', self.vm_ref,
+                                 'instance-renamed')
+        self.assertEqual(self.cache.get_vm_refs_by_name('instance-1'), None)
+        self.assertEqual(vm_utils.lookup(self.session, 'instance-1',
+                                         check_cache=True), None)
+        rec = self.session.get_cached_rec('VM', self.vm_ref)
+        self.assertEqual(rec['name_label'], 'instance-renamed')
+
+        self.cache.refresh()
+        self.assertEqual(self.cache.get_vm_refs_by_name('instance-renamed'),
+                         [self.vm_ref])
+
+    def test_resync_drops_records_destroyed_while_not_following(self):
+        vm_ref = xenapi_fake.create_vm('instance-2', 'Running')
+        self.cache.refresh()
+        xenapi_fake.destroy_vm(vm_ref)
+        self.cache._token = ''
+        self.cache.refresh()
+        self.assertFalse(vm_ref in self.cache.get_all_records('VM'))
+        self.assertTrue(self.vm_ref in self.cache.get_all_records('VM'))
+
+    def test_cache_is_bypassed_until_resynchronized(self):
+        self.cache._reset()
+        xenapi_fake.get_record('VM', self.vm_ref)['power_state'] = 'Halted'
+        rec = self.session.get_cached_rec('VM', self.vm_ref)
+        self.assertEqual(rec['power_state'], 'Halted')
+        self.assertEqual(self.cache.get_vm_refs_by_name('instance-1'), None)
+        self.assertEqual(self.cache.get_all_records('VM'), None)
+        self.assertEqual(vm_utils.lookup(self.session, 'instance-1',
+                                         check_cache=True), self.vm_ref)
+
+        self.cache.refresh()
+        self.assertEqual(self.cache.get_vm_refs_by_name('instance-1'),
+                         [self.vm_ref])
+
+    def test_failure_logs_in_again_and_backs_off(self):
+        logins = []
+        login = self.cache._login
+
+        def fake_login():
+            logins.append(True)
+            return login()
+
+        self.stubs.Set(self.cache, '_login', fake_login)
+
+        class StopLoop(Exception):
+            pass
+
+        def fake_refresh():
+            raise Exception('session expired')
+
+        sleeps = []
+
+        def fake_sleep(seconds):
+            sleeps.append(seconds)
+            if len(sleeps) == 3:
+                raise StopLoop()
+
+        class FakeGreenthread(object):
+            sleep = staticmethod(fake_sleep)
+
+        real_refresh = self.cache.refresh
+        self.stubs.Set(self.cache, 'refresh', fake_refresh)
+        self.stubs.Set(record_cache, 'greenthread', FakeGreenthread)
+        self.assertRaises(StopLoop, self.cache._run)
+        self.assertEqual(sleeps, [1, 2, 4])
+        self.assertEqual(self.cache._event_session, None)
+        self.assertEqual(self.cache.get_all_records('VM'), None)
+
+        real_refresh()
+        self.assertEqual(len(logins), 1)
+        self.assertTrue(self.vm_ref in self.cache.get_all_records('VM'))
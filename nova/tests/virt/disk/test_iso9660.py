@@ -0,0 +1,117 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 OpenStack LLC.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+import struct
+
+import fixtures
+
+from nova import test
+from nova.virt.disk import iso9660
+
+SECTOR_SIZE = iso9660.SECTOR_SIZE
+
+
+def read_tree(image, joliet=False):
+    """Return {path: data} for the files of a volume of an image."""
+    descriptor = (iso9660.FIRST_DESCRIPTOR + int(joliet)) * SECTOR_SIZE
+    if joliet:
+        assert image[descriptor + 88:descriptor + 91] == '%/E'
+    assert image[descriptor + 1:descriptor + 6] == 'CD001'
+
+    def records(lba, size):
+        offset = lba * SECTOR_SIZE
+        while offset < lba * SECTOR_SIZE + size:
+            length = ord(image[offset])
+            if not length:
+                # Records continue in the next sector
+                offset += -offset % SECTOR_SIZE
+                continue
+            yield image[offset:offset + length]
+            offset += length
+
+    files = {}
+
+    def walk(record, path):
+        lba, = struct.unpack('<I', record[2:6])
+        size, = struct.unpack('<I', record[10:14])
+        if not ord(record[25]) & 2:
+            files[path] = image[lba * SECTOR_SIZE:lba * SECTOR_SIZE + size]
+            return
+        for child in records(lba, size):
+            name = child[33:33 + ord(child[32])]
+            if name in ('\0', '\1'):
+                continue
+            if joliet:
+                name = name.decode('utf-16-be').encode('utf-8')
+            name = name.split(';')[0]
+            if path:
+                name = path + '/' + name
+            walk(child, name)
+
+    walk(image[descriptor + 156:descriptor + 190], '')
+    return files
+
+
+class ISO9660TestCase(test.TestCase):
+    def setUp(self):
+        super(ISO9660TestCase, self).setUp()
+        self.path = os.path.join(self.useFixture(fixtures.TempDir()).path,
+                                 'image.iso')
+
+    def _write(self, files):
+        iso9660.write(self.path, files, 'config-2', 'Nova')
+        with open(self.path) as image:
+            return image.read()
+
+    def test_write(self):
+        files = {'ec2/2009-04-04/meta-data.json': '{"uuid": "abc"}',
+                 'ec2/latest/meta-data.json': '{"uuid": "abc"}',
+                 'openstack/content/0000': 'x' * 5000,
+                 'openstack/latest/user_data': '',
+                 'top': 'level'}
+        image = self._write(files.items())
+        self.assertEqual(len(image) % SECTOR_SIZE, 0)
+        self.assertEqual(read_tree(image, joliet=True), files)
+
+        primary = read_tree(image)
+        self.assertEqual(primary['ec2/2009_04_04/meta_data.json'],
+                         files['ec2/2009-04-04/meta-data.json'])
+        self.assertEqual(len(primary), len(files))
+
+        # Files with the same contents share an extent
+        self.assertEqual(image.count('{"uuid": "abc"}'), 1)
+
+    def test_write_large_directory(self):
+        # Directories over a sector long, with names that clash once
+        # shortened for the primary volume
+        files = dict(('dir/a-file-with-a-very-long-name-%03d' % i, str(i))
+                     for i in xrange(200))
+        image = self._write(files.items())
+        self.assertEqual(read_tree(image, joliet=True), files)
+        self.assertEqual(sorted(read_tree(image).values()),
+                         sorted(files.values()))
+
+    def test_layout_is_cached(self):
+        files = [('openstack/latest/meta_data.json', '{}')]
+        self._write(files)
+        layout = iso9660._get_layout([('openstack', 'latest',
+                                       'meta_data.json')])
+        image = self._write([('openstack/latest/meta_data.json', '{"a": 1}')])
+        self.assertTrue(iso9660._get_layout([('openstack', 'latest',
+                                              'meta_data.json')]) is layout)
+        self.assertEqual(read_tree(image, joliet=True),
+                         {'openstack/latest/meta_data.json': '{"a": 1}'})
@@ -0,0 +1,102 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 OpenStack LLC.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import errno
+import os
+
+import fixtures
+
+from nova import test
+from nova.virt.disk import sparse
+
+
+class SparseCopyTestCase(test.TestCase):
+    def setUp(self):
+        super(SparseCopyTestCase, self).setUp()
+        self.tempdir = self.useFixture(fixtures.TempDir()).path
+        self.src_path = os.path.join(self.tempdir, 'src')
+        self.dst_path = os.path.join(self.tempdir, 'dst')
+
+    def _write_src(self, chunks, size):
+        with open(self.src_path, 'w') as src:
+            src.truncate(size)
+            for offset, data in chunks:
+                src.seek(offset)
+                src.write(data)
+        with open(self.src_path) as src:
+            return src.read()
+
+    def _read_dst(self):
+        with open(self.dst_path) as dst:
+            return dst.read()
+
+    def test_copy(self):
+        mib = 1024 * 1024
+        expected = self._write_src([(0, 'a' * 100),
+                                    (3 * mib + 5, 'b' * 70000),
+                                    (9 * mib - 7, 'c' * 7)], 9 * mib)
+        skipped = sparse.copy(self.src_path, self.dst_path, 9 * mib,
+                              buffer_size=mib)
+        self.assertEqual(self._read_dst(), expected)
+        self.assertTrue(skipped >= 8 * mib)
+        self.assertTrue(os.stat(self.dst_path).st_blocks * 512 < 2 * mib)
+
+    def test_copy_zero_runs_without_holes(self):
+        # A source written out in full has no holes to seek over, so the
+        # zero runs have to be found by comparing buffers.
+        data = ('x' * 4096 + '\0' * 300000 + 'y' * 10) * 3
+        with open(self.src_path, 'w') as src:
+            src.write(data)
+        skipped = sparse.copy(self.src_path, self.dst_path, len(data),
+                              buffer_size=128 * 1024)
+        self.assertEqual(self._read_dst(), data)
+        self.assertTrue(skipped >= 3 * 3 * sparse.HOLE_SIZE)
+
+    def test_copy_stops_at_length(self):
+        expected = self._write_src([(0, 'abc' * 5000)], 15000)
+        sparse.copy(self.src_path, self.dst_path, 10001)
+        self.assertEqual(self._read_dst(), expected[:10001])
+
+    def test_copy_all_holes(self):
+        self._write_src([], 1024 * 1024)
+        skipped = sparse.copy(self.src_path, self.dst_path, 1024 * 1024)
+        self.assertEqual(skipped, 1024 * 1024)
+        self.assertEqual(self._read_dst(), '\0' * 1024 * 1024)
+
+    def test_copy_without_seek_data(self):
+        def fake_lseek(fd, offset, whence):
+            raise OSError(errno.EINVAL, 'Invalid argument')
+
+        self.stubs.Set(os, 'lseek', fake_lseek)
+        expected = self._write_src([(200000, 'data')], 500000)
+        sparse.copy(self.src_path, self.dst_path, 500000)
+        self.assertEqual(self._read_dst(), expected)
+
+    def test_copy_direct_io(self):
+        # Falls back to buffered io where O_DIRECT isn't supported.
+        expected = self._write_src([(8192, 'd' * 10000),
+                                    (70000, 'e' * 3)], 70003)
+        sparse.copy(self.src_path, self.dst_path, 70003, direct_io=True)
+        self.assertEqual(self._read_dst(), expected)
+
+    def test_copy_without_memoryview(self):
+        self.stubs.Set(sparse, 'HAS_MEMORYVIEW', False)
+        expected = self._write_src([(0, 'f' * 5000),
+                                    (300000, 'g' * 7)], 300007)
+        skipped = sparse.copy(self.src_path, self.dst_path, 300007,
+                              buffer_size=128 * 1024, direct_io=True)
+        self.assertEqual(self._read_dst(), expected)
+        self.assertTrue(skipped >= sparse.HOLE_SIZE)
@@ -0,0 +1,233 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 OpenStack LLC.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Sampled timing of requests across services.
+
+A trace follows one request, like an API call or a periodic task, through
+every service it reaches over rpc. Whether it is sampled is decided where
+it starts. Sampled traces are carried in the request context as a dict of
+the trace id and the id of the span that sent the message.
+
+Spans time a section of the work. They nest within a greenthread, and go
+to the trace_sink when they end. Outside of sampled traces nothing is
+recorded.
+"""
+
+import contextlib
+import functools
+import random
+import socket
+import time
+import uuid
+
+from eventlet import corolocal
+
+from nova.openstack.common import cfg
+from nova.openstack.common import importutils
+from nova.openstack.common import jsonutils
+from nova.openstack.common import log as logging
+from nova.openstack.common.rpc import dispatcher as rpc_dispatcher
+
+LOG = logging.getLogger(__name__)
+
+tracing_opts = [
+    cfg.FloatOpt('trace_sample_rate',
+                 default=0.0,
+                 help='Fraction of API requests and periodic tasks to '
+                      'trace, from 0 to 1'),
+    cfg.StrOpt('trace_sink',
+               default='nova.tracing.LogSink',
+               help='Class the spans of sampled traces are sent to'),
+    cfg.StrOpt('trace_file',
+               default=None,
+               help='File FileSink appends spans to, one JSON object per '
+                    'line'),
+    ]
+
+CONF = cfg.CONF
+CONF.register_opts(tracing_opts)
+
+# The innermost span of each greenthread
+_local = corolocal.local()
+_sink = None
+
+
+class LogSink(object):
+    """Logs spans."""
+
+    def emit(self, span):
+        LOG.info(_('Trace %(trace_id)s span %(span_id)s (parent '
+                   '%(parent_id)s) %(name)s took %(duration).3fs'), span)
+
+
+class FileSink(object):
+    """Appends spans to trace_file, one JSON object per line."""
+
+    def emit(self, span):
+        with open(CONF.trace_file, 'a') as f:
+            f.write(jsonutils.dumps(span) + '\n')
+
+
+class NotifierSink(object):
+    """Sends spans as trace.span notifications."""
+
+    def emit(self, span):
+        # Imported here so that the low level modules timing their work
+        # with spans don't load the notifier
+        from nova.openstack.common.notifier import api as notifier_api
+
+        notifier_api.notify(None, notifier_api.publisher_id('trace'),
+                            'trace.span', notifier_api.INFO, span)
+
+
+class Span(object):
+    """A timed section of a trace."""
+
+    def __init__(self, name, trace_id, parent_id, info):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.info = info
+        self.start = time.time()
+        self.duration = None
+
+    def to_dict(self):
+        return {'name': self.name,
+                'trace_id': self.trace_id,
+                'span_id': self.span_id,
+                'parent_id': self.parent_id,
+                'host': socket.gethostname(),
+                'start': self.start,
+                'duration': self.duration,
+                'info': self.info}
+
+
+def _emit(span):
+    global _sink
+    try:
+        if _sink is None:
+            _sink = importutils.import_object(CONF.trace_sink)
+        _sink.emit(span.to_dict())
+    except Exception:
+        LOG.exception(_('Failed to record span %s'), span.name)
+
+
+def current_span():
+    """Return the innermost span of this greenthread, if any."""
+    return getattr(_local, 'span', None)
+
+
+def get_trace(context=None):
+    """Return the trace to pass on to other services, or None.
+
+    That is the trace of the current span or else the one context carries.
+    """
+    span = current_span()
+    if span is not None:
+        return {'trace_id': span.trace_id, 'span_id': span.span_id}
+    return getattr(context, 'trace', None)
+
+
+@contextlib.contextmanager
+def span(name, context=None, **info):
+    """Time the enclosed block as a span of the current trace.
+
+    The current trace is the one of the innermost span of this greenthread
+    or else the one context carries. The span is yielded, or None when
+    there is no sampled trace.
+    """
+    trace = get_trace(context)
+    if not trace:
+        yield None
+        return
+
+    parent = current_span()
+    new_span = Span(name, trace['trace_id'], trace.get('span_id'), info)
+    _local.span = new_span
+    try:
+        yield new_span
+    finally:
+        new_span.duration = time.time() - new_span.start
+        _local.span = parent
+        _emit(new_span)
+
+
+@contextlib.contextmanager
+def start_trace(name, context, **info):
+    """Time the enclosed block as the root span of a new trace.
+
+    A block already in a trace becomes a span of it. Otherwise a new trace
+    is sampled at trace_sample_rate and set on context for the duration of
+    the block, so messages sent with context carry it.
+    """
+    if (context is None or get_trace(context) or
+            random.random() >= CONF.trace_sample_rate):
+        with span(name, context, **info) as root:
+            yield root
+        return
+
+    previous = getattr(context, 'trace', None)
+    context.trace = {'trace_id': uuid.uuid4().hex, 'span_id': None}
+    try:
+        with span(name, context, **info) as root:
+            yield root
+    finally:
+        context.trace = previous
+
+
+def traced(name):
+    """Decorator timing a function as a span of the current trace."""
+    def wrap(f):
+        @functools.wraps(f)
+        def inner(*args, **kwargs):
+            if current_span() is None:
+                return f(*args, **kwargs)
+            with span(name):
+                return f(*args, **kwargs)
+        return inner
+    return wrap
+
+
+class TracedProxy(object):
+    """Proxy timing calls to the functions of an object.
+
+    Calls are only timed while the calling greenthread is in a span.
+    """
+
+    def __init__(self, target, prefix):
+        self._target = target
+        self._prefix = prefix
+
+    def __getattr__(self, key):
+        value = getattr(self._target, key)
+        if current_span() is None or not callable(value):
+            return value
+
+        def inner(*args, **kwargs):
+            with span(self._prefix + key):
+                return value(*args, **kwargs)
+        return inner
+
+
+class TracedRpcDispatcher(rpc_dispatcher.RpcDispatcher):
+    """Dispatcher timing each rpc method as a span of the sender's trace."""
+
+    def dispatch(self, ctxt, version, method, **kwargs):
+        with span('rpc.%s' % method, ctxt):
+            return super(TracedRpcDispatcher, self).dispatch(
+                ctxt, version, method, **kwargs)
@@ -47,8 +47,10 @@ from nova import exception
 from nova.openstack.common import cfg
 from nova.openstack.common import excutils
 from nova.openstack.common import importutils
+from nova.openstack.common import lockutils
 from nova.openstack.common import log as logging
 from nova.openstack.common import timeutils
+from nova import tracing
 
 monkey_patch_opts = [
     cfg.BoolOpt('monkey_patch',
@@ -68,6 +70,10 @@ utils_opts = [
     cfg.BoolOpt('disable_process_locking',
                 default=False,
                 help='Whether to disable inter-process locks'),
+    cfg.IntOpt('lock_stats_interval',
+               default=0,
+               help='seconds between logging the wait and hold times of the '
+                    'most contended locks (Disable by setting to 0)'),
     cfg.StrOpt('instance_usage_audit_period',
                default='month',
                help='time period to generate instance usages for.  '
@@ -190,6 +196,9 @@ def execute(*cmd, **kwargs):
         raise exception.NovaException(_('Got unknown keyword args '
                                         'to utils.execute: %r') % kwargs)
 
+    # Only the program, as arguments may hold secrets
+    span_name = 'execute %s' % cmd[0]
+
     if run_as_root and os.geteuid() != 0:
         cmd = ['sudo', 'nova-rootwrap', CONF.rootwrap_config] + list(cmd)
 
@@ -208,18 +217,19 @@ def execute(*cmd, **kwargs):
                 preexec_fn = _subprocess_setup
                 close_fds = True
 
-            obj = subprocess.Popen(cmd,
-                                   stdin=_PIPE,
-                                   stdout=_PIPE,
-                                   stderr=_PIPE,
-                                   close_fds=close_fds,
-                                   preexec_fn=preexec_fn,
-                                   shell=shell)
-            result = None
-            if process_input is not None:
-                result = obj.communicate(process_input)
-            else:
-                result = obj.communicate()
+            with tracing.span(span_name):
+                obj = subprocess.Popen(cmd,
+                                       stdin=_PIPE,
+                                       stdout=_PIPE,
+                                       stderr=_PIPE,
+                                       close_fds=close_fds,
+                                       preexec_fn=preexec_fn,
+                                       shell=shell)
+                result = None
+                if process_input is not None:
+                    result = obj.communicate(process_input)
+                else:
+                    result = obj.communicate()
             obj.stdin.close()  # pylint: disable=E1101
             _returncode = obj.returncode  # pylint: disable=E1101
             LOG.debug(_('Result was %s') % _returncode)
@@ -971,6 +981,124 @@ def timefunc(func):
     return inner
 
 
+class LockStats(object):
+    """How long a lock was waited for and held."""
+
+    def __init__(self):
+        self.acquisitions = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.total_hold = 0.0
+        self.max_hold = 0.0
+
+    def add(self, wait, hold):
+        self.acquisitions += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        self.total_hold += hold
+        self.max_hold = max(self.max_hold, hold)
+
+    def to_dict(self):
+        return {'acquisitions': self.acquisitions,
+                'total_wait': self.total_wait,
+                'max_wait': self.max_wait,
+                'total_hold': self.total_hold,
+                'max_hold': self.max_hold}
+
+
+# LockStats of locks taken through synchronized(), keyed by lock name.
+# The wait on an external lock includes the wait for the semaphore it is
+# taken under. Locks named after instances share one key, and past
+# _MAX_LOCK_NAMES names the rest are counted under _OTHER_LOCKS, so that
+# locks named after addresses or files don't grow it without bound.
+_MAX_LOCK_NAMES = 256
+_OTHER_LOCKS = '<other>'
+_UUID_RE = re.compile('[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-'
+                      '[0-9a-f]{12}')
+_lock_stats = {'semaphore': {}, 'external': {}}
+
+
+def _record_lock(kind, name, wait, hold):
+    locks = _lock_stats[kind]
+    name = _UUID_RE.sub('<uuid>', name)
+    stats = locks.get(name)
+    if stats is None:
+        if len(locks) >= _MAX_LOCK_NAMES:
+            name = _OTHER_LOCKS
+        stats = locks.setdefault(name, LockStats())
+    stats.add(wait, hold)
+
+
+def synchronized(name, external=False, lock_path=None):
+    """lockutils.synchronized for nova, recording lock wait and hold times.
+
+    The times are recorded while lock_stats_interval is set, and are
+    available from get_lock_stats().
+    """
+    kind = 'external' if external else 'semaphore'
+
+    def wrap(f):
+        locked_f = lockutils.synchronized(name, 'nova-', external,
+                                          lock_path)(f)
+
+        @functools.wraps(f)
+        def inner(*args, **kwargs):
+            if not CONF.lock_stats_interval:
+                return locked_f(*args, **kwargs)
+
+            started = time.time()
+
+            @lockutils.synchronized(name, 'nova-', external, lock_path)
+            def locked():
+                acquired = time.time()
+                try:
+                    return f(*args, **kwargs)
+                finally:
+                    _record_lock(kind, name, acquired - started,
+                                 time.time() - acquired)
+
+            return locked()
+        return inner
+    return wrap
+
+
+def get_lock_stats():
+    """Return the stats of every lock taken through synchronized().
+
+    The result maps 'semaphore' and 'external' to dicts of lock names to
+    acquisitions and total and max wait and hold times in seconds.
+    """
+    return dict((kind, dict((name, stats.to_dict())
+                            for name, stats in locks.iteritems()))
+                for kind, locks in _lock_stats.iteritems())
+
+
+def reset_lock_stats():
+    for locks in _lock_stats.itervalues():
+        locks.clear()
+
+
+def format_lock_stats(limit=None):
+    """Return lines describing the locks waited on longest."""
+    lines = []
+    for kind, locks in sorted(_lock_stats.iteritems(), reverse=True):
+        ranked = sorted(locks.iteritems(),
+                        key=lambda (name, stats): stats.total_wait,
+                        reverse=True)
+        for name, stats in ranked[:limit]:
+            lines.append('%s lock "%s": %d acquisitions, waited %.3fs '
+                         '(max %.3fs), held %.3fs (max %.3fs)' %
+                         (kind, name, stats.acquisitions, stats.total_wait,
+                          stats.max_wait, stats.total_hold, stats.max_hold))
+    return lines
+
+
+def log_lock_stats(limit=10):
+    """Log the stats of the locks waited on longest."""
+    for line in format_lock_stats(limit):
+        LOG.info(line)
+
+
 @contextlib.contextmanager
 def remove_path_on_error(path):
     """Protect code that wants to operate on PATH atomically.
@@ -28,6 +28,7 @@ from nova.openstack.common import fileutils
 from nova.openstack.common import log as logging
 from nova import utils
 from nova import version
+from nova.virt.disk import iso9660
 
 LOG = logging.getLogger(__name__)
 
@@ -48,7 +49,12 @@ configdrive_opts = [
     cfg.StrOpt('mkisofs_cmd',
                default='genisoimage',
                help='Name and optionally path of the tool used for '
-                    'ISO image creation')
+                    'ISO image creation'),
+    cfg.BoolOpt('config_drive_use_mkisofs',
+                default=True,
+                help='Build iso9660 config drives by running mkisofs_cmd on '
+                     'a temporary directory tree. If false the image is '
+                     'written directly, without Rock Ridge extensions'),
     ]
 
 CONF = cfg.CONF
@@ -69,22 +75,29 @@ class _ConfigDriveBuilder(object):
 
     def __init__(self, instance_md=None):
         self.imagefile = None
+        self.tempdir = None
+        # (path, data) of the files to put on the drive
+        self.files = []
 
+        if instance_md is not None:
+            self.add_instance_metadata(instance_md)
+
+    def _add_file(self, path, data):
+        self.files.append((path, data))
+
+    def _make_tree(self):
+        """Write the files to a temporary directory tree."""
         # TODO(mikal): I don't think I can use utils.tempdir here, because
         # I need to have the directory last longer than the scope of this
         # method call
         self.tempdir = tempfile.mkdtemp(dir=CONF.config_drive_tempdir,
                                         prefix='cd_gen_')
-
-        if instance_md is not None:
-            self.add_instance_metadata(instance_md)
-
-    def _add_file(self, path, data):
-        filepath = os.path.join(self.tempdir, path)
-        dirname = os.path.dirname(filepath)
-        fileutils.ensure_tree(dirname)
-        with open(filepath, 'w') as f:
-            f.write(data)
+        for path, data in self.files:
+            filepath = os.path.join(self.tempdir, path)
+            dirname = os.path.dirname(filepath)
+            fileutils.ensure_tree(dirname)
+            with open(filepath, 'w') as f:
+                f.write(data)
 
     def add_instance_metadata(self, instance_md):
         for (path, value) in instance_md.metadata_for_config_drive():
@@ -92,12 +105,20 @@ class _ConfigDriveBuilder(object):
             LOG.debug(_('Added %(filepath)s to config drive'),
                       {'filepath': path})
 
-    def _make_iso9660(self, path):
-        publisher = "%(product)s %(version)s" % {
+    @staticmethod
+    def _publisher():
+        return "%(product)s %(version)s" % {
             'product': version.product_string(),
             'version': version.version_string_with_package()
             }
 
+    def _write_iso9660(self, path):
+        iso9660.write(path, self.files, 'config-2', self._publisher())
+
+    def _make_iso9660(self, path):
+        publisher = self._publisher()
+        self._make_tree()
+
         utils.execute(CONF.mkisofs_cmd,
                       '-o', path,
                       '-ldots',
@@ -122,6 +143,7 @@ class _ConfigDriveBuilder(object):
             f.truncate(64 * 1024 * 1024)
 
         utils.mkfs('vfat', path, label='config-2')
+        self._make_tree()
 
         mounted = False
         try:
@@ -160,7 +182,10 @@ class _ConfigDriveBuilder(object):
         :raises ProcessExecuteError if a helper process has failed.
         """
         if CONF.config_drive_format == 'iso9660':
-            self._make_iso9660(path)
+            if CONF.config_drive_use_mkisofs:
+                self._make_iso9660(path)
+            else:
+                self._write_iso9660(path)
         elif CONF.config_drive_format == 'vfat':
             self._make_vfat(path)
         else:
@@ -171,6 +196,8 @@ class _ConfigDriveBuilder(object):
         if self.imagefile:
             utils.delete_if_exists(self.imagefile)
 
+        if self.tempdir is None:
+            return
         try:
             shutil.rmtree(self.tempdir)
         except OSError, e:
@@ -0,0 +1,333 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 OpenStack LLC.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Writer of ISO9660 images with Joliet names.
+
+Config drives hold a few small files, so the image is laid out in memory
+and written to its destination in one pass, without a directory tree on
+disk or a mkisofs process.
+
+The primary volume gets relaxed names like mkisofs -l -allow-lowercase
+-allow-multidot, and a Joliet volume keeps the names as given, which is
+what Linux and Windows read. Both volumes share the file data, and files
+with the same contents share one extent.
+"""
+
+import os
+import re
+import stat
+import struct
+import time
+
+from nova.openstack.common import log as logging
+
+LOG = logging.getLogger(__name__)
+
+SECTOR_SIZE = 2048
+
+# The first 16 sectors are the system area, then come the descriptors
+FIRST_DESCRIPTOR = 16
+
+MAX_PRIMARY_NAME_LEN = 31
+MAX_JOLIET_NAME_LEN = 64
+
+# Joliet level 3, UCS-2 names
+JOLIET_ESCAPE = '%/E'
+
+# Layouts of recently written trees, keyed by their file paths. Config
+# drives of the same release have the same paths, so this is mostly hits.
+LAYOUT_CACHE_SIZE = 32
+_layout_cache = {}
+
+
+def _both16(n):
+    return struct.pack('<H', n) + struct.pack('>H', n)
+
+
+def _both32(n):
+    return struct.pack('<I', n) + struct.pack('>I', n)
+
+
+def _sectors(size):
+    return (size + SECTOR_SIZE - 1) // SECTOR_SIZE
+
+
+def _pad(data):
+    return data + '\0' * (-len(data) % SECTOR_SIZE)
+
+
+def _shorten(name, max_len, serial):
+    """Truncate a name, ending it in a serial number to make it unique."""
+    if serial is None:
+        return name[:max_len]
+    return name[:max_len - 3] + '%03d' % serial
+
+
+def _primary_name(name, is_dir, serial=None):
+    name = _shorten(re.sub('[^A-Za-z0-9._]', '_', name),
+                    MAX_PRIMARY_NAME_LEN, serial)
+    if not is_dir:
+        name += ';1'
+    return name
+
+
+def _joliet_name(name, is_dir, serial=None):
+    name = _shorten(unicode(name), MAX_JOLIET_NAME_LEN, serial)
+    if not is_dir:
+        name += u';1'
+    return name.encode('utf-16-be')
+
+
+def _primary_text(text, size):
+    return text[:size].ljust(size, ' ')
+
+
+def _joliet_text(text, size):
+    data = unicode(text).encode('utf-16-be')[:size - size % 2]
+    data += '\0 ' * ((size - len(data)) // 2)
+    return data.ljust(size, '\0')
+
+
+def _record_length(identifier):
+    # Records are padded to an even length
+    return 33 + len(identifier) + (len(identifier) + 1) % 2
+
+
+def _dir_record(identifier, lba, size, is_dir, date):
+    return (struct.pack('<BB', _record_length(identifier), 0) +
+            _both32(lba) + _both32(size) + date +
+            struct.pack('<BBB', 2 if is_dir else 0, 0, 0) + _both16(1) +
+            struct.pack('<B', len(identifier)) + identifier +
+            '\0' * ((len(identifier) + 1) % 2))
+
+
+def _path_table_record_length(identifier):
+    return 8 + len(identifier) + len(identifier) % 2
+
+
+def _path_table_record(identifier, lba, parent_number, fmt):
+    return (struct.pack(fmt, len(identifier), 0, lba, parent_number) +
+            identifier + '\0' * (len(identifier) % 2))
+
+
+class _Tree(object):
+    """The directories of one volume, in path table order."""
+
+    def __init__(self, paths, encode):
+        # Each directory is a list of sectors, each of them a list of
+        # (identifier, path, is_dir) for the records in it.
+        self.dirs = []
+        self.numbers = {}
+        children = {(): {}}
+        for path in paths:
+            for i in xrange(1, len(path)):
+                children.setdefault(path[:i], {})
+                children[path[:i - 1]][path[:i]] = True
+            children[path[:-1]][path] = False
+
+        queue = [()]
+        while queue:
+            path = queue.pop(0)
+            self.numbers[path] = len(self.dirs) + 1
+            entries = []
+            used = set()
+            for child, is_dir in sorted(children[path].iteritems()):
+                identifier = encode(child[-1], is_dir)
+                serial = 0
+                while identifier in used:
+                    # Names that were truncated or had characters replaced
+                    # can clash
+                    identifier = encode(child[-1], is_dir, serial)
+                    serial += 1
+                used.add(identifier)
+                entries.append((identifier, child, is_dir))
+            entries.sort()
+            self.dirs.append((path, self._pack(entries)))
+            queue.extend(child for _id, child, is_dir in entries if is_dir)
+
+        self.identifiers = {(): '\0'}
+        self.sizes = {}
+        for path, sectors in self.dirs:
+            self.sizes[path] = len(sectors) * SECTOR_SIZE
+            for sector in sectors:
+                for identifier, child, _is_dir in sector:
+                    if child is not None:
+                        self.identifiers[child] = identifier
+        self.path_table_size = sum(_path_table_record_length(
+                self.identifiers[path]) for path, _sectors in self.dirs)
+
+    @staticmethod
+    def _pack(entries):
+        # Records can't cross a sector boundary
+        entries = [('\0', None, True), ('\1', None, True)] + entries
+        sectors = [[]]
+        used = 0
+        for entry in entries:
+            length = _record_length(entry[0])
+            if used + length > SECTOR_SIZE:
+                sectors.append([])
+                used = 0
+            sectors[-1].append(entry)
+            used += length
+        return sectors
+
+    def place(self, lba):
+        """Give the directories extents from lba on.
+
+        Builds the path tables, little and big endian, and returns the
+        sector after the last directory.
+        """
+        self.lbas = {}
+        for path, sectors in self.dirs:
+            self.lbas[path] = lba
+            lba += len(sectors)
+
+        self.path_tables = []
+        for fmt in ('<BBIH', '>BBIH'):
+            self.path_tables.append(''.join(
+                    _path_table_record(self.identifiers[path],
+                                       self.lbas[path],
+                                       self.numbers[path[:-1]], fmt)
+                    for path, _sectors in self.dirs))
+        return lba
+
+
+class _Layout(object):
+    """Where everything but the file data goes, given the file paths."""
+
+    def __init__(self, paths):
+        self.trees = [_Tree(paths, _primary_name), _Tree(paths, _joliet_name)]
+        # Each volume has a little and a big endian path table
+        lba = FIRST_DESCRIPTOR + 3
+        self.path_table_lbas = []
+        for tree in self.trees:
+            size = _sectors(tree.path_table_size)
+            self.path_table_lbas.append((lba, lba + size))
+            lba += 2 * size
+        for tree in self.trees:
+            lba = tree.place(lba)
+        self.data_lba = lba
+
+
+def _get_layout(paths):
+    key = tuple(paths)
+    layout = _layout_cache.get(key)
+    if layout is None:
+        if len(_layout_cache) >= LAYOUT_CACHE_SIZE:
+            _layout_cache.clear()
+        layout = _layout_cache[key] = _Layout(paths)
+    return layout
+
+
+def _volume_descriptor(vd_type, escape, text, tree, layout_lbas,
+                       volume_id, publisher, volume_size, date, dir_date):
+    root_record = _dir_record('\0', tree.lbas[()], tree.sizes[()], True,
+                              dir_date)
+    volume_date = time.strftime('%Y%m%d%H%M%S00', date) + '\0'
+    descriptor = (struct.pack('<B5sBB', vd_type, 'CD001', 1, 0) +
+                  text('', 32) + text(volume_id, 32) + '\0' * 8 +
+                  _both32(volume_size) + escape.ljust(32, '\0') +
+                  _both16(1) + _both16(1) + _both16(SECTOR_SIZE) +
+                  _both32(tree.path_table_size) +
+                  struct.pack('<II', layout_lbas[0], 0) +
+                  struct.pack('>II', layout_lbas[1], 0) +
+                  root_record +
+                  text('', 128) + text(publisher, 128) + text('', 128) +
+                  text('', 128) + text('', 37) * 3 +
+                  volume_date * 2 + '0' * 16 + '\0' + volume_date +
+                  '\1\0')
+    return descriptor.ljust(SECTOR_SIZE, '\0')
+
+
+def write(path, files, volume_id, publisher=''):
+    """Write an image of files to path.
+
+    :param path: a file, which is truncated to the image, or block device
+    :param files: (path, data) tuples, paths relative to the root and
+                  separated by slashes
+    :param volume_id: the volume label, at most 16 characters
+    """
+    files = [(tuple(name for name in file_path.split('/') if name), data)
+             for file_path, data in files]
+    files.sort()
+    layout = _get_layout([file_path for file_path, _data in files])
+
+    extents = {}
+    extents_by_data = {'': (0, 0)}
+    contents = []
+    lba = layout.data_lba
+    for file_path, data in files:
+        if data not in extents_by_data:
+            extents_by_data[data] = (lba, len(data))
+            contents.append(data)
+            lba += _sectors(len(data))
+        extents[file_path] = extents_by_data[data]
+    volume_size = lba
+
+    date = time.gmtime()
+    dir_date = struct.pack('<BBBBBBb', date.tm_year - 1900, date.tm_mon,
+                           date.tm_mday, date.tm_hour, date.tm_min,
+                           date.tm_sec, 0)
+
+    descriptors = []
+    for vd_type, escape, text, tree, lbas in (
+            (1, '', _primary_text, layout.trees[0],
+             layout.path_table_lbas[0]),
+            (2, JOLIET_ESCAPE, _joliet_text, layout.trees[1],
+             layout.path_table_lbas[1])):
+        descriptors.append(_volume_descriptor(vd_type, escape, text, tree,
+                                              lbas, volume_id, publisher,
+                                              volume_size, date, dir_date))
+    descriptors.append(struct.pack('<B5sB', 255, 'CD001', 1).ljust(
+            SECTOR_SIZE, '\0'))
+
+    def dir_extent(tree, dir_path, sectors):
+        # The root is its own parent
+        parent = dir_path[:-1]
+        records = []
+        for sector in sectors:
+            sector_records = []
+            for identifier, child, is_dir in sector:
+                if identifier == '\0':
+                    child = dir_path
+                elif identifier == '\1':
+                    child = parent
+                if is_dir:
+                    extent = (tree.lbas[child], tree.sizes[child])
+                else:
+                    extent = extents[child]
+                sector_records.append(_dir_record(identifier, extent[0],
+                                                  extent[1], is_dir,
+                                                  dir_date))
+            records.append(_pad(''.join(sector_records)))
+        return ''.join(records)
+
+    LOG.debug(_("Writing %(count)d files to ISO9660 image %(path)s"),
+              {'count': len(files), 'path': path})
+    with open(path, 'wb') as image:
+        image.write('\0' * FIRST_DESCRIPTOR * SECTOR_SIZE)
+        image.write(''.join(descriptors))
+        for tree in layout.trees:
+            for path_table in tree.path_tables:
+                image.write(_pad(path_table))
+        for tree in layout.trees:
+            for dir_path, sectors in tree.dirs:
+                image.write(dir_extent(tree, dir_path, sectors))
+        for data in contents:
+            image.write(_pad(data))
+        if stat.S_ISREG(os.fstat(image.fileno()).st_mode):
+            image.truncate(volume_size * SECTOR_SIZE)
@@ -0,0 +1,228 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 OpenStack LLC.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Sparse copying of disk images and block devices.
+
+Data is moved through a large page aligned buffer and compared against
+zeros a whole buffer at a time. Ranges the source reports as holes through
+SEEK_DATA and SEEK_HOLE aren't read at all.
+"""
+
+import __builtin__
+import ctypes
+import errno
+import fcntl
+import io
+import mmap
+import os
+import stat
+import sys
+import time
+
+from nova.openstack.common import log as logging
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_BUFFER_SIZE = 4 * 1024 * 1024
+
+# Runs of zeros shorter than this are written out rather than skipped.
+HOLE_SIZE = 64 * 1024
+
+# O_DIRECT transfers need offsets, lengths and memory aligned to this.
+ALIGNMENT = 4096
+
+# The os module only has these from Python 3.3 on; the values are Linux's.
+SEEK_DATA = getattr(os, 'SEEK_DATA', 3)
+SEEK_HOLE = getattr(os, 'SEEK_HOLE', 4)
+
+# Python 2.6 has no memoryview to read into the aligned buffer through, so
+# there data is copied through strings and O_DIRECT isn't used.
+HAS_MEMORYVIEW = hasattr(__builtin__, 'memoryview')
+
+
+def _align_down(offset):
+    return offset - offset % ALIGNMENT
+
+
+def _aligned_buffer(size):
+    """Return a writable memoryview over page aligned memory."""
+    return memoryview((ctypes.c_char * size).from_buffer(mmap.mmap(-1, size)))
+
+
+def _open(path, flags, direct_io):
+    """Open path, with O_DIRECT if asked for and supported.
+
+    Returns the file and whether it was opened with O_DIRECT.
+    """
+    mode = 'r' if flags == os.O_RDONLY else 'w'
+    if direct_io and hasattr(os, 'O_DIRECT'):
+        try:
+            fd = os.open(path, flags | os.O_DIRECT)
+        except OSError as e:
+            if e.errno != errno.EINVAL:
+                raise
+            LOG.debug(_("%(path)s does not support O_DIRECT"), locals())
+        else:
+            return io.FileIO(fd, mode), True
+    return io.FileIO(os.open(path, flags), mode), False
+
+
+def _data_extents(src, length):
+    """Yield (start, end) for each range of src that may hold data."""
+    if not sys.platform.startswith('linux'):
+        yield 0, length
+        return
+
+    offset = 0
+    while offset < length:
+        try:
+            start = os.lseek(src.fileno(), offset, SEEK_DATA)
+        except OSError as e:
+            if e.errno == errno.ENXIO:
+                # Nothing but holes from offset to the end of the file
+                return
+            # The file system can't tell us where the holes are
+            yield offset, length
+            return
+        if start >= length:
+            return
+        end = min(os.lseek(src.fileno(), start, SEEK_HOLE), length)
+        yield _align_down(start), end
+        offset = end
+
+
+def _read(src, buf, offset, count, direct_io):
+    """Read up to count bytes at offset, returning the data read.
+
+    The data is read into buf and a view of it returned, unless buf is
+    None, which is when a string is returned instead.
+    """
+    if buf is None:
+        src.seek(offset)
+        return src.read(count)
+    if direct_io:
+        # The whole aligned block has to be read, even past count
+        size = min(count + (-count % ALIGNMENT), len(buf))
+    else:
+        size = count
+    src.seek(offset)
+    done = 0
+    while done < size:
+        n = src.readinto(buf[done:size])
+        if not n:
+            break
+        done += n
+    return buf[:min(done, count)]
+
+
+def _write(dst, data, offset, direct_io):
+    dst.seek(offset)
+    if direct_io and len(data) % ALIGNMENT:
+        aligned = _align_down(len(data))
+        _write(dst, data[:aligned], offset, False)
+        # Unaligned writes only come at the end of the copy, or of a data
+        # extent on an oddly sized file system, so O_DIRECT stays off.
+        flags = fcntl.fcntl(dst.fileno(), fcntl.F_GETFL)
+        fcntl.fcntl(dst.fileno(), fcntl.F_SETFL, flags & ~os.O_DIRECT)
+        _write(dst, data[aligned:], offset + aligned, False)
+        return
+    done = 0
+    while done < len(data):
+        done += dst.write(data[done:])
+
+
+def _write_sparse(dst, data, zeros, offset, direct_io):
+    """Write data at offset, skipping runs of zeros.
+
+    Returns the number of bytes skipped.
+    """
+    count = len(data)
+    if data == zeros[:count]:
+        return count
+
+    skipped = 0
+    run_start = None
+    for start in xrange(0, count, HOLE_SIZE):
+        end = min(start + HOLE_SIZE, count)
+        if data[start:end] == zeros[start:end]:
+            if run_start is not None:
+                _write(dst, data[run_start:start], offset + run_start,
+                       direct_io)
+                run_start = None
+            skipped += end - start
+        elif run_start is None:
+            run_start = start
+    if run_start is not None:
+        _write(dst, data[run_start:], offset + run_start, direct_io)
+    return skipped
+
+
+def copy(src_path, dst_path, length, buffer_size=DEFAULT_BUFFER_SIZE,
+         direct_io=False):
+    """Copy the first length bytes of src_path to dst_path.
+
+    Zeros aren't written, so dst_path has to read as zeros beforehand,
+    like a new file or a freshly created volume. A regular file at
+    dst_path is truncated to length.
+
+    :param buffer_size: bytes moved per read, a multiple of ALIGNMENT
+    :param direct_io: bypass the page cache with O_DIRECT where the
+                      file systems support it
+    """
+    start_time = time.time()
+    skipped_bytes = 0
+
+    LOG.debug(_("Starting sparse_copy src=%(src_path)s dst=%(dst_path)s "
+                "virtual_size=%(length)d buffer_size=%(buffer_size)d"),
+              locals())
+
+    if HAS_MEMORYVIEW:
+        buf = _aligned_buffer(buffer_size)
+        zeros = memoryview(bytearray(buffer_size))
+    else:
+        buf = None
+        zeros = '\0' * buffer_size
+        direct_io = False
+
+    src, src_direct = _open(src_path, os.O_RDONLY, direct_io)
+    with src:
+        dst, dst_direct = _open(dst_path, os.O_WRONLY | os.O_CREAT, direct_io)
+        with dst:
+            if stat.S_ISREG(os.fstat(dst.fileno()).st_mode):
+                os.ftruncate(dst.fileno(), length)
+
+            copied_to = 0
+            for start, end in _data_extents(src, length):
+                skipped_bytes += max(start - copied_to, 0)
+                offset = start
+                while offset < end:
+                    data = _read(src, buf, offset,
+                                 min(buffer_size, end - offset), src_direct)
+                    if not len(data):
+                        break
+                    skipped_bytes += _write_sparse(dst, data, zeros, offset,
+                                                   dst_direct)
+                    offset += len(data)
+                copied_to = offset
+            skipped_bytes += max(length - copied_to, 0)
+
+    duration = time.time() - start_time
+    compression_pct = float(skipped_bytes) / max(length, 1) * 100
+
+    LOG.debug(_("Finished sparse_copy in %(duration).2f secs, "
+                "%(compression_pct).2f%% reduction in size"), locals())
+    return skipped_bytes
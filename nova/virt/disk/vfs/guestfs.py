@@ -16,14 +16,139 @@
 
 import guestfs
 
+from eventlet import semaphore
+
 from nova import exception
+from nova.openstack.common import cfg
 from nova.openstack.common import log as logging
 from nova.virt.disk.vfs import api as vfs
 
 LOG = logging.getLogger(__name__)
 
+guestfs_opts = [
+    cfg.IntOpt('libguestfs_appliance_pool_size',
+               default=0,
+               help='Number of libguestfs appliances kept running to hot-add '
+                    'disk images to for file injection, which is also the '
+                    'most that run at once. Needs libguestfs 1.20 or later. '
+                    '0 launches an appliance for every image'),
+    ]
+
+CONF = cfg.CONF
+CONF.register_opts(guestfs_opts)
+
 guestfs = None
 
+# Label of the image drive hot-added to a pooled appliance
+DRIVE_LABEL = 'nova'
+
+_appliance_pool = None
+_hotplug_supported = True
+
+
+class HotplugUnsupported(Exception):
+    """Drives can't be hot-added to a launched appliance."""
+    pass
+
+
+class AppliancePool(object):
+    """Launched appliances that disk images are hot-added to.
+
+    Launching an appliance boots a small VM, which takes several seconds.
+    Appliances handed back are kept for the next image instead, and no
+    more than size of them run at once.
+    """
+
+    def __init__(self, size):
+        self._semaphore = semaphore.Semaphore(size)
+        self._idle = []
+
+    def get(self, imgfile, imgfmt):
+        """Return a launched handle with imgfile added as DRIVE_LABEL.
+
+        Blocks while size handles are out. The handle has to be given back
+        with put(), or with discard() if it may be unusable.
+
+        :raises: HotplugUnsupported if libguestfs can't hot-add drives
+        """
+        self._semaphore.acquire()
+        try:
+            if self._idle:
+                handle = self._idle.pop()
+            else:
+                LOG.debug(_("Launching pooled appliance"))
+                handle = guestfs.GuestFS()
+                try:
+                    # Only appliances run by libvirt can have drives
+                    # hot-added.
+                    handle.set_attach_method('libvirt')
+                except (AttributeError, RuntimeError), e:
+                    _close(handle)
+                    raise HotplugUnsupported(e)
+                handle.launch()
+            try:
+                handle.add_drive_opts(imgfile, format=imgfmt,
+                                      label=DRIVE_LABEL)
+            except (TypeError, RuntimeError), e:
+                # The bindings of libguestfs before 1.20 can't label
+                # drives, and appliances that can't hot-add them fail
+                # the call.
+                _close(handle)
+                raise HotplugUnsupported(e)
+            except Exception:
+                _close(handle)
+                raise
+            return handle
+        except Exception:
+            self._semaphore.release()
+            raise
+
+    def put(self, handle):
+        """Remove the image drive from a handle and keep it for reuse."""
+        try:
+            handle.umount_all()
+            handle.remove_drive(DRIVE_LABEL)
+        except RuntimeError, e:
+            LOG.warn(_("Failed to remove drive from appliance %s"), e)
+            self.discard(handle)
+            return
+        self._idle.append(handle)
+        self._semaphore.release()
+
+    def discard(self, handle):
+        """Shut down a handle rather than keeping it."""
+        try:
+            _close(handle)
+        finally:
+            self._semaphore.release()
+
+
+def _get_appliance_pool():
+    global _appliance_pool
+    if not _hotplug_supported or CONF.libguestfs_appliance_pool_size <= 0:
+        return None
+    if _appliance_pool is None:
+        _appliance_pool = AppliancePool(CONF.libguestfs_appliance_pool_size)
+    return _appliance_pool
+
+
+def _close(handle):
+    try:
+        handle.shutdown()
+    except AttributeError:
+        # Older libguestfs versions haven't an explicit shutdown
+        pass
+    except RuntimeError, e:
+        LOG.warn(_("Failed to shutdown appliance %s"), e)
+
+    try:
+        handle.close()
+    except AttributeError:
+        # Older libguestfs versions haven't an explicit close
+        pass
+    except RuntimeError, e:
+        LOG.warn(_("Failed to close guest handle %s"), e)
+
 
 class VFSGuestFS(vfs.VFS):
 
@@ -41,6 +166,8 @@ class VFSGuestFS(vfs.VFS):
             guestfs = __import__('guestfs')
 
         self.handle = None
+        self.pool = None
+        self.device = "/dev/sda"
 
     def setup_os(self):
         if self.partition == -1:
@@ -53,9 +180,10 @@ class VFSGuestFS(vfs.VFS):
                   {'imgfile': self.imgfile, 'part': str(self.partition)})
 
         if self.partition:
-            self.handle.mount_options("", "/dev/sda%d" % self.partition, "/")
+            self.handle.mount_options("", "%s%d" % (self.device,
+                                                    self.partition), "/")
         else:
-            self.handle.mount_options("", "/dev/sda", "/")
+            self.handle.mount_options("", self.device, "/")
 
     def setup_os_inspect(self):
         LOG.debug(_("Inspecting guest OS image %s"), self.imgfile)
@@ -91,25 +219,53 @@ class VFSGuestFS(vfs.VFS):
     def setup(self):
         LOG.debug(_("Setting up appliance for %(imgfile)s %(imgfmt)s") %
                   {'imgfile': self.imgfile, 'imgfmt': self.imgfmt})
-        self.handle = guestfs.GuestFS()
-
         try:
-            self.handle.add_drive_opts(self.imgfile, format=self.imgfmt)
-            self.handle.launch()
+            self.launch()
 
             self.setup_os()
 
             self.handle.aug_init("/", 0)
         except RuntimeError, e:
-            # dereference object and implicitly close()
-            self.handle = None
+            self._release(discard=True)
             raise exception.NovaException(
                 _("Error mounting %(imgfile)s with libguestfs (%(e)s)") %
                 {'imgfile': self.imgfile, 'e': e})
         except Exception:
-            self.handle = None
+            self._release(discard=True)
             raise
 
+    def launch(self):
+        pool = _get_appliance_pool()
+        if pool is not None:
+            try:
+                self.handle = pool.get(self.imgfile, self.imgfmt)
+            except HotplugUnsupported, e:
+                global _hotplug_supported
+                _hotplug_supported = False
+                LOG.warn(_("Disabling the libguestfs appliance pool, drives "
+                           "can't be hot-added (%s)"), e)
+            else:
+                self.pool = pool
+                self.device = "/dev/disk/guestfs/%s" % DRIVE_LABEL
+                return
+
+        self.handle = guestfs.GuestFS()
+        self.handle.add_drive_opts(self.imgfile, format=self.imgfmt)
+        self.handle.launch()
+
+    def _release(self, discard=False):
+        handle = self.handle
+        pool = self.pool
+        # dereference object and implicitly close()
+        self.handle = None
+        self.pool = None
+        if handle is None or pool is None:
+            return
+        if discard:
+            pool.discard(handle)
+        else:
+            pool.put(handle)
+
     def teardown(self):
         LOG.debug(_("Tearing down appliance"))
 
@@ -119,24 +275,10 @@ class VFSGuestFS(vfs.VFS):
             except RuntimeError, e:
                 LOG.warn(_("Failed to close augeas %s"), e)
 
-            try:
-                self.handle.shutdown()
-            except AttributeError:
-                # Older libguestfs versions haven't an explicit shutdown
-                pass
-            except RuntimeError, e:
-                LOG.warn(_("Failed to shutdown appliance %s"), e)
-
-            try:
-                self.handle.close()
-            except AttributeError:
-                # Older libguestfs versions haven't an explicit close
-                pass
-            except RuntimeError, e:
-                LOG.warn(_("Failed to close guest handle %s"), e)
+            if self.pool is None:
+                _close(self.handle)
         finally:
-            # dereference object and implicitly close()
-            self.handle = None
+            self._release()
 
     @staticmethod
     def _canonicalize_path(path):
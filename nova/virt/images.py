@@ -27,6 +27,7 @@ import re
 from nova import exception
 from nova.image import glance
 from nova.openstack.common import cfg
+from nova.openstack.common import excutils
 from nova.openstack.common import log as logging
 from nova import utils
 
@@ -190,22 +191,46 @@ def convert_image(source, dest, out_format):
     utils.execute(*cmd)
 
 
-def fetch(context, image_href, path, _user_id, _project_id):
+def fetch(context, image_href, path, _user_id, _project_id, resume=False):
+    """Download an image to path.
+
+    With resume, what a download that failed to reach glance left in
+    path is kept, and taken as the start of the image by the next one.
+    """
     # TODO(vish): Improve context handling and add owner and auth data
     #             when it is added to glance.  Right now there is no
     #             auth checking in glance, so we assume that access was
     #             checked before we got here.
     (image_service, image_id) = glance.get_remote_image_service(context,
                                                                 image_href)
-    with utils.remove_path_on_error(path):
-        with open(path, "wb") as image_file:
+    try:
+        if resume and os.path.exists(path):
+            LOG.debug(_("Resuming download of %(image_href)s to %(path)s"),
+                      locals())
+            image_file = open(path, "r+b")
+            image_file.seek(0, os.SEEK_END)
+        else:
+            image_file = open(path, "wb")
+        with image_file:
             image_service.download(context, image_id, image_file)
+    except exception.GlanceConnectionFailed:
+        with excutils.save_and_reraise_exception():
+            if not resume:
+                utils.delete_if_exists(path)
+    except Exception:
+        with excutils.save_and_reraise_exception():
+            utils.delete_if_exists(path)
 
 
 def fetch_to_raw(context, image_href, path, user_id, project_id):
     path_tmp = "%s.part" % path
-    fetch(context, image_href, path_tmp, user_id, project_id)
+    fetch(context, image_href, path_tmp, user_id, project_id, resume=True)
+    move_to_raw(image_href, path_tmp, path)
+
 
+def move_to_raw(image_href, path_tmp, path):
+    """Move an image fetched to path_tmp to path, converting it to raw
+    if CONF.force_raw_images is set."""
     with utils.remove_path_on_error(path_tmp):
         data = qemu_img_info(path_tmp)
 
@@ -233,6 +258,7 @@ def fetch_to_raw(context, image_href, path, user_id, project_id):
                         data.file_format)
 
                 os.rename(staged, path)
+                os.unlink(path_tmp)
 
         else:
             os.rename(path_tmp, path)
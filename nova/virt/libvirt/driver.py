@@ -79,6 +79,7 @@ from nova.virt.libvirt import config as vconfig
 from nova.virt.libvirt import firewall as libvirt_firewall
 from nova.virt.libvirt import imagebackend
 from nova.virt.libvirt import imagecache
+from nova.virt.libvirt import imagepeer
 from nova.virt.libvirt import utils as libvirt_utils
 from nova.virt import netutils
 
@@ -196,6 +197,7 @@ CONF.import_opt('default_ephemeral_format', 'nova.virt.driver')
 CONF.import_opt('use_cow_images', 'nova.virt.driver')
 CONF.import_opt('live_migration_retry_count', 'nova.compute.manager')
 CONF.import_opt('vncserver_proxyclient_address', 'nova.vnc')
+CONF.import_opt('base_dir_name', 'nova.virt.libvirt.imagecache')
 
 DEFAULT_FIREWALL_DRIVER = "%s.%s" % (
     libvirt_firewall.__name__,
@@ -344,6 +346,10 @@ class LibvirtDriver(driver.ComputeDriver):
                         '%(major)i.%(minor)i.%(micro)i or greater.') %
                         locals())
 
+        if CONF.libvirt_image_peer_port:
+            base_dir = os.path.join(CONF.instances_path, CONF.base_dir_name)
+            self._image_peer_server = imagepeer.start_server(base_dir)
+
     def _get_connection(self):
         if not self._wrapped_conn or not self._test_connection():
             LOG.debug(_('Connecting to libvirt: %s'), self.uri)
@@ -601,6 +607,7 @@ class LibvirtDriver(driver.ComputeDriver):
 
             #NOTE(bfilippov): destroy all LVM disks for this instance
             self._cleanup_lvm(instance)
+            imagecache.remove_image_user(instance['name'])
 
     def _cleanup_lvm(self, instance):
         """Delete all LVM disks for given instance object."""
@@ -1306,6 +1313,7 @@ class LibvirtDriver(driver.ComputeDriver):
                                 image_id=disk_images['image_id'],
                                 user_id=instance['user_id'],
                                 project_id=instance['project_id'])
+            imagecache.add_image_user(root_fname, instance['name'])
 
         # Lookup the filesystem type if required
         os_type_with_default = instance['os_type']
@@ -2710,6 +2718,7 @@ class LibvirtDriver(driver.ComputeDriver):
                             user_id=instance['user_id'],
                             project_id=instance['project_id'],
                             size=info['virt_disk_size'])
+                imagecache.add_image_user(cache_name, instance['name'])
 
         # if image has kernel and ramdisk, just download
         # following normal way.
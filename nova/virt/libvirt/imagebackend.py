@@ -22,7 +22,6 @@ import os
 from nova.openstack.common import cfg
 from nova.openstack.common import excutils
 from nova.openstack.common import fileutils
-from nova.openstack.common import lockutils
 from nova import utils
 from nova.virt.disk import api as disk
 from nova.virt.libvirt import config as vconfig
@@ -114,8 +113,8 @@ class Image(object):
         :filename: Name of the file in the image directory
         :size: Size of created image in bytes (optional)
         """
-        @lockutils.synchronized(filename, 'nova-', external=True,
-                                lock_path=self.lock_path)
+        @utils.synchronized(filename, external=True,
+                            lock_path=self.lock_path)
         def call_if_not_exists(target, *args, **kwargs):
             if not os.path.exists(target):
                 fetch_func(target=target, *args, **kwargs)
@@ -146,8 +145,8 @@ class Raw(Image):
                                          instance, name)
 
     def create_image(self, prepare_template, base, size, *args, **kwargs):
-        @lockutils.synchronized(base, 'nova-', external=True,
-                                lock_path=self.lock_path)
+        @utils.synchronized(base, external=True,
+                            lock_path=self.lock_path)
         def copy_raw_image(base, target, size):
             libvirt_utils.copy_image(base, target)
             if size:
@@ -174,8 +173,8 @@ class Qcow2(Image):
                                          instance, name)
 
     def create_image(self, prepare_template, base, size, *args, **kwargs):
-        @lockutils.synchronized(base, 'nova-', external=True,
-                                lock_path=self.lock_path)
+        @utils.synchronized(base, external=True,
+                            lock_path=self.lock_path)
         def copy_qcow2_image(base, target, size):
             libvirt_utils.create_cow_image(base, target)
             if size:
@@ -215,8 +214,8 @@ class Lvm(Image):
         self.sparse = CONF.libvirt_sparse_logical_volumes
 
     def create_image(self, prepare_template, base, size, *args, **kwargs):
-        @lockutils.synchronized(base, 'nova-', external=True,
-                                lock_path=self.lock_path)
+        @utils.synchronized(base, external=True,
+                            lock_path=self.lock_path)
         def create_lvm_image(base, size):
             base_size = disk.get_disk_size(base)
             resize = size > base_size
@@ -22,18 +22,23 @@ http://wiki.openstack.org/nova-image-cache-management.
 
 """
 
+import ctypes
 import hashlib
+import io
 import json
 import os
+import platform
 import re
 import time
 
+from eventlet import patcher
+from eventlet import tpool
+
 from nova.compute import task_states
 from nova.compute import vm_states
 from nova.openstack.common import cfg
 from nova.openstack.common import fileutils
 from nova.openstack.common import jsonutils
-from nova.openstack.common import lockutils
 from nova.openstack.common import log as logging
 from nova import utils
 from nova.virt.libvirt import utils as virtutils
@@ -68,6 +73,21 @@ imagecache_opts = [
     cfg.IntOpt('checksum_interval_seconds',
                default=3600,
                help='How frequently to checksum base images'),
+    cfg.IntOpt('checksum_bytes_per_second',
+               default=0,
+               help='Rate to read base images at when checksumming them, '
+                    'or 0 for no limit'),
+    cfg.IntOpt('checksum_seconds_per_pass',
+               default=300,
+               help='Seconds an image cache manager pass may spend '
+                    'verifying base images. Verifications still going are '
+                    'carried on in the next pass. 0 for no limit'),
+    cfg.IntOpt('image_cache_full_scan_interval',
+               default=(24 * 3600),
+               help='Seconds between image cache manager passes which list '
+                    '_base and the backing file of every instance disk. '
+                    'Passes in between go by an inventory of base files '
+                    'kept in _base. 0 to always scan and keep no inventory'),
     ]
 
 CONF = cfg.CONF
@@ -75,6 +95,22 @@ CONF.register_opts(imagecache_opts)
 CONF.import_opt('host', 'nova.netconf')
 CONF.import_opt('instances_path', 'nova.compute.manager')
 
+# Base files are verified a segment at a time, so that a verification can
+# stop at the end of a pass and carry on in the next
+CHECKSUM_SEGMENT_SIZE = 256 * 1024 * 1024
+CHECKSUM_BUFFER_SIZE = 4 * 1024 * 1024
+
+IOPRIO_WHO_PROCESS = 1
+IOPRIO_CLASS_IDLE = 3
+IOPRIO_CLASS_SHIFT = 13
+_IOPRIO_SET_SYSCALLS = {'x86_64': 251,
+                        'i386': 289,
+                        'i686': 289,
+                        'aarch64': 30}
+
+# Hashing threads sleep for real, not in the hub
+_native_sleep = patcher.original('time').sleep
+
 
 def get_info_filename(base_path):
     """Construct a filename for storing addtional information about a base
@@ -145,8 +181,8 @@ def read_stored_info(target, field=None, timestamped=False):
         lock_name = 'info-%s' % os.path.split(target)[-1]
         lock_path = os.path.join(CONF.instances_path, 'locks')
 
-        @lockutils.synchronized(lock_name, 'nova-', external=True,
-                                lock_path=lock_path)
+        @utils.synchronized(lock_name, external=True,
+                            lock_path=lock_path)
         def read_file(info_file):
             LOG.debug(_('Reading image info file: %s'), info_file)
             with open(info_file, 'r') as f:
@@ -176,8 +212,8 @@ def write_stored_info(target, field=None, value=None):
     lock_name = 'info-%s' % os.path.split(target)[-1]
     lock_path = os.path.join(CONF.instances_path, 'locks')
 
-    @lockutils.synchronized(lock_name, 'nova-', external=True,
-                            lock_path=lock_path)
+    @utils.synchronized(lock_name, external=True,
+                        lock_path=lock_path)
     def write_file(info_file, field, value):
         d = {}
 
@@ -194,6 +230,166 @@ def write_stored_info(target, field=None, value=None):
     write_file(info_file, field, value)
 
 
+def get_inventory_filename():
+    """Return the path of the inventory of base images."""
+    return os.path.join(CONF.instances_path, CONF.base_dir_name,
+                        'inventory.json')
+
+
+def _read_inventory():
+    """Read the inventory of base images.
+
+    The inventory maps the names of base files to a dictionary of the
+    instances created from them, with the time they were recorded, and
+    the time the file was last checksummed. Returns None if there is no
+    inventory.
+    """
+    inventory_file = get_inventory_filename()
+    try:
+        with open(inventory_file, 'r') as f:
+            serialized = f.read()
+    except IOError:
+        return None
+
+    inventory = _read_possible_json(serialized, inventory_file)
+    if 'base_files' not in inventory:
+        return None
+    return inventory
+
+
+def _update_inventory(update, create=False):
+    """Apply update to the inventory of base images, and write it back.
+
+    Does nothing if there is no inventory, unless create is True.
+    """
+    if not CONF.image_cache_full_scan_interval:
+        return
+
+    inventory_file = get_inventory_filename()
+    if not create and not os.path.exists(inventory_file):
+        return
+
+    lock_path = os.path.join(CONF.instances_path, 'locks')
+
+    @utils.synchronized('image-inventory', external=True,
+                        lock_path=lock_path)
+    def update_file():
+        inventory = _read_inventory()
+        if inventory is None:
+            if not create:
+                return
+            inventory = {'base_files': {}}
+
+        update(inventory)
+
+        # Other compute nodes sharing this storage may be reading it
+        with open(inventory_file + '.tmp', 'w') as f:
+            f.write(jsonutils.dumps(inventory))
+        os.rename(inventory_file + '.tmp', inventory_file)
+
+    update_file()
+
+
+def add_image_user(base_file, instance_name):
+    """Record that the disk of an instance was created from a base file."""
+
+    def add(inventory):
+        entry = inventory['base_files'].setdefault(
+            os.path.basename(base_file), {'users': {}})
+        entry['users'][instance_name] = time.time()
+
+    _update_inventory(add)
+
+
+def remove_image_user(instance_name):
+    """Record that the disks of an instance were deleted."""
+
+    def remove(inventory):
+        for entry in inventory['base_files'].itervalues():
+            entry['users'].pop(instance_name, None)
+
+    _update_inventory(remove)
+
+
+def _set_io_priority(ioprio):
+    """Set the I/O priority of the calling thread, where that is possible.
+
+    ioprio_set(2) has no libc wrapper, so it is called by its number.
+    """
+    number = _IOPRIO_SET_SYSCALLS.get(platform.machine())
+    if number is None:
+        return False
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        return libc.syscall(number, IOPRIO_WHO_PROCESS, 0, ioprio) == 0
+    except (AttributeError, OSError):
+        return False
+
+
+def _hash_segments(path, offset, deadline, rate, whole):
+    """Hash path from offset, in segments of CHECKSUM_SEGMENT_SIZE.
+
+    This runs in a native thread, at idle I/O priority. It stops at the
+    end of the segment it is in at the deadline, if one is given, and
+    reads at most rate bytes a second if that is set. whole, if given, is
+    updated with everything read.
+
+    Returns the hex SHA1s of the segments hashed, and whether the end of
+    the file was reached.
+    """
+    idle = _set_io_priority(IOPRIO_CLASS_IDLE << IOPRIO_CLASS_SHIFT)
+    try:
+        digests = []
+        segment = hashlib.sha1()
+        segment_size = 0
+        read = 0
+        started = time.time()
+        with io.open(path, 'rb', buffering=0) as f:
+            f.seek(offset)
+            while True:
+                if (deadline and not segment_size and
+                    time.time() >= deadline):
+                    # A file ending on a segment boundary is complete
+                    if f.tell() < os.fstat(f.fileno()).st_size:
+                        return digests, False
+
+                chunk = f.read(min(CHECKSUM_BUFFER_SIZE,
+                                   CHECKSUM_SEGMENT_SIZE - segment_size))
+                if not chunk:
+                    break
+                n = len(chunk)
+                segment.update(chunk)
+                if whole is not None:
+                    whole.update(chunk)
+                segment_size += n
+                if segment_size == CHECKSUM_SEGMENT_SIZE:
+                    digests.append(segment.hexdigest())
+                    segment = hashlib.sha1()
+                    segment_size = 0
+
+                read += n
+                if rate:
+                    delay = started + float(read) / rate - time.time()
+                    if delay > 0:
+                        _native_sleep(delay)
+
+        if segment_size or not (digests or offset):
+            digests.append(segment.hexdigest())
+        return digests, True
+    finally:
+        if idle:
+            _set_io_priority(0)
+
+
+def _checksum_file(path, offset=0, deadline=None, whole=None):
+    """Hash path in a native thread, so other greenthreads can go on.
+
+    See _hash_segments.
+    """
+    return tpool.execute(_hash_segments, path, offset, deadline,
+                         CONF.checksum_bytes_per_second, whole)
+
+
 def read_stored_checksum(target, timestamped=True):
     """Read the checksum.
 
@@ -205,9 +401,10 @@ def read_stored_checksum(target, timestamped=True):
 def write_stored_checksum(target):
     """Write a checksum to disk for a file in _base."""
 
-    with open(target, 'r') as img_file:
-        checksum = utils.hash_file(img_file)
-    write_stored_info(target, field='sha1', value=checksum)
+    checksum = hashlib.sha1()
+    segments, _eof = _checksum_file(target, whole=checksum)
+    write_stored_info(target, field='sha1-segments', value=segments)
+    write_stored_info(target, field='sha1', value=checksum.hexdigest())
 
 
 class ImageCacheManager(object):
@@ -222,6 +419,13 @@ class ImageCacheManager(object):
         self.image_popularity = {}
         self.instance_names = {}
 
+        # Base files found, the instances using them and when they were
+        # last checksummed
+        self.base_files = []
+        self.base_file_users = {}
+        self.checksum_times = {}
+        self.checksum_deadline = None
+
         self.active_base_files = []
         self.corrupt_base_files = []
         self.originals = []
@@ -232,6 +436,7 @@ class ImageCacheManager(object):
         """Store a base image for later examination."""
         entpath = os.path.join(base_dir, ent)
         if os.path.isfile(entpath):
+            self.base_files.append(entpath)
             self.unexplained_images.append(entpath)
             if original:
                 self.originals.append(entpath)
@@ -256,6 +461,16 @@ class ImageCacheManager(object):
                   not is_valid_info_file(os.path.join(base_dir, ent))):
                 self._store_image(base_dir, ent, original=False)
 
+    def _list_inventory_images(self, base_dir, inventory):
+        """Like _list_base_images, but going by the inventory."""
+        digest_size = hashlib.sha1().digestsize * 2
+        for ent, entry in inventory['base_files'].iteritems():
+            self._store_image(base_dir, ent,
+                              original=(len(ent) == digest_size))
+            if entry.get('checked'):
+                self.checksum_times[os.path.join(base_dir, ent)] = \
+                    entry['checked']
+
     def _list_running_instances(self, context, all_instances):
         """List running instances (on all compute nodes)."""
         self.used_images = {}
@@ -307,6 +522,8 @@ class ImageCacheManager(object):
                                                     backing_file)
                         if not backing_path in inuse_images:
                             inuse_images.append(backing_path)
+                        self.base_file_users.setdefault(
+                            backing_path, set()).add(ent)
 
                         if backing_path in self.unexplained_images:
                             LOG.warning(_('Instance %(instance)s is using a '
@@ -319,6 +536,18 @@ class ImageCacheManager(object):
 
         return inuse_images
 
+    def _list_inventory_backing_images(self, base_dir, inventory):
+        """Like _list_backing_images, but going by the inventory."""
+        inuse_images = []
+        for ent, entry in inventory['base_files'].iteritems():
+            backing_path = os.path.join(base_dir, ent)
+            if not entry['users'] or backing_path not in self.base_files:
+                continue
+            inuse_images.append(backing_path)
+            if backing_path in self.unexplained_images:
+                self.unexplained_images.remove(backing_path)
+        return inuse_images
+
     def _find_base_file(self, base_dir, fingerprint):
         """Find the base file matching this fingerprint.
 
@@ -357,12 +586,24 @@ class ImageCacheManager(object):
         if not CONF.checksum_base_images:
             return None
 
+        checksum_time = self.checksum_times.get(base_file)
+        if (checksum_time and
+            time.time() - checksum_time < CONF.checksum_interval_seconds):
+            return True
+
+        if self.checksum_deadline and time.time() >= self.checksum_deadline:
+            LOG.debug(_('image %(id)s at (%(base_file)s): no time left to '
+                        'verify the image in this pass'),
+                      {'id': img_id,
+                       'base_file': base_file})
+            return None
+
         lock_name = 'hash-%s' % os.path.split(base_file)[-1]
 
         # Protect against other nova-computes performing checksums at the same
         # time if we are using shared storage
-        @lockutils.synchronized(lock_name, 'nova-', external=True,
-                                lock_path=self.lock_path)
+        @utils.synchronized(lock_name, external=True,
+                            lock_path=self.lock_path)
         def inner_verify_checksum():
             (stored_checksum, stored_timestamp) = read_stored_checksum(
                 base_file, timestamped=True)
@@ -373,25 +614,60 @@ class ImageCacheManager(object):
                 if (stored_timestamp and
                     time.time() - stored_timestamp <
                     CONF.checksum_interval_seconds):
+                    self.checksum_times[base_file] = stored_timestamp
                     return True
 
-                # NOTE(mikal): If there is no timestamp, then the checksum was
-                # performed by a previous version of the code.
-                if not stored_timestamp:
-                    write_stored_info(base_file, field='sha1',
-                                      value=stored_checksum)
-
-                with open(base_file, 'r') as f:
-                    current_checksum = utils.hash_file(f)
-
-                if current_checksum != stored_checksum:
+                info = read_stored_info(base_file)
+                stored_segments = info.get('sha1-segments')
+                if stored_segments:
+                    # Carry on from the segments verified by earlier passes
+                    verified = info.get('sha1-verified') or 0
+                    segments, complete = _checksum_file(
+                        base_file, verified * CHECKSUM_SEGMENT_SIZE,
+                        self.checksum_deadline)
+                    end = verified + len(segments)
+                    valid = (segments == stored_segments[verified:end] and
+                             (end == len(stored_segments)
+                              if complete else end < len(stored_segments)))
+                else:
+                    # Checksums stored by older versions cover the whole
+                    # file, so verifying them can't stop part way
+                    checksum = hashlib.sha1()
+                    segments, complete = _checksum_file(base_file,
+                                                        whole=checksum)
+                    valid = checksum.hexdigest() == stored_checksum
+                    if valid:
+                        write_stored_info(base_file, field='sha1-segments',
+                                          value=segments)
+
+                if not valid:
                     LOG.error(_('image %(id)s at (%(base_file)s): image '
                                 'verification failed'),
                               {'id': img_id,
                                'base_file': base_file})
+                    if stored_segments:
+                        write_stored_info(base_file, field='sha1-verified',
+                                          value=0)
                     return False
 
+                elif not complete:
+                    LOG.info(_('image %(id)s at (%(base_file)s): image '
+                               'verification will carry on in the next '
+                               'pass'),
+                             {'id': img_id,
+                              'base_file': base_file})
+                    write_stored_info(base_file, field='sha1-verified',
+                                      value=end)
+                    return None
+
                 else:
+                    if stored_segments:
+                        write_stored_info(base_file, field='sha1-verified',
+                                          value=0)
+                    # Restart the interval, here and for other nodes
+                    write_stored_info(base_file, field='sha1',
+                                      value=stored_checksum)
+                    self.checksum_times[base_file] = time.time()
                     return True
 
             else:
@@ -408,6 +684,7 @@ class ImageCacheManager(object):
                              {'id': img_id,
                               'base_file': base_file})
                     write_stored_checksum(base_file)
+                    self.checksum_times[base_file] = time.time()
 
                 return None
 
@@ -515,6 +792,42 @@ class ImageCacheManager(object):
                     virtutils.chown(base_file, os.getuid())
                     os.utime(base_file, None)
 
+    def _update_inventory(self, base_dir, pass_start, full_scan):
+        """Write what this pass found to the inventory.
+
+        A full scan replaces the inventory, keeping instances recorded
+        since the pass started. Otherwise only removed base files and
+        checksum times change.
+        """
+
+        def update(inventory):
+            base_files = inventory['base_files']
+            if full_scan:
+                inventory['scanned'] = pass_start
+                inventory['base_files'] = {}
+                for base_file in self.base_files:
+                    ent = os.path.basename(base_file)
+                    users = self.base_file_users.get(base_file, [])
+                    inventory['base_files'][ent] = {
+                        'users': dict((user, pass_start) for user in users),
+                        'checked': base_files.get(ent, {}).get('checked')}
+
+                for ent, entry in base_files.iteritems():
+                    for user, recorded in entry['users'].iteritems():
+                        if recorded >= pass_start:
+                            new_entry = inventory['base_files'].setdefault(
+                                ent, {'users': {}})
+                            new_entry['users'][user] = recorded
+
+            for ent, entry in inventory['base_files'].items():
+                base_file = os.path.join(base_dir, ent)
+                if not entry['users'] and not os.path.exists(base_file):
+                    del inventory['base_files'][ent]
+                elif base_file in self.checksum_times:
+                    entry['checked'] = self.checksum_times[base_file]
+
+        _update_inventory(update, create=full_scan)
+
     def verify_base_images(self, context, all_instances):
         """Verify that base images are in a reasonable state."""
 
@@ -535,8 +848,26 @@ class ImageCacheManager(object):
                       base_dir)
             return
 
+        # Between full scans, the base files and the instances using them
+        # are taken from the inventory, which is updated as instance disks
+        # are created and deleted
+        inventory = None
+        if CONF.image_cache_full_scan_interval:
+            inventory = _read_inventory()
+            if (inventory and
+                time.time() - inventory.get('scanned', 0) >=
+                CONF.image_cache_full_scan_interval):
+                inventory = None
+        pass_start = time.time()
+        if CONF.checksum_seconds_per_pass:
+            self.checksum_deadline = (pass_start +
+                                      CONF.checksum_seconds_per_pass)
+
         LOG.debug(_('Verify base images'))
-        self._list_base_images(base_dir)
+        if inventory is None:
+            self._list_base_images(base_dir)
+        else:
+            self._list_inventory_images(base_dir, inventory)
         self._list_running_instances(context, all_instances)
 
         # Determine what images are on disk because they're in use
@@ -548,12 +879,18 @@ class ImageCacheManager(object):
             for result in self._find_base_file(base_dir, fingerprint):
                 base_file, image_small, image_resized = result
                 self._handle_base_image(img, base_file)
+                self.base_file_users.setdefault(base_file, set()).update(
+                    self.used_images[img][2])
 
                 if not image_small and not image_resized:
                     self.originals.append(base_file)
 
         # Elements remaining in unexplained_images might be in use
-        inuse_backing_images = self._list_backing_images()
+        if inventory is None:
+            inuse_backing_images = self._list_backing_images()
+        else:
+            inuse_backing_images = self._list_inventory_backing_images(
+                base_dir, inventory)
         for backing_path in inuse_backing_images:
             if not backing_path in self.active_base_files:
                 self.active_base_files.append(backing_path)
@@ -579,5 +916,9 @@ class ImageCacheManager(object):
                 for base_file in self.removable_base_files:
                     self._remove_base_file(base_file)
 
+        if CONF.image_cache_full_scan_interval:
+            self._update_inventory(base_dir, pass_start,
+                                   full_scan=(inventory is None))
+
         # That's it
         LOG.debug(_('Verification complete'))
@@ -0,0 +1,239 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 OpenStack LLC.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Sharing of base images between compute nodes.
+
+A compute node with libvirt_image_peer_port set serves the files in its
+image cache over HTTP, and one with libvirt_image_peers set asks those
+nodes for an image before downloading it from glance. An image is only
+taken from a peer if its MD5 matches the checksum glance has for it, so
+only base files kept as glance has them, rather than converted to raw,
+are shared. With force_raw_images set every base file is converted, so
+images are neither served nor looked for on peers.
+
+Peers only serve an image to requests carrying its checksum, which only
+those allowed to see the image in glance can learn. There is no other
+authentication, so the port should only be reachable by compute nodes.
+
+Two nova-compute processes on one machine can share images given their
+own instances_path and libvirt_image_peer_port, and the address of the
+other in libvirt_image_peers.
+"""
+
+import hashlib
+import httplib
+import os
+import random
+import socket
+import urllib
+
+from eventlet import greenthread
+import webob.dec
+import webob.exc
+
+from nova.image import glance
+from nova.openstack.common import cfg
+from nova.openstack.common import log as logging
+from nova import utils
+from nova.virt import images
+from nova import wsgi
+
+LOG = logging.getLogger(__name__)
+
+imagepeer_opts = [
+    cfg.ListOpt('libvirt_image_peers',
+                default=[],
+                help='host:port of the compute nodes to fetch base images '
+                     'from, if they have them, before trying glance. '
+                     'Ignored when force_raw_images is set'),
+    cfg.StrOpt('libvirt_image_peer_listen',
+               default='$my_ip',
+               help='IP address to serve base images to other compute '
+                    'nodes on'),
+    cfg.IntOpt('libvirt_image_peer_port',
+               default=0,
+               help='Port to serve base images to other compute nodes on, '
+                    'or 0 not to serve them. Nothing is served when '
+                    'force_raw_images is set. Requests are only checked '
+                    'against the image checksum, which is not a secret, '
+                    'so firewall the port off from everything but other '
+                    'compute nodes'),
+    ]
+
+CONF = cfg.CONF
+CONF.register_opts(imagepeer_opts)
+CONF.import_opt('force_raw_images', 'nova.virt.images')
+CONF.import_opt('my_ip', 'nova.netconf')
+
+CHUNK_SIZE = 64 * 1024
+
+# Seconds to wait for a peer before trying the next
+PEER_TIMEOUT = 30
+
+
+class FileIter(object):
+    """Iterator over a file, closing it when done."""
+
+    def __init__(self, file):
+        self.file = file
+
+    def __iter__(self):
+        try:
+            for chunk in iter(lambda: self.file.read(CHUNK_SIZE), ''):
+                yield chunk
+        finally:
+            self.close()
+
+    def close(self):
+        self.file.close()
+
+
+class ImagePeerApp(object):
+    """Serves the files of an image cache, by image id.
+
+    GET /images/<image id> returns the base file of an image, if its MD5
+    matches the X-Image-Checksum header of the request.
+    """
+
+    def __init__(self, base_dir):
+        self.base_dir = base_dir
+        # MD5s of base files, keyed by path, with their size and mtime
+        self._checksums = {}
+
+    def _checksum(self, path, stat):
+        key = (stat.st_size, stat.st_mtime)
+        cached = self._checksums.get(path)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+
+        md5 = hashlib.md5()
+        with open(path, 'rb') as base_file:
+            for chunk in iter(lambda: base_file.read(CHUNK_SIZE), ''):
+                md5.update(chunk)
+                # Let requests for other images go on meanwhile
+                greenthread.sleep(0)
+        checksum = md5.hexdigest()
+        self._checksums[path] = (key, checksum)
+        return checksum
+
+    @webob.dec.wsgify
+    def __call__(self, req):
+        parts = req.path_info.strip('/').split('/')
+        if len(parts) != 2 or parts[0] != 'images':
+            raise webob.exc.HTTPNotFound()
+        if req.method not in ('GET', 'HEAD'):
+            raise webob.exc.HTTPMethodNotAllowed()
+
+        wanted = req.headers.get('X-Image-Checksum')
+        if not wanted:
+            raise webob.exc.HTTPForbidden()
+
+        image_id = urllib.unquote(parts[1])
+        path = os.path.join(self.base_dir, hashlib.sha1(image_id).hexdigest())
+        try:
+            base_file = open(path, 'rb')
+        except IOError:
+            raise webob.exc.HTTPNotFound()
+
+        try:
+            stat = os.fstat(base_file.fileno())
+            checksum = self._checksum(path, stat)
+            if wanted != checksum:
+                # Most likely the image was converted to raw
+                raise webob.exc.HTTPNotFound()
+        except Exception:
+            base_file.close()
+            raise
+
+        LOG.debug(_("Serving image %(image_id)s to %(peer)s"),
+                  {'image_id': image_id, 'peer': req.remote_addr})
+        resp = webob.Response(content_type='application/octet-stream')
+        resp.headers['X-Image-Checksum'] = checksum
+        resp.app_iter = FileIter(base_file)
+        resp.content_length = stat.st_size
+        return resp
+
+
+def start_server(base_dir):
+    """Start serving the base files in base_dir to other compute nodes.
+
+    Returns None when force_raw_images is set, as no base file could match.
+    """
+    if CONF.force_raw_images:
+        LOG.warn(_("Not serving base images to other compute nodes, as "
+                   "force_raw_images converts every one of them"))
+        return None
+    server = wsgi.Server('image_peer', ImagePeerApp(base_dir),
+                         host=CONF.libvirt_image_peer_listen,
+                         port=CONF.libvirt_image_peer_port)
+    server.start()
+    return server
+
+
+def _fetch_from_peer(peer, image_id, checksum, path):
+    host, _sep, port = peer.rpartition(':')
+    conn = httplib.HTTPConnection(host, int(port), timeout=PEER_TIMEOUT)
+    try:
+        conn.request('GET', '/images/%s' % urllib.quote(image_id),
+                     headers={'X-Image-Checksum': checksum})
+        resp = conn.getresponse()
+        if resp.status != httplib.OK:
+            return False
+
+        md5 = hashlib.md5()
+        with open(path, 'wb') as image_file:
+            for chunk in iter(lambda: resp.read(CHUNK_SIZE), ''):
+                md5.update(chunk)
+                image_file.write(chunk)
+        if md5.hexdigest() == checksum:
+            return True
+        LOG.warn(_("Image %(image_id)s from %(peer)s does not match its "
+                   "checksum"), locals())
+    except (socket.error, httplib.HTTPException) as e:
+        LOG.warn(_("Failed to fetch image %(image_id)s from %(peer)s: "
+                   "%(e)s"), locals())
+    finally:
+        conn.close()
+    utils.delete_if_exists(path)
+    return False
+
+
+def fetch_to_raw(context, image_href, path):
+    """Fetch an image from a peer to path, like images.fetch_to_raw.
+
+    Returns False if no peer has the image.
+    """
+    if not CONF.libvirt_image_peers or CONF.force_raw_images:
+        return False
+    (image_service, image_id) = glance.get_remote_image_service(context,
+                                                                image_href)
+    checksum = image_service.show(context, image_id).get('checksum')
+    if not checksum:
+        return False
+
+    # Not .part, which holds what was downloaded from glance so far
+    path_tmp = "%s.peer" % path
+    peers = list(CONF.libvirt_image_peers)
+    random.shuffle(peers)
+    for peer in peers:
+        # Base files are named after the image ref they were fetched by
+        if _fetch_from_peer(peer, image_href, checksum, path_tmp):
+            LOG.info(_("Fetched image %(image_href)s from %(peer)s"),
+                     locals())
+            images.move_to_raw(image_href, path_tmp, path)
+            return True
+    return False
@@ -28,6 +28,7 @@ from nova.openstack.common import cfg
 from nova.openstack.common import log as logging
 from nova import utils
 from nova.virt import images
+from nova.virt.libvirt import imagepeer
 
 CONF = cfg.CONF
 LOG = logging.getLogger(__name__)
@@ -466,5 +467,6 @@ def get_fs_info(path):
 
 
 def fetch_image(context, target, image_id, user_id, project_id):
-    """Grab image."""
-    images.fetch_to_raw(context, image_id, target, user_id, project_id)
+    """Grab image, from another compute node if one has it."""
+    if not imagepeer.fetch_to_raw(context, image_id, target):
+        images.fetch_to_raw(context, image_id, target, user_id, project_id)
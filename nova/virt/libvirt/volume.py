@@ -22,7 +22,6 @@ import time
 
 from nova import exception
 from nova.openstack.common import cfg
-from nova.openstack.common import lockutils
 from nova.openstack.common import log as logging
 from nova import utils
 from nova.virt.libvirt import config as vconfig
@@ -138,7 +137,7 @@ class LibvirtISCSIVolumeDriver(LibvirtVolumeDriver):
                          '-v', property_value)
         return self._run_iscsiadm(iscsi_properties, iscsi_command, **kwargs)
 
-    @lockutils.synchronized('connect_volume', 'nova-')
+    @utils.synchronized('connect_volume')
     def connect_volume(self, connection_info, mount_device):
         """Attach the volume to instance_name."""
         iscsi_properties = connection_info['data']
@@ -208,7 +207,7 @@ class LibvirtISCSIVolumeDriver(LibvirtVolumeDriver):
         sup = super(LibvirtISCSIVolumeDriver, self)
         return sup.connect_volume(connection_info, mount_device)
 
-    @lockutils.synchronized('connect_volume', 'nova-')
+    @utils.synchronized('connect_volume')
     def disconnect_volume(self, connection_info, mount_device):
         """Detach the volume from instance_name."""
         sup = super(LibvirtISCSIVolumeDriver, self)
@@ -55,6 +55,23 @@ def ssh_connect(connection):
         raise exception.PowerVMConnectionFailed()
 
 
+def check_connection(ssh, connection):
+    """Method to check that an ssh connection is still usable.
+
+    :param ssh: an existing paramiko.SSHClient, or None.
+    :param connection: a Connection object to reconnect with.
+    :returns: paramiko.SSHClient -- ssh if it is still active, otherwise
+              a new connection.
+    :raises: PowerVMConnectionFailed
+    """
+    transport = ssh.get_transport() if ssh is not None else None
+    if transport is None or not transport.is_active():
+        if ssh is not None:
+            LOG.debug(_('Connection to PowerVM manager lost, reconnecting'))
+        ssh = ssh_connect(connection)
+    return ssh
+
+
 def ssh_command_as_root(ssh_connection, cmd, check_exit_code=True):
     """Method to execute remote command as root.
 
@@ -52,6 +52,10 @@ powervm_opts = [
     cfg.StrOpt('powervm_img_local_path',
                default=None,
                help='Local directory to download glance images to'),
+    cfg.IntOpt('powervm_host_stats_ttl',
+               default=30,
+               help='Number of seconds PowerVM host stats are cached for '
+                    'before they are queried from the manager again'),
     ]
 
 CONF = cfg.CONF
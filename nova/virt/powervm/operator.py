@@ -17,6 +17,7 @@
 import decimal
 import re
 import time
+import uuid
 
 from nova import exception as nova_exception
 from nova import utils
@@ -63,6 +64,7 @@ class PowerVMOperator(object):
         self._operator = get_powervm_operator()
         self._disk_adapter = get_powervm_disk_adapter()
         self._host_stats = {}
+        self._host_stats_time = 0
         self._update_host_stats()
 
     def get_info(self, instance_name):
@@ -131,20 +133,26 @@ class PowerVMOperator(object):
                'local_gb_used': local_gb_used,
                'hypervisor_type': data['hypervisor_type'],
                'hypervisor_version': data['hypervisor_version'],
-               'hypervisor_hostname': self._operator.get_hostname(),
+               'hypervisor_hostname': data['hypervisor_hostname'],
                'cpu_info': ','.join(data['cpu_info']),
                'disk_available_least': data['disk_total']}
         return dic
 
     def get_host_stats(self, refresh=False):
-        """Return currently known host stats."""
-        if refresh:
+        """Return currently known host stats.
+
+        Stats older than powervm_host_stats_ttl seconds are refreshed
+        even when refresh is False.
+        """
+        age = time.time() - self._host_stats_time
+        if refresh or age > CONF.powervm_host_stats_ttl:
             self._update_host_stats()
         return self._host_stats
 
     def _update_host_stats(self):
-        memory_info = self._operator.get_memory_info()
-        cpu_info = self._operator.get_cpu_info()
+        resources = self._operator.get_host_resources()
+        memory_info = resources['memory_info']
+        cpu_info = resources['cpu_info']
 
         # Note: disk avail information is not accurate. The value
         # is a sum of all Volume Groups and the result cannot
@@ -152,7 +160,7 @@ class PowerVMOperator(object):
         # VGs both 10G, the avail disk will be 20G however,
         # a 15G image does not fit in any VG. This can be improved
         # later on.
-        disk_info = self._operator.get_disk_info()
+        disk_info = resources['disk_info']
 
         data = {}
         data['vcpus'] = cpu_info['total_procs']
@@ -165,10 +173,11 @@ class PowerVMOperator(object):
         data['host_memory_free'] = memory_info['avail_mem']
         data['hypervisor_type'] = constants.POWERVM_HYPERVISOR_TYPE
         data['hypervisor_version'] = constants.POWERVM_HYPERVISOR_VERSION
-        data['hypervisor_hostname'] = self._operator.get_hostname()
+        data['hypervisor_hostname'] = resources['hostname']
         data['extres'] = ''
 
         self._host_stats = data
+        self._host_stats_time = time.time()
 
     def spawn(self, context, instance, image_id):
         def _create_lpar_instance(instance):
@@ -360,8 +369,8 @@ class BaseOperator(object):
         self.connection_data = connection
 
     def _set_connection(self):
-        if self._connection is None:
-            self._connection = common.ssh_connect(self.connection_data)
+        self._connection = common.check_connection(self._connection,
+                                                   self.connection_data)
 
     def get_lpar(self, instance_name, resource_type='lpar'):
         """Return a LPAR object by its instance name.
@@ -508,9 +517,14 @@ class BaseOperator(object):
 
         :returns: tuple - memory info (total_mem, avail_mem)
         """
-        cmd = self.command.lshwres(
+        return self._parse_memory_info(self.run_command(
+                self._memory_info_command()))
+
+    def _memory_info_command(self):
+        return self.command.lshwres(
             '-r mem --level sys -F configurable_sys_mem,curr_avail_sys_mem')
-        output = self.run_command(cmd)
+
+    def _parse_memory_info(self, output):
         total_mem, avail_mem = output[0].split(',')
         return {'total_mem': int(total_mem),
                 'avail_mem': int(avail_mem)}
@@ -520,10 +534,15 @@ class BaseOperator(object):
 
         :returns: tuple - cpu info (total_procs, avail_procs)
         """
-        cmd = self.command.lshwres(
+        return self._parse_cpu_info(self.run_command(
+                self._cpu_info_command()))
+
+    def _cpu_info_command(self):
+        return self.command.lshwres(
             '-r proc --level sys -F '
             'configurable_sys_proc_units,curr_avail_sys_proc_units')
-        output = self.run_command(cmd)
+
+    def _parse_cpu_info(self, output):
         total_procs, avail_procs = output[0].split(',')
         return {'total_procs': float(total_procs),
                 'avail_procs': float(avail_procs)}
@@ -533,12 +552,15 @@ class BaseOperator(object):
 
         :returns: tuple - disk info (disk_total, disk_used, disk_avail)
         """
-        vgs = self.run_command(self.command.lsvg())
+        return self._get_disk_info(self.run_command(self.command.lsvg()))
+
+    def _get_disk_info(self, vgs):
+        """Get the disk usage of the volume groups given."""
+        outputs = self.run_commands(
+                [self.command.lsvg('%s -field totalpps usedpps freepps -fmt :'
+                                   % vg) for vg in vgs])
         (disk_total, disk_used, disk_avail) = [0, 0, 0]
-        for vg in vgs:
-            cmd = self.command.lsvg('%s -field totalpps usedpps freepps -fmt :'
-                                    % vg)
-            output = self.run_command(cmd)
+        for output in outputs:
             # Output example:
             # 1271 (10168 megabytes):0 (0 megabytes):1271 (10168 megabytes)
             (d_total, d_used, d_avail) = re.findall(r'(\d+) megabytes',
@@ -551,6 +573,23 @@ class BaseOperator(object):
                 'disk_used': disk_used,
                 'disk_avail': disk_avail}
 
+    def get_host_resources(self):
+        """Get the memory, CPU and disk info and the hostname.
+
+        The queries are batched, so this takes two round trips to the
+        manager however many volume groups there are.
+
+        :returns: dict -- with memory_info, cpu_info and disk_info dicts
+                  like the get_*_info methods return, and the hostname.
+        """
+        mem_output, cpu_output, vgs, hostname_output = self.run_commands(
+                [self._memory_info_command(), self._cpu_info_command(),
+                 self.command.lsvg(), self.command.hostname()])
+        return {'memory_info': self._parse_memory_info(mem_output),
+                'cpu_info': self._parse_cpu_info(cpu_output),
+                'disk_info': self._get_disk_info(vgs),
+                'hostname': hostname_output[0]}
+
     def run_command(self, cmd, check_exit_code=True):
         """Run a remote command using an active ssh connection.
 
@@ -561,6 +600,52 @@ class BaseOperator(object):
                                            check_exit_code=check_exit_code)
         return stdout.strip().splitlines()
 
+    def run_commands(self, cmds, check_exit_code=True):
+        """Run several remote commands in a single ssh invocation.
+
+        The commands are run one after the other by one remote shell,
+        each followed by an echo of a delimiter and its exit status, and
+        the output is split back up at the delimiters. A failing command
+        doesn't stop the ones after it, so this is meant for queries.
+
+        :param cmds: List of command strings.
+        :returns: list -- the output lines of each command.
+        :raises: nova.exception.ProcessExecutionError
+        """
+        if not cmds:
+            return []
+        delimiter = 'END-%s' % uuid.uuid4().hex
+        script = '; '.join('%s; echo "%s $?"' % (cmd, delimiter)
+                           for cmd in cmds)
+        self._set_connection()
+        stdout, stderr = utils.ssh_execute(self._connection, script,
+                                           check_exit_code=False)
+
+        outputs = []
+        lines = []
+        for line in stdout.splitlines():
+            # Output without a trailing newline runs into the delimiter
+            text, sep, exit_status = line.partition(delimiter + ' ')
+            if not sep:
+                lines.append(line)
+                continue
+            if text:
+                lines.append(text)
+            cmd = cmds[len(outputs)]
+            if check_exit_code and int(exit_status) != 0:
+                raise nova_exception.ProcessExecutionError(
+                        exit_code=int(exit_status), stdout='\n'.join(lines),
+                        stderr=stderr, cmd=cmd)
+            outputs.append('\n'.join(lines).strip().splitlines())
+            lines = []
+
+        if len(outputs) != len(cmds):
+            raise nova_exception.ProcessExecutionError(
+                    stdout=stdout, stderr=stderr, cmd=cmds[len(outputs)],
+                    description=_('Remote shell exited before running all '
+                                  'commands'))
+        return outputs
+
     def run_command_as_root(self, command, check_exit_code=True):
         """Run a remote command as root using an active ssh connection.
 
@@ -44,6 +44,7 @@ from nova.virt import driver
 from nova.virt.vmwareapi import error_util
 from nova.virt.vmwareapi import vim
 from nova.virt.vmwareapi import vim_util
+from nova.virt.vmwareapi import vm_cache
 from nova.virt.vmwareapi import vmops
 
 
@@ -215,6 +216,8 @@ class VMWareAPISession(object):
     the calls made to the host.
     """
 
+    vm_cache = None
+
     def __init__(self, host_ip, host_username, host_password,
                  api_retry_count, scheme="https"):
         self._host_ip = host_ip
@@ -225,6 +228,9 @@ class VMWareAPISession(object):
         self._session_id = None
         self.vim = None
         self._create_session()
+        if CONF.vmwareapi_use_vm_cache:
+            self.vm_cache = vm_cache.VMCache(self)
+            self.vm_cache.start()
 
     def _get_vim_object(self):
         """Create the VIM Object instance."""
@@ -301,7 +307,12 @@ class VMWareAPISession(object):
                 for method_elem in method.split("."):
                     temp_module = getattr(temp_module, method_elem)
 
-                return temp_module(*args, **kwargs)
+                try:
+                    return temp_module(*args, **kwargs)
+                finally:
+                    if (self.vm_cache is not None and
+                            self._is_vim_object(module) and args):
+                        self.vm_cache.invalidate(args[0])
             except error_util.VimFaultException, excep:
                 # If it is a Session Fault Exception, it may point
                 # to a session gone bad. So we try re-creating a session
@@ -379,6 +390,11 @@ class VMWareAPISession(object):
             elif task_info.state == 'success':
                 LOG.debug(_("Task [%(task_name)s] %(task_ref)s "
                             "status: success") % locals())
+                # The task has changed its VM since the call that started
+                # it returned, so reads have to skip the cache again.
+                if self.vm_cache is not None:
+                    self.vm_cache.invalidate(getattr(task_info, 'entity',
+                                                     None))
                 done.send("success")
             else:
                 error_info = str(task_info.error.localizedMessage)
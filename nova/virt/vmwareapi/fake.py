@@ -457,6 +457,7 @@ class FakeVim(object):
         contents and the cookies for the session.
         """
         self._session = None
+        self._collectors = {}
         self.client = DataObject()
         self.client.factory = FakeFactory()
 
@@ -647,6 +648,65 @@ class FakeVim(object):
                 continue
         return lst_ret_objs
 
+    def _create_property_collector(self, method, *args, **kwargs):
+        """Creates a property collector with no filters."""
+        collector = "PropCollector-%s" % uuid.uuid4()
+        self._collectors[collector] = {'filters': [], 'versions': {'': {}}}
+        return collector
+
+    def _create_filter(self, method, *args, **kwargs):
+        """Adds a filter to a property collector."""
+        self._collectors[args[0]]['filters'].append(kwargs.get("spec"))
+        return str(uuid.uuid4())
+
+    def _wait_for_updates_ex(self, method, *args, **kwargs):
+        """
+        Returns the changes to the filtered objects since the version
+        given, by comparing against the properties returned then. Returns
+        None rather than blocking when nothing has changed.
+        """
+        collector = self._collectors[args[0]]
+        old = collector['versions'][kwargs.get("version") or '']
+        new = {}
+        for spec in collector['filters']:
+            prop_spec = spec.propSet[0]
+            for mdo_ref, mdo in _db_content[prop_spec.type].iteritems():
+                new[mdo_ref] = dict((prop, mdo.get(prop))
+                                    for prop in prop_spec.pathSet)
+
+        object_updates = []
+        for mdo_ref in set(old) | set(new):
+            object_update = DataObject()
+            object_update.obj = mdo_ref
+            object_update.changeSet = []
+            if mdo_ref not in new:
+                object_update.kind = "leave"
+            else:
+                object_update.kind = "modify" if mdo_ref in old else "enter"
+                for name, val in new[mdo_ref].iteritems():
+                    if mdo_ref in old and old[mdo_ref].get(name) == val:
+                        continue
+                    change = DataObject()
+                    change.name = name
+                    change.op = "assign"
+                    change.val = val
+                    object_update.changeSet.append(change)
+                if not object_update.changeSet:
+                    continue
+            object_updates.append(object_update)
+        if not object_updates:
+            return None
+
+        version = str(len(collector['versions']))
+        collector['versions'][version] = new
+        filter_update = DataObject()
+        filter_update.objectSet = object_updates
+        update_set = DataObject()
+        update_set.version = version
+        update_set.filterSet = [filter_update]
+        update_set.truncated = False
+        return update_set
+
     def _add_port_group(self, method, *args, **kwargs):
         """Adds a port group to the host system."""
         _host_sk = _db_content["HostSystem"].keys()[0]
@@ -709,6 +769,15 @@ class FakeVim(object):
         elif attr_name == "RetrieveProperties":
             return lambda *args, **kwargs: self._retrieve_properties(
                                                 attr_name, *args, **kwargs)
+        elif attr_name == "CreatePropertyCollector":
+            return lambda *args, **kwargs: self._create_property_collector(
+                                                attr_name, *args, **kwargs)
+        elif attr_name == "CreateFilter":
+            return lambda *args, **kwargs: self._create_filter(attr_name,
+                                                *args, **kwargs)
+        elif attr_name == "WaitForUpdatesEx":
+            return lambda *args, **kwargs: self._wait_for_updates_ex(
+                                                attr_name, *args, **kwargs)
         elif attr_name == "AcquireCloneTicket":
             return lambda *args, **kwargs: self._just_return()
         elif attr_name == "AddPortGroup":
@@ -146,6 +146,18 @@ def get_object_properties(vim, collector, mobj, type, properties):
     return vim.RetrieveProperties(usecoll, specSet=[property_filter_spec])
 
 
+def get_object_properties_dict(vim, mobj, type, properties):
+    """
+    Gets the properties of the Managed object specified as a dict, or None
+    if there is no such object.
+    """
+    obj_contents = get_object_properties(vim, None, mobj, type, properties)
+    if not obj_contents:
+        return None
+    return dict((prop.name, prop.val)
+                for prop in getattr(obj_contents[0], 'propSet', []))
+
+
 def get_dynamic_property(vim, mobj, type, property_name):
     """Gets a particular property of the Managed Object."""
     obj_content = get_object_properties(vim, None, mobj, type, [property_name])
@@ -0,0 +1,206 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 OpenStack LLC.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Local mirror of the VirtualMachine properties nova reads most.
+
+A PropertyCollector of our own is given a filter over every VM in the
+inventory. The first WaitForUpdatesEx call returns all of them in one
+round trip and a greenthread then keeps waiting for changes, so looking up
+a VM by name or reading its power state doesn't walk the inventory.
+
+A VM passed to a call through the session, or the entity of a task that
+completed, is marked dirty. Reads of dirty VMs go to the server until a
+WaitForUpdatesEx call that started after the change has been applied, so
+nova always reads its own writes.
+"""
+
+from eventlet import greenthread
+
+from nova.openstack.common import cfg
+from nova.openstack.common import log as logging
+from nova.virt.vmwareapi import vim_util
+
+LOG = logging.getLogger(__name__)
+
+vmwareapi_vm_cache_opts = [
+    cfg.BoolOpt('vmwareapi_use_vm_cache',
+                default=False,
+                help='Mirror the names, power states and sizes of all VMs '
+                     'locally, kept current through a PropertyCollector, '
+                     'instead of listing every VM to find one by name. '
+                     'Used only if compute_driver is '
+                     'vmwareapi.VMWareESXDriver.'),
+    cfg.IntOpt('vmwareapi_wait_for_updates_timeout',
+               default=30,
+               help='Number of seconds a WaitForUpdatesEx call waits for '
+                    'property changes before returning'),
+    ]
+
+CONF = cfg.CONF
+CONF.register_opts(vmwareapi_vm_cache_opts)
+
+VM_PROPERTIES = ['name', 'runtime.powerState', 'summary.config.numCpu',
+                 'summary.config.memorySizeMB']
+
+
+class VMCache(object):
+    """Mirror of VM properties kept current by a PropertyCollector."""
+
+    def __init__(self, session):
+        self._session = session
+        self._collector = None
+        self._version = ''
+        # Managed object references and properties, keyed by the string
+        # value of the reference.
+        self._refs = {}
+        self._props = {}
+        self._keys_by_name = {}
+        # Dirty keys mapped to the number of WaitForUpdatesEx rounds
+        # started when they were marked.
+        self._dirty = {}
+        self._rounds = 0
+        self._thread = None
+
+    def start(self):
+        """Fill the cache and start waiting for updates."""
+        self._create_filter()
+        self.refresh(0)
+        self._thread = greenthread.spawn(self._run)
+
+    def stop(self):
+        if self._thread is not None:
+            self._thread.kill()
+            self._thread = None
+
+    def _run(self):
+        while True:
+            try:
+                if self._collector is None:
+                    self._create_filter()
+                self.refresh(CONF.vmwareapi_wait_for_updates_timeout)
+            except Exception:
+                LOG.exception(_('Failed to wait for VM updates, '
+                                'resynchronizing the VM cache'))
+                self._collector = None
+                greenthread.sleep(1)
+
+    def _create_filter(self):
+        vim = self._session._get_vim()
+        client_factory = vim.client.factory
+        service_content = vim.get_service_content()
+        # WaitForUpdatesEx reports changes to the filters of the collector
+        # it is called on, so a collector of our own keeps them apart from
+        # anything else using the session.
+        collector = self._session._call_method(vim,
+                "CreatePropertyCollector", service_content.propertyCollector)
+        object_spec = vim_util.build_object_spec(client_factory,
+                service_content.rootFolder,
+                [vim_util.build_recursive_traversal_spec(client_factory)])
+        property_spec = vim_util.build_property_spec(client_factory,
+                type="VirtualMachine", properties_to_collect=VM_PROPERTIES)
+        filter_spec = vim_util.build_property_filter_spec(client_factory,
+                [property_spec], [object_spec])
+        self._session._call_method(vim, "CreateFilter", collector,
+                                   spec=filter_spec, partialUpdates=False)
+        self._collector = collector
+        self._version = ''
+
+    def refresh(self, timeout):
+        """Wait up to timeout seconds for updates and apply them."""
+        self._rounds += 1
+        started = self._rounds
+        # Without a version every VM is returned, which also catches VMs
+        # removed while we weren't following updates.
+        resync = not self._version
+        seen = set()
+        vim = self._session._get_vim()
+        options = vim.client.factory.create('ns0:WaitOptions')
+        options.maxWaitSeconds = timeout
+        while True:
+            update_set = self._session._call_method(vim, "WaitForUpdatesEx",
+                    self._collector, version=self._version, options=options)
+            if not update_set:
+                break
+            for filter_update in update_set.filterSet:
+                for object_update in filter_update.objectSet:
+                    self._apply(object_update)
+                    seen.add(str(object_update.obj))
+            self._version = update_set.version
+            # Large inventories come in several pieces
+            if not getattr(update_set, 'truncated', False):
+                break
+        if resync:
+            for key in self._props.keys():
+                if key not in seen:
+                    self._remove(key)
+
+        for key, marked in self._dirty.items():
+            if marked < started:
+                del self._dirty[key]
+
+    def _apply(self, object_update):
+        key = str(object_update.obj)
+        if object_update.kind == 'leave':
+            self._remove(key)
+            return
+        props = dict(self._props.get(key, {}))
+        for change in getattr(object_update, 'changeSet', []):
+            if change.op in ('remove', 'indirectRemove'):
+                props.pop(change.name, None)
+            else:
+                props[change.name] = getattr(change, 'val', None)
+        self._remove(key)
+        self._refs[key] = object_update.obj
+        self._props[key] = props
+        self._keys_by_name.setdefault(props.get('name'), set()).add(key)
+
+    def _remove(self, key):
+        old_props = self._props.pop(key, None)
+        self._refs.pop(key, None)
+        if old_props is not None:
+            name = old_props.get('name')
+            keys = self._keys_by_name.get(name, set())
+            keys.discard(key)
+            if not keys:
+                self._keys_by_name.pop(name, None)
+
+    def invalidate(self, ref):
+        """Mark a VM a call may have changed as dirty."""
+        key = str(ref)
+        if key in self._props:
+            self._dirty[key] = self._rounds
+
+    def get_vm_ref(self, name):
+        """Return the ref of the VM with a name.
+
+        Returns None when the server has to be asked, which is when no VM
+        with that name is cached or when one of them is dirty.
+        """
+        keys = self._keys_by_name.get(name)
+        if not keys or any(key in self._dirty for key in keys):
+            return None
+        return self._refs[sorted(keys)[0]]
+
+    def get_properties(self, ref):
+        """Return a dict of the cached properties of a VM.
+
+        Returns None when the server has to be asked.
+        """
+        key = str(ref)
+        if key in self._dirty or key not in self._props:
+            return None
+        return dict(self._props[key])
@@ -680,21 +680,17 @@ class VMWareVMOps(object):
         lst_properties = ["summary.config.numCpu",
                     "summary.config.memorySizeMB",
                     "runtime.powerState"]
-        vm_props = self._session._call_method(vim_util,
-                    "get_object_properties", None, vm_ref, "VirtualMachine",
-                    lst_properties)
+        vm_props = self._get_vm_properties(vm_ref, lst_properties)
         max_mem = None
         pwr_state = None
         num_cpu = None
-        for elem in vm_props:
-            for prop in elem.propSet:
-                if prop.name == "summary.config.numCpu":
-                    num_cpu = int(prop.val)
-                elif prop.name == "summary.config.memorySizeMB":
-                    # In MB, but we want in KB
-                    max_mem = int(prop.val) * 1024
-                elif prop.name == "runtime.powerState":
-                    pwr_state = VMWARE_POWER_STATES[prop.val]
+        if vm_props.get("summary.config.numCpu") is not None:
+            num_cpu = int(vm_props["summary.config.numCpu"])
+        if vm_props.get("summary.config.memorySizeMB") is not None:
+            # In MB, but we want in KB
+            max_mem = int(vm_props["summary.config.memorySizeMB"]) * 1024
+        if vm_props.get("runtime.powerState") is not None:
+            pwr_state = VMWARE_POWER_STATES[vm_props["runtime.powerState"]]
 
         return {'state': pwr_state,
                 'max_mem': max_mem,
@@ -813,8 +809,22 @@ class VMWareVMOps(object):
                     name=ds_path, createParentDirectories=False)
         LOG.debug(_("Created directory with path %s") % ds_path)
 
+    def _get_vm_properties(self, vm_ref, properties):
+        """Get a dict of properties of a VM, from the VM cache if possible."""
+        if self._session.vm_cache is not None:
+            props = self._session.vm_cache.get_properties(vm_ref)
+            if props is not None:
+                return props
+        return self._session._call_method(vim_util,
+                    "get_object_properties_dict", vm_ref, "VirtualMachine",
+                    properties) or {}
+
     def _get_vm_ref_from_the_name(self, vm_name):
         """Get reference to the VM with the name specified."""
+        if self._session.vm_cache is not None:
+            vm_ref = self._session.vm_cache.get_vm_ref(vm_name)
+            if vm_ref is not None:
+                return vm_ref
         vms = self._session._call_method(vim_util, "get_objects",
                     "VirtualMachine", ["name"])
         for vm in vms:
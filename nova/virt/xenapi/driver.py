@@ -53,6 +53,7 @@ from nova.virt import driver
 from nova.virt.xenapi import host
 from nova.virt.xenapi import pool
 from nova.virt.xenapi import pool_states
+from nova.virt.xenapi import record_cache
 from nova.virt.xenapi import vm_utils
 from nova.virt.xenapi import vmops
 from nova.virt.xenapi import volumeops
@@ -299,7 +300,7 @@ class XenAPIDriver(driver.ComputeDriver):
 
     def get_info(self, instance):
         """Return data about VM instance."""
-        return self._vmops.get_info(instance)
+        return self._vmops.get_info(instance, check_cache=True)
 
     def get_diagnostics(self, instance):
         """Return data about VM diagnostics."""
@@ -610,6 +611,8 @@ class XenAPIDriver(driver.ComputeDriver):
 class XenAPISession(object):
     """The session to invoke XenAPI SDK calls."""
 
+    record_cache = None
+
     def __init__(self, url, user, pw, virtapi):
         import XenAPI
         self.XenAPI = XenAPI
@@ -623,6 +626,8 @@ class XenAPISession(object):
         self.product_version, self.product_brand = \
             self._get_product_version_and_brand()
         self._virtapi = virtapi
+        if CONF.xenapi_use_record_cache:
+            self._start_record_cache(url, user, pw, exception)
 
     def _create_first_session(self, url, user, pw, exception):
         try:
@@ -649,6 +654,17 @@ class XenAPISession(object):
                 session.login_with_password(user, pw)
             self._sessions.put(session)
 
+    def _start_record_cache(self, url, user, pw, exception):
+        # event.from blocks its session, so it gets one outside the pool.
+        def login():
+            event_session = self._create_session(url)
+            with timeout.Timeout(CONF.xenapi_login_timeout, exception):
+                event_session.login_with_password(user, pw)
+            return event_session
+
+        self.record_cache = record_cache.RecordCache(self, login)
+        self.record_cache.start()
+
     def _get_host_uuid(self):
         if self.is_slave:
             aggr = self._virtapi.aggregate_get_by_host(
@@ -705,8 +721,12 @@ class XenAPISession(object):
 
     def call_xenapi(self, method, *args):
         """Call the specified XenAPI method on a background thread."""
-        with self._get_session() as session:
-            return session.xenapi_request(method, args)
+        try:
+            with self._get_session() as session:
+                return session.xenapi_request(method, args)
+        finally:
+            if self.record_cache is not None:
+                self.record_cache.invalidate_for_call(method, args)
 
     def call_plugin(self, plugin, fn, args):
         """Call host.call_plugin on a background thread."""
@@ -765,6 +785,15 @@ class XenAPISession(object):
 
         return None
 
+    def get_cached_rec(self, record_type, ref):
+        """Get a record from the record cache, if it is enabled.
+
+        Unlike get_rec this raises if the ref is invalid.
+        """
+        if self.record_cache is not None:
+            return self.record_cache.get_record(record_type, ref)
+        return self.call_xenapi('%s.get_record' % record_type, ref)
+
     def get_all_refs_and_recs(self, record_type):
         """Retrieve all refs and recs for a Xen record type.
 
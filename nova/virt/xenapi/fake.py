@@ -50,6 +50,7 @@
 A fake XenAPI SDK.
 """
 
+import copy
 import pickle
 import random
 import uuid
@@ -68,6 +69,9 @@ _CLASSES = ['host', 'network', 'session', 'pool', 'SR', 'VBD',
 
 _db_content = {}
 
+# Copies of _db_content handed out with event.from tokens.
+_event_snapshots = {}
+
 LOG = logging.getLogger(__name__)
 
 
@@ -80,6 +84,7 @@ def log_db_contents(msg=None):
 def reset():
     for c in _CLASSES:
         _db_content[c] = {}
+    _event_snapshots.clear()
     host = create_host('fake')
     create_vm('fake',
               'Running',
@@ -663,6 +668,35 @@ class SessionBase(object):
                         vif_map, options):
         pass
 
+    def event_from(self, _1, classes, token, timeout):
+        """Return the changes since token without waiting.
+
+        Changes are found by comparing the records with the copy taken when
+        the token was handed out.
+        """
+        tables = [table for table in _CLASSES if table.lower() in classes]
+        old_content = _event_snapshots.get(token, {})
+        events = []
+        for table in tables:
+            old_recs = old_content.get(table, {})
+            for ref, rec in _db_content[table].iteritems():
+                if ref not in old_recs:
+                    operation = 'add'
+                elif old_recs[ref] != rec:
+                    operation = 'mod'
+                else:
+                    continue
+                events.append({'class': table.lower(), 'operation': operation,
+                               'ref': ref, 'snapshot': copy.deepcopy(rec)})
+            for ref in old_recs:
+                if ref not in _db_content[table]:
+                    events.append({'class': table.lower(), 'operation': 'del',
+                                   'ref': ref})
+        new_token = str(len(_event_snapshots) + 1)
+        _event_snapshots[new_token] = copy.deepcopy(
+                dict((table, _db_content[table]) for table in tables))
+        return {'events': events, 'token': new_token, 'valid_ref_counts': {}}
+
     def network_get_all_records_where(self, _1, filter):
         return self.xenapi.network.get_all_records()
 
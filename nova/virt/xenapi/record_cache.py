@@ -0,0 +1,239 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 OpenStack LLC.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Local mirror of xapi VM, VIF, VBD and VDI records.
+
+The mirror is filled with get_all_records and kept current by a greenthread
+waiting on event.from, so read only paths like power state syncs,
+bandwidth polls and diagnostics don't need a round trip to dom0 for every
+instance.
+
+A ref passed to a call that may change it is marked dirty when the call
+returns. Reads of dirty refs go to xapi until an event.from call that
+started after the change has been applied, so nova always reads its own
+writes.
+
+If following events fails, for instance because the session expired or
+xapi restarted, all reads go to xapi until the event session has been
+logged in again and the mirror resynchronized.
+"""
+
+import copy
+
+from eventlet import greenthread
+
+from nova.openstack.common import cfg
+from nova.openstack.common import log as logging
+
+LOG = logging.getLogger(__name__)
+
+xenapi_record_cache_opts = [
+    cfg.BoolOpt('xenapi_use_record_cache',
+                default=False,
+                help='Mirror VM, VIF, VBD and VDI records locally, kept '
+                     'current from the XenAPI event stream, and serve read '
+                     'only lookups from the mirror'),
+    cfg.FloatOpt('xenapi_event_timeout',
+                 default=30.0,
+                 help='Number of seconds an event.from call waits for '
+                      'events before returning'),
+    ]
+
+CONF = cfg.CONF
+CONF.register_opts(xenapi_record_cache_opts)
+
+RECORD_TYPES = ('VM', 'VIF', 'VBD', 'VDI')
+
+# Seconds to wait before retrying after following events failed, doubled
+# on each failure in a row up to the maximum
+RETRY_INTERVAL = 1
+MAX_RETRY_INTERVAL = 60
+
+
+class RecordCache(object):
+    """Mirror of xapi records kept current from the event stream."""
+
+    def __init__(self, session, login):
+        """
+        :param session: the XenAPISession to read records with
+        :param login: returns a newly logged in XenAPI session for events,
+                      which needs one of its own since event.from blocks
+                      it for up to xenapi_event_timeout seconds
+        """
+        self._session = session
+        self._login = login
+        self._event_session = None
+        self._records = dict((record_type, {})
+                             for record_type in RECORD_TYPES)
+        self._record_types = dict((record_type.lower(), record_type)
+                                  for record_type in RECORD_TYPES)
+        self._vm_refs_by_name = {}
+        # Dirty refs mapped to the number of event.from calls started when
+        # they were marked.
+        self._dirty = {}
+        self._rounds = 0
+        self._token = ''
+        # Whether the records are known to be current, which they aren't
+        # until an event.from call without a token has been applied
+        self._in_sync = False
+        self._thread = None
+
+    def start(self):
+        """Fill the cache and start following the event stream."""
+        for record_type in RECORD_TYPES:
+            recs = self._session.call_xenapi('%s.get_all_records' %
+                                             record_type)
+            for ref, rec in recs.iteritems():
+                self._set(record_type, ref, rec)
+        self._thread = greenthread.spawn(self._run)
+
+    def stop(self):
+        if self._thread is not None:
+            self._thread.kill()
+            self._thread = None
+
+    def _run(self):
+        interval = RETRY_INTERVAL
+        while True:
+            try:
+                self.refresh()
+                interval = RETRY_INTERVAL
+            except Exception:
+                LOG.exception(_('Failed to fetch XenAPI events, reading '
+                                'from XenAPI until the record cache is '
+                                'resynchronized'))
+                self._reset()
+                greenthread.sleep(interval)
+                interval = min(interval * 2, MAX_RETRY_INTERVAL)
+
+    def _reset(self):
+        """Stop serving records, and drop the event session."""
+        self._in_sync = False
+        self._token = ''
+        if self._event_session is not None:
+            try:
+                self._event_session.xenapi.session.logout()
+            except Exception:
+                pass
+            self._event_session = None
+
+    def refresh(self):
+        """Wait for one batch of events and apply it to the cache."""
+        if self._event_session is None:
+            self._event_session = self._login()
+        self._rounds += 1
+        started = self._rounds
+        # Calling event.from without a token returns every record, which
+        # also catches records destroyed while we weren't following events.
+        resync = not self._token
+        result = self._event_session.xenapi_request(
+                'event.from', ([t.lower() for t in RECORD_TYPES],
+                               self._token, CONF.xenapi_event_timeout))
+
+        seen = dict((record_type, set()) for record_type in RECORD_TYPES)
+        for event in result['events']:
+            record_type = self._record_types.get(event['class'])
+            if record_type is None:
+                continue
+            ref = event['ref']
+            if event['operation'] == 'del':
+                self._remove(record_type, ref)
+            elif 'snapshot' in event:
+                self._set(record_type, ref, event['snapshot'])
+                seen[record_type].add(ref)
+        if resync:
+            for record_type in RECORD_TYPES:
+                for ref in self._records[record_type].keys():
+                    if ref not in seen[record_type]:
+                        self._remove(record_type, ref)
+        self._token = result['token']
+        if resync:
+            self._in_sync = True
+
+        for ref, marked in self._dirty.items():
+            if marked < started:
+                del self._dirty[ref]
+
+    def _set(self, record_type, ref, rec):
+        if record_type == 'VM':
+            self._remove_vm_name(ref)
+            self._vm_refs_by_name.setdefault(rec.get('name_label'),
+                                             set()).add(ref)
+        self._records[record_type][ref] = rec
+
+    def _remove(self, record_type, ref):
+        if record_type == 'VM':
+            self._remove_vm_name(ref)
+        self._records[record_type].pop(ref, None)
+
+    def _remove_vm_name(self, ref):
+        old_rec = self._records['VM'].get(ref)
+        if old_rec is not None:
+            name_label = old_rec.get('name_label')
+            refs = self._vm_refs_by_name.get(name_label, set())
+            refs.discard(ref)
+            if not refs:
+                self._vm_refs_by_name.pop(name_label, None)
+
+    def invalidate_for_call(self, method, args):
+        """Mark the ref a xapi call may have changed as dirty."""
+        if method.startswith('Async.'):
+            method = method[len('Async.'):]
+        record_type, _sep, call = method.partition('.')
+        if (record_type in self._records and not call.startswith('get_') and
+                args and isinstance(args[0], basestring)):
+            self._dirty[args[0]] = self._rounds
+
+    def get_record(self, record_type, ref):
+        rec = self._records[record_type].get(ref)
+        if not self._in_sync or rec is None or ref in self._dirty:
+            return self._session.call_xenapi('%s.get_record' % record_type,
+                                             ref)
+        return copy.deepcopy(rec)
+
+    def get_all_records(self, record_type):
+        """Return a dict of all records of a type, keyed by ref.
+
+        Records created since the last event was applied may be missing.
+        Returns None when xapi has to be asked, while the cache is being
+        resynchronized.
+        """
+        if not self._in_sync:
+            return None
+        recs = {}
+        for ref in self._records[record_type].keys():
+            if ref in self._dirty:
+                rec = self._session.get_rec(record_type, ref)
+            else:
+                rec = copy.deepcopy(self._records[record_type].get(ref))
+            if rec:
+                recs[ref] = rec
+        return recs
+
+    def get_vm_refs_by_name(self, name_label):
+        """Return the refs of the VMs with a name label.
+
+        Returns None when xapi has to be asked, which is when no VM with
+        that name is cached, when one of them is dirty or while the cache is
+        being resynchronized.
+        """
+        if not self._in_sync:
+            return None
+        refs = self._vm_refs_by_name.get(name_label)
+        if not refs or any(ref in self._dirty for ref in refs):
+            return None
+        return list(refs)
@@ -44,6 +44,7 @@ from nova.openstack.common import excutils
 from nova.openstack.common import log as logging
 from nova import utils
 from nova.virt.disk import api as disk
+from nova.virt.disk import sparse
 from nova.virt.disk.vfs import localfs as vfsimpl
 from nova.virt import driver
 from nova.virt.xenapi import agent
@@ -83,6 +84,11 @@ xenapi_vm_utils_opts = [
                      'resize down (False will use standard dd). This speeds '
                      'up resizes down considerably since large runs of zeros '
                      'won\'t have to be rsynced'),
+    cfg.BoolOpt('xenapi_sparse_copy_direct_io',
+                default=False,
+                help='Open the devices with O_DIRECT during sparse_copy, so '
+                     'a resize down doesn\'t push other data out of the '
+                     'page cache'),
     cfg.IntOpt('xenapi_num_vbd_unplug_retries',
                default=10,
                help='Maximum number of retries to unplug VBD'),
@@ -1343,8 +1349,16 @@ def set_vm_name_label(session, vm_ref, name_label):
 
 
 def list_vms(session):
-    for vm_ref, vm_rec in session.get_all_refs_and_recs('VM'):
-        if (vm_rec["resident_on"] != session.get_xenapi_host() or
+    recs = None
+    if session.record_cache is not None:
+        recs = session.record_cache.get_all_records('VM')
+    if recs is not None:
+        refs_and_recs = recs.items()
+    else:
+        refs_and_recs = session.get_all_refs_and_recs('VM')
+    host_ref = session.get_xenapi_host()
+    for vm_ref, vm_rec in refs_and_recs:
+        if (vm_rec["resident_on"] != host_ref or
             vm_rec["is_a_template"] or vm_rec["is_control_domain"]):
             continue
         else:
@@ -1374,9 +1388,16 @@ def lookup_vm_vdis(session, vm_ref):
     return vdi_refs
 
 
-def lookup(session, name_label):
-    """Look the instance up and return it if available."""
-    vm_refs = session.call_xenapi("VM.get_by_name_label", name_label)
+def lookup(session, name_label, check_cache=False):
+    """Look the instance up and return it if available.
+
+    With check_cache the record cache is used if the session has one.
+    """
+    vm_refs = None
+    if check_cache and session.record_cache is not None:
+        vm_refs = session.record_cache.get_vm_refs_by_name(name_label)
+    if vm_refs is None:
+        vm_refs = session.call_xenapi("VM.get_by_name_label", name_label)
     n = len(vm_refs)
     if n == 0:
         return None
@@ -2046,48 +2067,15 @@ def _resize_part_and_fs(dev, start, old_sectors, new_sectors):
     utils.execute('tune2fs', '-j', partition_path, run_as_root=True)
 
 
-def _sparse_copy(src_path, dst_path, virtual_size, block_size=4096):
+def _sparse_copy(src_path, dst_path, virtual_size):
     """Copy data, skipping long runs of zeros to create a sparse file."""
-    start_time = time.time()
-    EMPTY_BLOCK = '\0' * block_size
-    bytes_read = 0
-    skipped_bytes = 0
-    left = virtual_size
-
-    LOG.debug(_("Starting sparse_copy src=%(src_path)s dst=%(dst_path)s "
-                "virtual_size=%(virtual_size)d block_size=%(block_size)d"),
-              locals())
-
     # NOTE(sirp): we need read/write access to the devices; since we don't have
     # the luxury of shelling out to a sudo'd command, we temporarily take
     # ownership of the devices.
     with utils.temporary_chown(src_path):
         with utils.temporary_chown(dst_path):
-            with open(src_path, "r") as src:
-                with open(dst_path, "w") as dst:
-                    data = src.read(min(block_size, left))
-                    while data:
-                        if data == EMPTY_BLOCK:
-                            dst.seek(block_size, os.SEEK_CUR)
-                            left -= block_size
-                            bytes_read += block_size
-                            skipped_bytes += block_size
-                        else:
-                            dst.write(data)
-                            data_len = len(data)
-                            left -= data_len
-                            bytes_read += data_len
-
-                        if left <= 0:
-                            break
-
-                        data = src.read(min(block_size, left))
-
-    duration = time.time() - start_time
-    compression_pct = float(skipped_bytes) / bytes_read * 100
-
-    LOG.debug(_("Finished sparse_copy in %(duration).2f secs, "
-                "%(compression_pct).2f%% reduction in size"), locals())
+            sparse.copy(src_path, dst_path, virtual_size,
+                        direct_io=CONF.xenapi_sparse_copy_direct_io)
 
 
 def _copy_partition(session, src_ref, dst_ref, partition, virtual_size):
@@ -605,9 +605,10 @@ class VMOps(object):
             self._session.call_xenapi('VM.add_to_VCPUs_params', vm_ref,
                                       'weight', str(vcpu_weight))
 
-    def _get_vm_opaque_ref(self, instance):
+    def _get_vm_opaque_ref(self, instance, check_cache=False):
         """Get xapi OpaqueRef from a db record."""
-        vm_ref = vm_utils.lookup(self._session, instance['name'])
+        vm_ref = vm_utils.lookup(self._session, instance['name'],
+                                 check_cache=check_cache)
         if vm_ref is None:
             raise exception.NotFound(_('Could not find VM with name %s') %
                                      instance['name'])
@@ -1244,21 +1245,24 @@ class VMOps(object):
             LOG.info(_("Automatically hard rebooting"), instance=instance)
             self.compute_api.reboot(ctxt, instance, "HARD")
 
-    def get_info(self, instance, vm_ref=None):
+    def get_info(self, instance, vm_ref=None, check_cache=False):
         """Return data about VM instance."""
-        vm_ref = vm_ref or self._get_vm_opaque_ref(instance)
-        vm_rec = self._session.call_xenapi("VM.get_record", vm_ref)
+        vm_ref = vm_ref or self._get_vm_opaque_ref(instance, check_cache)
+        if check_cache:
+            vm_rec = self._session.get_cached_rec('VM', vm_ref)
+        else:
+            vm_rec = self._session.call_xenapi("VM.get_record", vm_ref)
         return vm_utils.compile_info(vm_rec)
 
     def get_diagnostics(self, instance):
         """Return data about VM diagnostics."""
-        vm_ref = self._get_vm_opaque_ref(instance)
-        vm_rec = self._session.call_xenapi("VM.get_record", vm_ref)
+        vm_ref = self._get_vm_opaque_ref(instance, check_cache=True)
+        vm_rec = self._session.get_cached_rec('VM', vm_ref)
         return vm_utils.compile_diagnostics(vm_rec)
 
     def _get_vif_device_map(self, vm_rec):
         vif_map = {}
-        for vif in [self._session.call_xenapi("VIF.get_record", vrec)
+        for vif in [self._session.get_cached_rec('VIF', vrec)
                     for vrec in vm_rec['VIFs']]:
             vif_map[vif['device']] = vif['MAC']
         return vif_map